@@ -0,0 +1,198 @@
+# agendador.py
+# Agenda a verificação de cada caixa de forma independente: uma fila de prioridade com o próximo horário de
+# cada usuário, intervalo adaptado à taxa de chegada de recibos, jitter para não bater em todas as caixas no
+# mesmo instante, backoff exponencial em erros e um orçamento global de verificações por minuto.
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from observabilidade import metricas
+
+logger = logging.getLogger(__name__)
+
+
+class EstadoCaixa:
+    def __init__(self, id_usuario, intervalo, taxa_recibos):
+        self.id_usuario = id_usuario
+        self.intervalo = intervalo
+        self.taxa_recibos = taxa_recibos  # recibos/segundo, média móvel exponencial
+        self.falhas_consecutivas = 0
+        self.ultima_verificacao = None
+        self.proxima_verificacao = None
+        self.em_execucao = False
+        self.versao = 0  # entradas da fila com versão antiga são ignoradas
+
+
+class OrcamentoVerificacoes:
+    """Balde de fichas: no máximo `por_minuto` verificações por minuto, com rajadas de até ~10s de orçamento.
+    `por_minuto` <= 0 desativa o limite."""
+
+    def __init__(self, por_minuto):
+        self.taxa = por_minuto / 60
+        self.capacidade = max(1.0, por_minuto / 6)
+        self.fichas = self.capacidade
+        self._ultima_reposicao = time.monotonic()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self.fichas = min(self.capacidade, self.fichas + (agora - self._ultima_reposicao) * self.taxa)
+        self._ultima_reposicao = agora
+
+    def consumir(self):
+        if self.taxa <= 0: return True
+        self._repor()
+        if self.fichas < 1: return False
+        self.fichas -= 1
+        return True
+
+    def espera(self):
+        """Segundos até haver uma ficha disponível."""
+        if self.taxa <= 0: return 0.0
+        self._repor()
+        return max(0.0, (1 - self.fichas) / self.taxa)
+
+
+class AgendadorCaixas:
+    """Executa `verificar(id_usuario)` para cada caixa no seu próprio ritmo.
+
+    `verificar` devolve quantos recibos novos encontrou, ou None se a verificação falhou (IMAP/API).
+    O intervalo de cada caixa é `alvo_recibos_por_verificacao / taxa`, limitado a [intervalo_minimo, intervalo_maximo],
+    em que a taxa é uma média móvel dos recibos observados por segundo. Falhas consecutivas adiam a próxima
+    tentativa em intervalo_minimo * 2^falhas (nunca menos que o intervalo normal, nunca mais que backoff_maximo).
+    """
+
+    def __init__(self, verificar, intervalo_inicial, intervalo_minimo, intervalo_maximo, backoff_maximo,
+                 max_concorrentes=1, verificacoes_por_minuto=0, jitter=0.1, alvo_recibos_por_verificacao=1.0, suavizacao=0.3):
+        self._verificar = verificar
+        self.intervalo_minimo = intervalo_minimo
+        self.intervalo_maximo = max(intervalo_maximo, intervalo_minimo)
+        self.intervalo_inicial = min(max(intervalo_inicial, self.intervalo_minimo), self.intervalo_maximo)
+        self.backoff_maximo = backoff_maximo
+        self.max_concorrentes = max_concorrentes
+        self.jitter = jitter
+        self.alvo_recibos_por_verificacao = alvo_recibos_por_verificacao
+        self.suavizacao = suavizacao
+        self._orcamento = OrcamentoVerificacoes(verificacoes_por_minuto)
+        self._caixas = {}
+        self._fila = []  # (proxima_verificacao, sequencia, id_usuario, versao)
+        self._sequencia = itertools.count()
+        self._em_execucao = 0
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+
+    def _com_jitter(self, segundos):
+        return segundos * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _agendar(self, caixa, atraso):
+        caixa.versao += 1
+        caixa.proxima_verificacao = time.monotonic() + atraso
+        heapq.heappush(self._fila, (caixa.proxima_verificacao, next(self._sequencia), caixa.id_usuario, caixa.versao))
+
+    def sincronizar(self, ids_usuarios):
+        """Inclui caixas novas e remove as que saíram da lista. Várias caixas novas de uma vez têm o início
+        espalhado ao longo do intervalo inicial; uma só é verificada na hora."""
+        ids_usuarios = set(ids_usuarios)
+        with self._lock:
+            novas = ids_usuarios - set(self._caixas)
+            janela = self.intervalo_inicial if len(novas) > 1 else 0
+            for id_usuario in novas:
+                caixa = self._caixas[id_usuario] = EstadoCaixa(id_usuario, self.intervalo_inicial, self.alvo_recibos_por_verificacao / self.intervalo_inicial)
+                self._agendar(caixa, random.uniform(0, janela))
+            removidas = set(self._caixas) - ids_usuarios
+            for id_usuario in removidas:
+                del self._caixas[id_usuario]  # a entrada na fila fica órfã e é descartada ao chegar a vez
+        if novas or removidas:
+            logger.info("Agendador: %d caixa(s) incluída(s), %d removida(s), %d no total.", len(novas), len(removidas), len(self._caixas))
+        self._acordar.set()
+
+    def _registrar_sucesso(self, caixa, recibos, inicio):
+        decorrido = inicio - caixa.ultima_verificacao if caixa.ultima_verificacao is not None else caixa.intervalo
+        caixa.ultima_verificacao = inicio
+        taxa_observada = recibos / max(decorrido, 1.0)
+        caixa.taxa_recibos = (1 - self.suavizacao) * caixa.taxa_recibos + self.suavizacao * taxa_observada
+        intervalo = self.alvo_recibos_por_verificacao / caixa.taxa_recibos if caixa.taxa_recibos > 0 else self.intervalo_maximo
+        caixa.intervalo = min(max(intervalo, self.intervalo_minimo), self.intervalo_maximo)
+        caixa.falhas_consecutivas = 0
+        atraso = self._com_jitter(caixa.intervalo)
+        self._agendar(caixa, atraso)
+        metricas.incrementar("agendador", resultado="ok")
+        logger.info("Próxima verificação em %ds (%.2f recibos/h estimados).", atraso, caixa.taxa_recibos * 3600,
+                    extra={"id_usuario": caixa.id_usuario})
+
+    def _registrar_falha(self, caixa):
+        caixa.falhas_consecutivas += 1
+        backoff = min(self.intervalo_minimo * 2 ** caixa.falhas_consecutivas, self.backoff_maximo)
+        atraso = self._com_jitter(max(caixa.intervalo, backoff))
+        self._agendar(caixa, atraso)
+        metricas.incrementar("agendador", resultado="erro")
+        logger.warning("Verificação falhou (%d seguida(s)). Nova tentativa em %ds.", caixa.falhas_consecutivas, atraso,
+                       extra={"id_usuario": caixa.id_usuario})
+
+    def _executar_caixa(self, caixa):
+        inicio = time.monotonic()
+        try:
+            recibos = self._verificar(caixa.id_usuario)
+        except Exception as e:
+            logger.exception("Erro geral no usuário %s: %s", caixa.id_usuario, e)
+            recibos = None
+        with self._lock:
+            caixa.em_execucao = False
+            self._em_execucao -= 1
+            if self._caixas.get(caixa.id_usuario) is caixa:
+                if recibos is None: self._registrar_falha(caixa)
+                else: self._registrar_sucesso(caixa, recibos, inicio)
+        self._acordar.set()
+
+    def _despachar(self, executor):
+        """Dispara as caixas vencidas que cabem na concorrência e no orçamento; devolve quanto esperar (None = até ser acordado)."""
+        with self._lock:
+            while self._fila and self._em_execucao < self.max_concorrentes:
+                proxima, _, id_usuario, versao = self._fila[0]
+                caixa = self._caixas.get(id_usuario)
+                if caixa is None or caixa.versao != versao:
+                    heapq.heappop(self._fila); continue
+                espera = proxima - time.monotonic()
+                if espera > 0:
+                    return espera
+                if not self._orcamento.consumir():
+                    return self._orcamento.espera()
+                heapq.heappop(self._fila)
+                caixa.em_execucao = True
+                self._em_execucao += 1
+                executor.submit(self._executar_caixa, caixa)
+            return None
+
+    def executar(self, parar, listar_caixas=None, intervalo_atualizacao=300):
+        """Laço principal até `parar` ser sinalizado. `listar_caixas()` é chamado a cada `intervalo_atualizacao`
+        segundos para incluir/remover caixas; uma lista vazia é tratada como falha da listagem e ignorada."""
+        proxima_atualizacao = 0.0
+        with ThreadPoolExecutor(max_workers=self.max_concorrentes, thread_name_prefix='caixa') as executor:
+            while not parar.is_set():
+                if listar_caixas is not None and time.monotonic() >= proxima_atualizacao:
+                    ids_usuarios = listar_caixas()
+                    if ids_usuarios: self.sincronizar(ids_usuarios)
+                    proxima_atualizacao = time.monotonic() + intervalo_atualizacao
+                self._acordar.clear()
+                espera = self._despachar(executor)
+                if listar_caixas is not None:
+                    ate_atualizacao = max(0.0, proxima_atualizacao - time.monotonic())
+                    espera = ate_atualizacao if espera is None else min(espera, ate_atualizacao)
+                self._acordar.wait(espera)
+
+    def encerrar(self):
+        self._acordar.set()
+
+    def instantaneo(self):
+        """Estado de cada caixa, para logs e páginas de status."""
+        agora = time.monotonic()
+        with self._lock:
+            return [{"id_usuario": caixa.id_usuario, "intervalo_segundos": round(caixa.intervalo),
+                     "recibos_por_hora": round(caixa.taxa_recibos * 3600, 2), "falhas_consecutivas": caixa.falhas_consecutivas,
+                     "em_execucao": caixa.em_execucao,
+                     "proxima_em_segundos": None if caixa.em_execucao else round(max(0.0, caixa.proxima_verificacao - agora))}
+                    for caixa in self._caixas.values()]
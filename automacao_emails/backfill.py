@@ -0,0 +1,179 @@
+# backfill.py
+# Importação em massa de recibos antigos (mbox, Maildir, diretório de .eml ou intervalo de datas via IMAP).
+# O parse e a extração rodam num pool de processos; o processo principal resolve IDs na API e envia em lote.
+#
+# Exemplos:
+#   python backfill.py --usuario 3 --mbox ~/Takeout/Recibos.mbox
+#   python backfill.py --usuario 3 --eml-dir ./exportados --processos 8
+#   python backfill.py --usuario 3 --imap-desde 2024-07-01 --imap-ate 2025-07-01 --simular
+
+import argparse
+import logging
+import mailbox
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+import email_automation
+import busca_imap
+import extratores
+import mime_stream
+from documento import MensagemParseada
+from observabilidade import configurar_logging, registrar_resumo_metricas
+
+MESES_IMAP = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+TAMANHO_BLOCO = 32  # mensagens por tarefa enviada ao pool (reduz o custo de IPC)
+
+logger = logging.getLogger("backfill")
+
+
+# --- Fontes de mensagens (geradores de bytes RFC822) ---
+def ler_mbox(caminho):
+    caixa = mailbox.mbox(caminho, create=False)
+    try:
+        for chave in caixa.iterkeys():
+            yield caixa.get_bytes(chave)
+    finally:
+        caixa.close()
+
+def ler_maildir(caminho):
+    caixa = mailbox.Maildir(caminho, factory=None, create=False)
+    for chave in caixa.iterkeys():
+        yield caixa.get_bytes(chave)
+
+def ler_diretorio_eml(caminho):
+    for raiz, _, arquivos in os.walk(caminho):
+        for nome in sorted(arquivos):
+            if nome.lower().endswith('.eml'):
+                with open(os.path.join(raiz, nome), 'rb') as arquivo:
+                    yield arquivo.read()
+
+def _data_imap(data_str):
+    data = datetime.strptime(data_str, '%Y-%m-%d')
+    return f"{data.day:02d}-{MESES_IMAP[data.month - 1]}-{data.year}"
+
+def ler_imap_intervalo(id_usuario, desde, ate=None):
+    try:
+        mail, _ = email_automation.conectar_imap_usuario(id_usuario)
+    except email_automation.CredenciaisIndisponiveis:
+        raise SystemExit(f"Não foi possível obter credenciais IMAP para o usuário {id_usuario}.")
+    try:
+        criterio_datas = f"SINCE {_data_imap(desde)}" + (f" BEFORE {_data_imap(ate)}" if ate else "")
+        uids = busca_imap.buscar_uids(mail, busca_imap.montar_criterio_busca(extratores.remetentes_para_busca(), criterio_datas)) or []
+        logger.info("%d mensagem(ns) de remetentes de corrida entre %s e %s.", len(uids), desde, ate or 'hoje')
+        for _, dados_brutos in busca_imap.buscar_mensagens_brutas_em_lote(mail, uids, email_automation.TAMANHO_LOTE_FETCH_IMAP):
+            yield dados_brutos
+    finally:
+        try: mail.logout()
+        except Exception: pass
+
+
+# --- Trabalho executado nos processos do pool ---
+def extrair_de_bytes(dados_brutos):
+    cabecalhos, conteudo_bruto, tipo_conteudo = mime_stream.parse_mensagem_stream(dados_brutos, email_automation.MAX_BYTES_CORPO_EMAIL)
+    remetente, assunto, data_email = email_automation.extrair_dados_email(cabecalhos)
+    if extratores.obter_extrator(remetente) is None or not conteudo_bruto:
+        return None
+    documento = MensagemParseada(conteudo_bruto, tipo_conteudo, remetente, assunto, data_email, cabecalhos.get("Message-ID"))
+    return email_automation.extrair_corrida(documento)
+
+def extrair_bloco(bloco):
+    return [extrair_de_bytes(dados_brutos) for dados_brutos in bloco]
+
+def _blocos(mensagens, tamanho):
+    bloco = []
+    for dados_brutos in mensagens:
+        bloco.append(dados_brutos)
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+# --- Execução ---
+class Progresso:
+    def __init__(self, intervalo_segundos=5):
+        self.inicio = time.monotonic()
+        self.intervalo_segundos = intervalo_segundos
+        self._ultimo_relatorio = self.inicio
+        self.lidas = self.extraidas = self.registradas = 0
+
+    def relatar(self, forcar=False):
+        agora = time.monotonic()
+        if not forcar and agora - self._ultimo_relatorio < self.intervalo_segundos:
+            return
+        self._ultimo_relatorio = agora
+        decorrido = max(agora - self.inicio, 1e-9)
+        logger.info("Progresso: %d e-mails lidos, %d corridas extraídas, %d registradas em %.1fs (%.1f e-mails/s).",
+                    self.lidas, self.extraidas, self.registradas, decorrido, self.lidas / decorrido,
+                    extra={"lidas": self.lidas, "extraidas": self.extraidas, "registradas": self.registradas})
+
+def executar_backfill(mensagens, id_usuario, processos=None, simular=False):
+    progresso = Progresso()
+    processos = processos or os.cpu_count() or 1
+    blocos = _blocos(mensagens, TAMANHO_BLOCO)
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        # Janela limitada de tarefas em andamento: a fonte é consumida aos poucos, sem carregar tudo na memória
+        em_andamento = {}
+        for bloco in blocos:
+            em_andamento[executor.submit(extrair_bloco, bloco)] = len(bloco)
+            if len(em_andamento) < processos * 2:
+                continue
+            concluidas, _ = wait(em_andamento, return_when=FIRST_COMPLETED)
+            for futuro in concluidas:
+                _consumir_resultado(futuro, em_andamento.pop(futuro), id_usuario, simular, progresso)
+        for futuro in list(em_andamento):
+            _consumir_resultado(futuro, em_andamento.pop(futuro), id_usuario, simular, progresso)
+    if not simular:
+        email_automation._buffer_corridas.descarregar()
+    progresso.relatar(forcar=True)
+    return progresso
+
+def _consumir_resultado(futuro, tamanho_bloco, id_usuario, simular, progresso):
+    progresso.lidas += tamanho_bloco
+    try:
+        extracoes = futuro.result()
+    except Exception as e:
+        logger.error("Falha ao processar bloco de %d e-mail(s): %s", tamanho_bloco, e)
+        return
+    for extracao in extracoes:
+        if not extracao: continue
+        progresso.extraidas += 1
+        if simular:
+            print(f"  [SIMULAÇÃO] {extracao['data']} {extracao['remetente']} R$ {extracao['valor']:.2f} ({extracao['descricao_fp']}, {extracao['cartao']})")
+        elif email_automation.registrar_corrida_extraida(extracao, id_usuario):
+            progresso.registradas += 1
+    progresso.relatar()
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa recibos antigos de Uber/99 para a API de gastos.")
+    parser.add_argument('--usuario', required=True, help="ID do usuário dono das corridas")
+    fonte = parser.add_mutually_exclusive_group(required=True)
+    fonte.add_argument('--mbox', help="Arquivo mbox (ex: exportação do Google Takeout)")
+    fonte.add_argument('--maildir', help="Diretório Maildir")
+    fonte.add_argument('--eml-dir', help="Diretório com arquivos .eml (busca recursiva)")
+    fonte.add_argument('--imap-desde', help="Busca via IMAP a partir desta data (AAAA-MM-DD)")
+    parser.add_argument('--imap-ate', help="Data final exclusiva da busca IMAP (AAAA-MM-DD)")
+    parser.add_argument('--processos', type=int, default=None, help="Processos de extração (padrão: número de CPUs)")
+    parser.add_argument('--simular', action='store_true', help="Só extrai e lista as corridas, sem enviar para a API")
+    args = parser.parse_args()
+    configurar_logging(email_automation.LOG_NIVEL, email_automation.LOG_FORMATO)
+
+    if args.mbox: mensagens = ler_mbox(args.mbox)
+    elif args.maildir: mensagens = ler_maildir(args.maildir)
+    elif args.eml_dir: mensagens = ler_diretorio_eml(args.eml_dir)
+    else: mensagens = ler_imap_intervalo(args.usuario, args.imap_desde, args.imap_ate)
+
+    logger.info("Backfill iniciado para o usuário %s%s.", args.usuario, ' (simulação)' if args.simular else '')
+    executar_backfill(mensagens, args.usuario, args.processos, args.simular)
+    if not args.simular:
+        pendentes = email_automation._obter_outbox().contar_pendentes()
+        if pendentes: logger.warning("%d corrida(s) ficaram pendentes no outbox e serão reenviadas pela automação.", pendentes)
+    registrar_resumo_metricas()
+    logger.info("Backfill concluído.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# benchmark.py
+# Benchmark offline do caminho de extração: gera um corpus sintético de recibos, mede cada etapa isolada
+# (parse MIME, cabeçalhos, bandeira/dígitos, valor) e depois o ciclo completo contra um IMAP e uma API
+# falsos locais. Serve para comparar vazão e memória de um commit para outro.
+#
+# Exemplos:
+#   python benchmark.py --mensagens 2000 --json bench_atual.json
+#   python benchmark.py --mensagens 2000 --comparar bench_atual.json
+#   python benchmark.py --latencia-imap-ms 20 --latencia-api-ms 5   # simula a rede até o Gmail/API
+
+import argparse
+import email
+import json
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource  # só existe em sistemas Unix
+except ImportError:
+    resource = None
+
+import corpus_sintetico
+from observabilidade import configurar_logging, metricas
+from servidores_falsos import APIGastosFalsa, ServidorIMAPFalso
+
+ID_USUARIO_BENCHMARK = "1"
+
+
+# --- Medição ---
+def _rss_maximo_bytes():
+    if resource is None: return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux informa em KiB
+
+def _versao_git():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- Etapas isoladas ---
+def _etapas_isoladas(email_automation, corpus):
+    import extratores
+    import mime_stream
+    from documento import MensagemParseada
+
+    brutos = [dados for dados, _ in corpus]
+    parseadas = [mime_stream.parse_mensagem_stream(dados, email_automation.MAX_BYTES_CORPO_EMAIL) for dados in brutos]
+    dados_email = [email_automation.extrair_dados_email(cabecalhos) for cabecalhos, _, _ in parseadas]
+    recibos = [(cabecalhos, conteudo, tipo, dados) for (cabecalhos, conteudo, tipo), dados in zip(parseadas, dados_email)
+               if extratores.obter_extrator(dados[0]) is not None and conteudo]
+
+    def documento(cabecalhos, conteudo, tipo, dados):
+        remetente, assunto, data_email = dados
+        return MensagemParseada(conteudo, tipo, remetente, assunto, data_email, cabecalhos.get("Message-ID"))
+
+    def parse_legado(dados):
+        return email_automation.extrair_conteudo_principal(email.message_from_bytes(dados))
+
+    def inferir_forma_pagamento(item):
+        doc = documento(*item)
+        return email_automation.inferir_forma_pagamento_e_digitos(doc.remetente, doc.conteudo, doc.tipo_conteudo, doc)
+
+    def extrair_valor(item):
+        doc = documento(*item)
+        return extratores.obter_extrator(doc.remetente).extrair_valor(doc)
+
+    # (nome, função aplicada a cada item, itens)
+    return [
+        ("parse MIME (mime_stream)", lambda dados: mime_stream.parse_mensagem_stream(dados, email_automation.MAX_BYTES_CORPO_EMAIL), brutos),
+        ("parse MIME (email + extrair_conteudo_principal)", parse_legado, brutos),
+        ("cabeçalhos (extrair_dados_email)", lambda item: email_automation.extrair_dados_email(item[0]), parseadas),
+        ("bandeira e dígitos (inferir_forma_pagamento_e_digitos)", inferir_forma_pagamento, recibos),
+        ("valor (regex do extrator)", extrair_valor, recibos),
+        ("extração completa (extrair_corrida)", lambda item: email_automation.extrair_corrida(documento(*item)), recibos),
+    ]
+
+def medir_etapas_isoladas(email_automation, corpus, repeticoes):
+    resultados = {}
+    for nome, funcao, itens in _etapas_isoladas(email_automation, corpus):
+        melhor = None
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            for item in itens: funcao(item)
+            decorrido = time.perf_counter() - inicio
+            melhor = decorrido if melhor is None else min(melhor, decorrido)
+        # Passada separada para memória: o tracemalloc deixa o código bem mais lento
+        tracemalloc.start()
+        for item in itens: funcao(item)
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        resultados[nome] = {"itens": len(itens), "segundos": melhor,
+                            "emails_por_segundo": len(itens) / melhor if melhor else None, "pico_memoria_bytes": pico}
+    return resultados
+
+def verificar_extracao(email_automation, corpus):
+    """Compara a extração com o gabarito do corpus. Retorna (corretas, total de recibos, exemplos de divergência)."""
+    import extratores
+    import mime_stream
+    from documento import MensagemParseada
+    corretas, total, divergencias = 0, 0, []
+    for dados, esperado in corpus:
+        if esperado is None: continue
+        total += 1
+        cabecalhos, conteudo, tipo = mime_stream.parse_mensagem_stream(dados, email_automation.MAX_BYTES_CORPO_EMAIL)
+        remetente, assunto, data_email = email_automation.extrair_dados_email(cabecalhos)
+        extracao = None
+        if extratores.obter_extrator(remetente) is not None:
+            extracao = email_automation.extrair_corrida(MensagemParseada(conteudo, tipo, remetente, assunto, data_email, cabecalhos.get("Message-ID")))
+        if extracao and abs(extracao["valor"] - esperado["valor"]) < 0.005 and all(extracao[c] == esperado[c] for c in ("remetente", "cartao", "descricao_fp")):
+            corretas += 1
+        elif len(divergencias) < 3:
+            divergencias.append({"esperado": esperado, "extraido": extracao})
+    return corretas, total, divergencias
+
+
+# --- Ponta a ponta ---
+def medir_ponta_a_ponta(email_automation, corpus, api):
+    # As etapas vêm das próprias métricas do script (observabilidade.metricas), zeradas antes do ciclo
+    metricas.zerar()
+    inicio = time.perf_counter()
+    email_automation.processar_emails_usuario(ID_USUARIO_BENCHMARK)
+    email_automation._buffer_corridas.descarregar()
+    decorrido = time.perf_counter() - inicio
+    instantaneo = metricas.instantaneo()
+    esperadas = sum(1 for _, esperado in corpus if esperado is not None)
+    return {
+        "mensagens": len(corpus), "segundos": decorrido, "emails_por_segundo": len(corpus) / decorrido if decorrido else None,
+        "corridas_esperadas": esperadas, "corridas_recebidas_api": len(api.corridas), "duplicadas_api": api.duplicadas,
+        "requisicoes_api": dict(api.contagem_requisicoes),
+        "etapas": {etapa: {"segundos": dados["soma_segundos"], "chamadas": dados["chamadas"], "erros": dados["erros"], "p95_ms": dados["p95_ms"]}
+                   for etapa, dados in instantaneo["etapas"].items()},
+        "contadores": instantaneo["contadores"],
+    }
+
+
+# --- Relatório ---
+def _mb(valor):
+    return f"{valor / (1024 * 1024):.1f} MB" if valor is not None else "n/d"
+
+def _variacao(atual, anterior):
+    if not atual or not anterior: return ""
+    return f" ({(atual - anterior) / anterior * 100:+.1f}%)"
+
+def imprimir_relatorio(resultado, anterior=None):
+    anterior = anterior or {}
+    anteriores_isoladas = anterior.get("etapas_isoladas", {})
+    print(f"\nCorpus: {resultado['mensagens']} mensagens ({_mb(resultado['bytes_corpus'])}), semente {resultado['semente']}, commit {resultado['versao'] or 'n/d'}")
+    print(f"Extração correta: {resultado['extracao_correta']}/{resultado['recibos']} recibos")
+    print("\nEtapas isoladas (melhor de {} repetições):".format(resultado['repeticoes']))
+    for nome, etapa in resultado["etapas_isoladas"].items():
+        taxa_anterior = anteriores_isoladas.get(nome, {}).get("emails_por_segundo")
+        print(f"  {nome:<58} {etapa['segundos']:8.3f}s  {etapa['emails_por_segundo']:10.0f} e-mails/s{_variacao(etapa['emails_por_segundo'], taxa_anterior)}"
+              f"  pico {_mb(etapa['pico_memoria_bytes'])}")
+    ponta = resultado["ponta_a_ponta"]
+    taxa_anterior = anterior.get("ponta_a_ponta", {}).get("emails_por_segundo")
+    print(f"\nPonta a ponta (IMAP e API falsos): {ponta['segundos']:.3f}s, {ponta['emails_por_segundo']:.0f} e-mails/s{_variacao(ponta['emails_por_segundo'], taxa_anterior)}")
+    print(f"  Corridas na API: {ponta['corridas_recebidas_api']}/{ponta['corridas_esperadas']} (duplicadas: {ponta['duplicadas_api']})")
+    for nome, etapa in sorted(ponta["etapas"].items(), key=lambda item: -item[1]["segundos"]):
+        print(f"  {nome:<58} {etapa['segundos']:8.3f}s  {etapa['chamadas']:6d} chamada(s)  {etapa['erros']:4d} erro(s)  p95 <= {etapa['p95_ms']:.1f} ms")
+    print(f"  Contadores: {ponta['contadores']}")
+    print(f"  Requisições à API: {ponta['requisicoes_api']}")
+    print(f"  Comandos IMAP: {resultado['comandos_imap']}")
+    print(f"\nPico de memória do processo (RSS): {_mb(resultado['rss_maximo_bytes'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline da extração de recibos (corpus sintético, IMAP e API falsos).")
+    parser.add_argument('--mensagens', type=int, default=1000, help="Tamanho do corpus sintético")
+    parser.add_argument('--semente', type=int, default=42, help="Semente do gerador (mesma semente, mesmo corpus)")
+    parser.add_argument('--repeticoes', type=int, default=3, help="Repetições de cada etapa isolada (vale a melhor)")
+    parser.add_argument('--latencia-imap-ms', type=float, default=0, help="Atraso artificial por comando IMAP")
+    parser.add_argument('--latencia-api-ms', type=float, default=0, help="Atraso artificial por requisição à API")
+    parser.add_argument('--json', help="Grava o resultado neste arquivo")
+    parser.add_argument('--comparar', help="Resultado anterior (JSON) para mostrar a variação de vazão")
+    parser.add_argument('--log-nivel', default="WARNING", help="Nível de log do script durante as medições")
+    args = parser.parse_args()
+    configurar_logging(args.log_nivel)
+
+    print(f"Gerando corpus sintético com {args.mensagens} mensagens...")
+    corpus = corpus_sintetico.gerar_corpus(args.mensagens, args.semente)
+    chave = os.urandom(32)
+    imap = ServidorIMAPFalso([dados for dados, _ in corpus], latencia_segundos=args.latencia_imap_ms / 1000).iniciar()
+    api = APIGastosFalsa(chave, ids_usuarios=(int(ID_USUARIO_BENCHMARK),), latencia_segundos=args.latencia_api_ms / 1000).iniciar()
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as diretorio:
+        # A configuração do script é lida do ambiente na importação; o .env local não sobrescreve estes valores
+        os.environ.update({
+            "API_CORRIDAS_ENDPOINT_URL": f"{api.url_base}/corridas",
+            "API_CORRIDAS_LOTE_ENDPOINT_URL": f"{api.url_base}/corridas/lote",
+            "API_APPS_ENDPOINT_URL": f"{api.url_base}/aplicativos",
+            "API_FORMAS_PAGAMENTO_ENDPOINT_URL": f"{api.url_base}/formas-pagamentos",
+            "API_USER_IMAP_CREDS_ENDPOINT_URL_TEMPLATE": f"{api.url_base}/usuarios/{{id_usuario}}/obter-credenciais-imap",
+            "PYTHON_SCRIPT_API_KEY": "benchmark",
+            "TARGET_USER_ID": ID_USUARIO_BENCHMARK,
+            "IMAP_ENCRYPTION_KEY": chave.hex(),
+            "IMAP_HOST": "127.0.0.1", "IMAP_PORTA": str(imap.porta), "IMAP_SSL": "false",
+            "MODO_SYNC": "unseen",
+            "ARQUIVO_OUTBOX": os.path.join(diretorio, "outbox.db"),
+            "ARQUIVO_ESTADO_SYNC": os.path.join(diretorio, "estado_sync.db"),
+        })
+        import email_automation
+
+        print("Verificando a extração contra o gabarito do corpus...")
+        corretas, recibos, divergencias = verificar_extracao(email_automation, corpus)
+        print("Medindo etapas isoladas...")
+        etapas_isoladas = medir_etapas_isoladas(email_automation, corpus, args.repeticoes)
+        print("Medindo o ciclo completo contra o IMAP e a API falsos...")
+        ponta_a_ponta = medir_ponta_a_ponta(email_automation, corpus, api)
+
+    resultado = {
+        "versao": _versao_git(), "mensagens": len(corpus), "semente": args.semente, "repeticoes": args.repeticoes,
+        "bytes_corpus": sum(len(dados) for dados, _ in corpus), "recibos": recibos, "extracao_correta": corretas,
+        "divergencias": divergencias, "etapas_isoladas": etapas_isoladas, "ponta_a_ponta": ponta_a_ponta,
+        "comandos_imap": dict(imap.contagem_comandos), "rss_maximo_bytes": _rss_maximo_bytes(),
+    }
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            anterior = json.load(arquivo)
+    imprimir_relatorio(resultado, anterior)
+    for divergencia in divergencias:
+        print(f"  [DIVERGÊNCIA] {divergencia}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+        print(f"Resultado gravado em {args.json}.")
+    imap.shutdown(); api.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# busca_imap.py
+# Pipeline de busca IMAP: filtro de remetentes no SEARCH do servidor, cabeçalhos em lote
+# e download apenas da parte text/html (ou text/plain) das mensagens relevantes.
+
+import base64
+import email
+import logging
+import quopri
+import re
+
+from observabilidade import metricas
+
+CABECALHOS_BUSCADOS = "FROM SUBJECT DATE MESSAGE-ID"
+
+_TOKEN_REGEX = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"\[\]]+(?:\[[^\]]*\](?:<\d+>)?)?))')
+_LITERAL_REGEX = re.compile(rb'\{(\d+)\}$')
+
+logger = logging.getLogger(__name__)
+
+
+# --- Montagem do critério de busca ---
+def montar_criterio_busca(remetentes, criterio_base="UNSEEN"):
+    # IMAP só tem OR binário: (OR FROM a (OR FROM b FROM c))
+    remetentes = list(remetentes)
+    if not remetentes:
+        return f"({criterio_base})"
+    filtro = f'FROM "{remetentes[-1]}"'
+    for remetente in reversed(remetentes[:-1]):
+        filtro = f'OR FROM "{remetente}" {filtro}'
+    return f"({criterio_base} {filtro})" if criterio_base else f"({filtro})"
+
+@metricas.cronometrar("imap_busca", falhou=lambda uids: uids is None)
+def buscar_uids(mail, criterio):
+    status, dados = mail.uid('SEARCH', None, criterio)
+    if status != "OK":
+        logger.error("Falha no SEARCH IMAP: %s", dados, extra={"criterio": criterio})
+        return None
+    if not dados or not dados[0]:
+        return []
+    return dados[0].split()
+
+def obter_uidvalidity_uidnext(mail, caixa="inbox"):
+    """Lê UIDVALIDITY/UIDNEXT das respostas do SELECT; se ausentes, pergunta via STATUS."""
+    uidvalidity = mail.response('UIDVALIDITY')[1][0]
+    uidnext = mail.response('UIDNEXT')[1][0]
+    if uidvalidity is None or uidnext is None:
+        status, dados = mail.status(caixa, '(UIDVALIDITY UIDNEXT)')
+        if status != "OK" or not dados or not dados[0]:
+            return None, None
+        valores = dict(re.findall(rb'(UIDVALIDITY|UIDNEXT) (\d+)', dados[0]))
+        uidvalidity, uidnext = valores.get(b'UIDVALIDITY'), valores.get(b'UIDNEXT')
+    return (int(uidvalidity) if uidvalidity else None), (int(uidnext) if uidnext else None)
+
+def _em_lotes(itens, tamanho_lote):
+    for i in range(0, len(itens), tamanho_lote):
+        yield itens[i:i + tamanho_lote]
+
+
+# --- Parser das respostas de FETCH ---
+def _segmentos(dados_fetch):
+    # imaplib devolve tuplas (prefixo terminado em {n}, literal) intercaladas com bytes
+    for item in dados_fetch:
+        if isinstance(item, tuple):
+            prefixo, literal = item[0], item[1]
+            yield ('txt', _LITERAL_REGEX.sub(b'', prefixo))
+            yield ('lit', literal)
+        elif isinstance(item, bytes):
+            yield ('txt', b' ' + item)
+
+def _tokens(dados_fetch):
+    for tipo, conteudo in _segmentos(dados_fetch):
+        if tipo == 'lit':
+            yield ('valor', conteudo)
+            continue
+        pos = 0
+        while pos < len(conteudo):
+            m = _TOKEN_REGEX.match(conteudo, pos)
+            if not m or m.end() == pos:
+                break
+            pos = m.end()
+            if m.group(1): yield ('abre', None)
+            elif m.group(2): yield ('fecha', None)
+            elif m.group(3) is not None: yield ('valor', re.sub(rb'\\(.)', rb'\1', m.group(3)))
+            elif m.group(4):
+                atomo = m.group(4)
+                yield ('valor', None if atomo.upper() == b'NIL' else atomo)
+
+def _montar_arvore(tokens):
+    pilha, atual = [], []
+    for tipo, valor in tokens:
+        if tipo == 'abre':
+            pilha.append(atual); atual = []
+        elif tipo == 'fecha':
+            if not pilha: continue
+            lista, atual = atual, pilha.pop()
+            atual.append(lista)
+        else:
+            atual.append(valor)
+    return atual
+
+def parse_resposta_fetch(dados_fetch):
+    """Converte a resposta de um FETCH em lote numa lista de dicts {ITEM: valor}, um por mensagem."""
+    mensagens = []
+    for elemento in _montar_arvore(_tokens(dados_fetch)):
+        if not isinstance(elemento, list):
+            continue  # número de sequência da mensagem
+        itens = {}
+        for i in range(0, len(elemento) - 1, 2):
+            chave = elemento[i]
+            if isinstance(chave, bytes):
+                itens[chave.decode('ascii', errors='replace').upper()] = elemento[i + 1]
+        mensagens.append(itens)
+    return mensagens
+
+def _item_por_prefixo(itens, prefixo):
+    for chave, valor in itens.items():
+        if chave.startswith(prefixo):
+            return valor
+    return None
+
+
+# --- BODYSTRUCTURE ---
+def _texto(valor):
+    return valor.decode('utf-8', errors='replace') if isinstance(valor, bytes) else ''
+
+def _params(lista):
+    params = {}
+    if isinstance(lista, list):
+        for i in range(0, len(lista) - 1, 2):
+            params[_texto(lista[i]).lower()] = _texto(lista[i + 1])
+    return params
+
+def _eh_anexo(estrutura):
+    # A disposição fica entre os campos de extensão; procuramos por ("attachment" (...))
+    for campo in estrutura[7:]:
+        if isinstance(campo, list) and campo and isinstance(campo[0], bytes) and campo[0].lower() == b'attachment':
+            return True
+    return False
+
+def listar_partes(estrutura, prefixo=""):
+    """Percorre um BODYSTRUCTURE e devolve as partes folha com seção, tipo, charset e encoding."""
+    if not isinstance(estrutura, list) or not estrutura:
+        return []
+    if isinstance(estrutura[0], list):
+        partes, indice = [], 1
+        for filho in estrutura:
+            if not isinstance(filho, list): break
+            partes.extend(listar_partes(filho, f"{prefixo}{indice}."))
+            indice += 1
+        return partes
+    if len(estrutura) < 7:
+        return []
+    return [{
+        "secao": prefixo.rstrip('.') or "1",
+        "tipo": f"{_texto(estrutura[0])}/{_texto(estrutura[1])}".lower(),
+        "charset": _params(estrutura[2]).get('charset') or 'utf-8',
+        "encoding": _texto(estrutura[5]).lower(),
+        "tamanho": int(estrutura[6]) if isinstance(estrutura[6], bytes) and estrutura[6].isdigit() else 0,
+        "anexo": _eh_anexo(estrutura),
+    }]
+
+def escolher_parte_principal(estrutura):
+    partes = [p for p in listar_partes(estrutura) if not p["anexo"]]
+    for tipo in ("text/html", "text/plain"):
+        for parte in partes:
+            if parte["tipo"] == tipo:
+                return parte
+    return None
+
+@metricas.cronometrar("parse_mime")
+def decodificar_parte(conteudo, parte):
+    try:
+        if parte["encoding"] == "base64": conteudo = base64.b64decode(conteudo)
+        elif parte["encoding"] == "quoted-printable": conteudo = quopri.decodestring(conteudo)
+        return conteudo.decode(parte["charset"], errors='replace')
+    except (LookupError, ValueError) as e:
+        logger.warning("Erro ao decodificar parte %s: %s", parte['secao'], e)
+        return conteudo.decode('utf-8', errors='replace')
+
+
+# --- Pipeline ---
+def buscar_cabecalhos_em_lote(mail, uids, tamanho_lote=50):
+    """Gera (uid, mensagem só com cabeçalhos, bodystructure) sem baixar corpos nem marcar como lido."""
+    for lote in _em_lotes(uids, tamanho_lote):
+        conjunto = b",".join(lote).decode()
+        with metricas.medir("imap_fetch") as medicao:
+            status, dados = mail.uid('FETCH', conjunto, f"(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({CABECALHOS_BUSCADOS})])")
+            if status != "OK": medicao.erro()
+        if status != "OK":
+            logger.error("Falha ao buscar cabeçalhos do lote: %s", dados, extra={"uids": conjunto})
+            continue
+        for itens in parse_resposta_fetch(dados):
+            uid = itens.get("UID")
+            cabecalhos = _item_por_prefixo(itens, "BODY[HEADER")
+            if not uid or cabecalhos is None:
+                continue
+            yield uid, email.message_from_bytes(cabecalhos), itens.get("BODYSTRUCTURE")
+
+def buscar_partes_em_lote(mail, uid_para_parte, tamanho_lote=50):
+    """Baixa apenas a seção escolhida de cada mensagem, agrupando por seção para um FETCH por lote."""
+    por_secao = {}
+    for uid, parte in uid_para_parte.items():
+        por_secao.setdefault(parte["secao"], []).append(uid)
+    conteudos = {}
+    for secao, uids in por_secao.items():
+        for lote in _em_lotes(uids, tamanho_lote):
+            conjunto = b",".join(lote).decode()
+            with metricas.medir("imap_fetch") as medicao:
+                status, dados = mail.uid('FETCH', conjunto, f"(UID BODY.PEEK[{secao}])")
+                if status != "OK": medicao.erro()
+            if status != "OK":
+                logger.error("Falha ao buscar seção %s do lote: %s", secao, dados, extra={"uids": conjunto})
+                continue
+            for itens in parse_resposta_fetch(dados):
+                uid = itens.get("UID")
+                conteudo = _item_por_prefixo(itens, "BODY[")
+                if uid in uid_para_parte and isinstance(conteudo, bytes):
+                    conteudos[uid] = decodificar_parte(conteudo, uid_para_parte[uid])
+    return conteudos
+
+def buscar_mensagem_bruta(mail, uid):
+    """Bytes RFC822 completos da mensagem (sem marcar como lida), para interpretação via mime_stream."""
+    with metricas.medir("imap_fetch") as medicao:
+        status, dados = mail.uid('FETCH', uid.decode() if isinstance(uid, bytes) else uid, "(BODY.PEEK[])")
+        if status != "OK": medicao.erro()
+    if status != "OK":
+        return None
+    for item in dados:
+        if isinstance(item, tuple):
+            return item[1]
+    return None
+
+def buscar_mensagens_brutas_em_lote(mail, uids, tamanho_lote=50):
+    """Gera (uid, bytes RFC822) das mensagens, em lotes, sem marcar como lidas."""
+    for lote in _em_lotes(uids, tamanho_lote):
+        conjunto = b",".join(lote).decode()
+        with metricas.medir("imap_fetch") as medicao:
+            status, dados = mail.uid('FETCH', conjunto, "(UID BODY.PEEK[])")
+            if status != "OK": medicao.erro()
+        if status != "OK":
+            logger.error("Falha ao buscar mensagens do lote: %s", dados, extra={"uids": conjunto})
+            continue
+        for itens in parse_resposta_fetch(dados):
+            conteudo = _item_por_prefixo(itens, "BODY[")
+            if itens.get("UID") and isinstance(conteudo, bytes):
+                yield itens["UID"], conteudo
+
+def marcar_como_lidas(mail, uids, tamanho_lote=50):
+    for lote in _em_lotes(list(uids), tamanho_lote):
+        with metricas.medir("imap_store"):
+            mail.uid('STORE', b",".join(lote).decode(), '+FLAGS', '(\\Seen)')
@@ -0,0 +1,87 @@
+# cache_resolucao.py
+# Cache em memória (LRU + TTL) para resoluções quase estáticas, como IDs de aplicativos e formas de pagamento.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheResolucao:
+    """LRU limitado com expiração por TTL, cache negativo (valor None) e coalescência de consultas.
+
+    Threads que pedem a mesma chave enquanto outra já está calculando esperam pelo resultado dela
+    em vez de repetir a consulta.
+    """
+
+    def __init__(self, max_itens=1024, ttl_segundos=3600, ttl_negativo_segundos=60):
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        self.ttl_negativo_segundos = ttl_negativo_segundos
+        self._itens = OrderedDict()  # chave -> (valor, expira_em)
+        self._em_andamento = {}      # chave -> threading.Event
+        self._lock = threading.Lock()
+
+    def _buscar(self, chave):
+        # Chamar com o lock adquirido. Retorna (encontrado, valor).
+        item = self._itens.get(chave)
+        if item is None:
+            return False, None
+        if item[1] <= time.monotonic():
+            del self._itens[chave]
+            return False, None
+        self._itens.move_to_end(chave)
+        return True, item[0]
+
+    def obter(self, chave):
+        with self._lock:
+            return self._buscar(chave)
+
+    def definir(self, chave, valor):
+        ttl = self.ttl_negativo_segundos if valor is None else self.ttl_segundos
+        with self._lock:
+            if ttl <= 0:
+                self._itens.pop(chave, None)
+                return
+            self._itens[chave] = (valor, time.monotonic() + ttl)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def invalidar(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def obter_ou_calcular(self, chave, calcular):
+        """Retorna o valor em cache ou executa `calcular()` uma única vez por chave, mesmo sob concorrência.
+
+        Exceções de `calcular` não são cacheadas: propagam para quem calculou e as threads em espera tentam de novo.
+        """
+        while True:
+            with self._lock:
+                encontrado, valor = self._buscar(chave)
+                if encontrado:
+                    return valor
+                evento = self._em_andamento.get(chave)
+                responsavel = evento is None
+                if responsavel:
+                    evento = threading.Event()
+                    self._em_andamento[chave] = evento
+            if not responsavel:
+                evento.wait()
+                continue
+            try:
+                valor = calcular()
+                self.definir(chave, valor)
+                return valor
+            finally:
+                with self._lock:
+                    self._em_andamento.pop(chave, None)
+                evento.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._itens)
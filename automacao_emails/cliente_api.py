@@ -0,0 +1,85 @@
+# cliente_api.py
+# Cliente HTTP da API de gastos: Session com pool de conexões (keep-alive) e retentativas com backoff.
+
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class ClienteAPI:
+    """Reaproveita conexões via requests.Session e repete requisições em erros de conexão/timeout e respostas 5xx.
+
+    O backoff é exponencial com "full jitter": espera aleatória entre 0 e min(backoff_maximo, backoff_base * 2^n).
+    """
+
+    def __init__(self, tentativas=3, backoff_base_segundos=0.5, backoff_maximo_segundos=10,
+                 timeout=(3.05, 10), tamanho_pool=10):
+        self.tentativas = tentativas
+        self.backoff_base_segundos = backoff_base_segundos
+        self.backoff_maximo_segundos = backoff_maximo_segundos
+        self.timeout = timeout
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=tamanho_pool, pool_maxsize=tamanho_pool)
+        self.sessao.mount('http://', adaptador)
+        self.sessao.mount('https://', adaptador)
+
+    def _espera_backoff(self, tentativa):
+        return random.uniform(0, min(self.backoff_maximo_segundos, self.backoff_base_segundos * (2 ** tentativa)))
+
+    def requisitar(self, metodo, url, **kwargs):
+        """Executa a requisição com retentativas. Devolve a última Response (inclusive 5xx) ou
+        propaga a última RequestException de conexão/timeout."""
+        kwargs.setdefault('timeout', self.timeout)
+        for tentativa in range(self.tentativas + 1):
+            ultima_tentativa = tentativa == self.tentativas
+            try:
+                resposta = self.sessao.request(metodo, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if ultima_tentativa: raise
+                logger.warning("%s %s falhou (%s). Tentativa %d/%d.", metodo, url, e.__class__.__name__, tentativa + 1, self.tentativas + 1)
+            else:
+                if resposta.status_code < 500 or ultima_tentativa:
+                    return resposta
+                logger.warning("%s %s respondeu %d. Tentativa %d/%d.", metodo, url, resposta.status_code, tentativa + 1, self.tentativas + 1)
+            time.sleep(self._espera_backoff(tentativa))
+
+    def get(self, url, **kwargs):
+        return self.requisitar('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.requisitar('POST', url, **kwargs)
+
+
+class BufferCorridas:
+    """Acumula corridas extraídas e as envia em lotes, ao atingir `tamanho_lote` ou quando `descarregar()` é chamado."""
+
+    def __init__(self, enviar_lote, tamanho_lote=50):
+        self._enviar_lote = enviar_lote
+        self.tamanho_lote = tamanho_lote
+        self._pendentes = []
+        self._lock = threading.Lock()
+
+    def adicionar(self, dados_corrida):
+        with self._lock:
+            self._pendentes.append(dados_corrida)
+            cheio = len(self._pendentes) >= self.tamanho_lote
+        if cheio:
+            self.descarregar()
+
+    def descarregar(self):
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, []
+        enviadas = 0
+        for i in range(0, len(pendentes), self.tamanho_lote):
+            enviadas += self._enviar_lote(pendentes[i:i + self.tamanho_lote])
+        return enviadas
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pendentes)
@@ -0,0 +1,260 @@
+# coordenacao.py
+# Divide as caixas entre vários workers (processos ou contentores) que compartilham um arquivo SQLite:
+# cada caixa só é processada pelo dono de uma lease renovável. A preferência de dono vem de rendezvous
+# hashing sobre os workers vivos, então a divisão se refaz sozinha quando um worker entra ou para de bater.
+#
+# Status dos workers: python coordenacao.py --arquivo dados/coordenacao.db [--duracao-lease 90] [--leases]
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Batimentos mais antigos que isso são apagados da tabela de workers
+RETENCAO_WORKERS_SEGUNDOS = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+def id_worker_padrao():
+    # Em contentores o hostname já é único por réplica; o pid desambigua vários processos na mesma máquina
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class CoordenadorLeases:
+    """Leases de caixas num SQLite compartilhado.
+
+    Uma lease vale por `duracao_lease_segundos` e precisa ser renovada antes disso; um worker que para de
+    renovar (morreu, travou) perde as caixas para os demais quando as leases expiram. Caixas em uso
+    (dentro de `reservar`) nunca são liberadas no meio da verificação.
+    """
+
+    def __init__(self, caminho_arquivo, id_worker=None, duracao_lease_segundos=90):
+        diretorio = os.path.dirname(caminho_arquivo)
+        if diretorio: os.makedirs(diretorio, exist_ok=True)
+        self.id_worker = id_worker or id_worker_padrao()
+        self.duracao_lease_segundos = duracao_lease_segundos
+        self._conexao = sqlite3.connect(caminho_arquivo, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._mantidas = set()  # caixas (chaves em texto) cuja lease este worker detém
+        self._em_uso = {}
+        self._iniciado_em = time.time()
+        with self._lock, self._conexao:
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("""
+                CREATE TABLE IF NOT EXISTS workers (
+                    id_worker TEXT PRIMARY KEY,
+                    host TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    iniciado_em REAL NOT NULL,
+                    batimento_em REAL NOT NULL,
+                    status TEXT
+                )""")
+            self._conexao.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    id_usuario TEXT PRIMARY KEY,
+                    id_worker TEXT NOT NULL,
+                    adquirida_em REAL NOT NULL,
+                    expira_em REAL NOT NULL
+                )""")
+
+    @contextmanager
+    def _transacao(self):
+        # BEGIN IMMEDIATE trava a escrita já na leitura: dois workers não adquirem a mesma lease
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conexao
+            except BaseException:
+                self._conexao.rollback()
+                raise
+            self._conexao.commit()
+
+    # --- Workers ---
+    def batimento(self, status=None):
+        agora = time.time()
+        with self._transacao() as conexao:
+            conexao.execute(
+                "INSERT INTO workers (id_worker, host, pid, iniciado_em, batimento_em, status) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id_worker) DO UPDATE SET batimento_em = excluded.batimento_em, status = excluded.status",
+                (self.id_worker, socket.gethostname(), os.getpid(), self._iniciado_em, agora, json.dumps(status) if status is not None else None))
+            conexao.execute("DELETE FROM workers WHERE batimento_em < ?", (agora - RETENCAO_WORKERS_SEGUNDOS,))
+
+    def workers_ativos(self):
+        with self._lock:
+            linhas = self._conexao.execute("SELECT id_worker FROM workers WHERE batimento_em >= ? ORDER BY id_worker",
+                                           (time.time() - self.duracao_lease_segundos,)).fetchall()
+        return [linha[0] for linha in linhas]
+
+    @staticmethod
+    def dono_preferido(chave, workers):
+        """Rendezvous hashing: cada caixa vai para o worker de maior hash(worker, caixa). Quando um worker
+        entra ou sai, só as caixas dele mudam de dono."""
+        if not workers: return None
+        return max(workers, key=lambda worker: hashlib.sha1(f"{worker}|{chave}".encode('utf-8')).digest())
+
+    # --- Leases ---
+    def adquirir(self, chave):
+        """Pega (ou renova) a lease se estiver livre, vencida ou já for deste worker."""
+        agora = time.time()
+        with self._transacao() as conexao:
+            linha = conexao.execute("SELECT id_worker, expira_em FROM leases WHERE id_usuario = ?", (chave,)).fetchone()
+            if linha and linha[0] != self.id_worker and linha[1] > agora:
+                adquirida = False
+            else:
+                conexao.execute(
+                    "INSERT INTO leases (id_usuario, id_worker, adquirida_em, expira_em) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(id_usuario) DO UPDATE SET id_worker = excluded.id_worker, expira_em = excluded.expira_em, "
+                    "adquirida_em = CASE WHEN leases.id_worker = excluded.id_worker THEN leases.adquirida_em ELSE excluded.adquirida_em END",
+                    (chave, self.id_worker, agora, agora + self.duracao_lease_segundos))
+                adquirida = True
+            if adquirida: self._mantidas.add(chave)
+            else: self._mantidas.discard(chave)
+        return adquirida
+
+    def renovar(self):
+        """Estende todas as leases deste worker. Leases perdidas (expiraram e outro worker pegou) são esquecidas."""
+        expira_em = time.time() + self.duracao_lease_segundos
+        perdidas = []
+        with self._transacao() as conexao:
+            for chave in list(self._mantidas):
+                cursor = conexao.execute("UPDATE leases SET expira_em = ? WHERE id_usuario = ? AND id_worker = ?", (expira_em, chave, self.id_worker))
+                if cursor.rowcount == 0:
+                    self._mantidas.discard(chave)
+                    perdidas.append(chave)
+        for chave in perdidas:
+            logger.warning("Lease da caixa do usuário %s foi perdida para outro worker.", chave)
+
+    def liberar(self, chave):
+        # A verificação de uso e a remoção acontecem sob o mesmo lock que `reservar` usa para marcar a caixa
+        with self._transacao() as conexao:
+            if self._em_uso.get(chave): return False
+            conexao.execute("DELETE FROM leases WHERE id_usuario = ? AND id_worker = ?", (chave, self.id_worker))
+            self._mantidas.discard(chave)
+        return True
+
+    @contextmanager
+    def reservar(self, id_usuario):
+        """Confirma (renovando) a lease antes de processar a caixa e a mantém presa até o fim do bloco. Devolve False
+        se a caixa está com outro worker."""
+        chave = str(id_usuario)
+        with self._lock:
+            self._em_uso[chave] = self._em_uso.get(chave, 0) + 1
+        try:
+            yield self.adquirir(chave)
+        finally:
+            with self._lock:
+                self._em_uso[chave] -= 1
+                if not self._em_uso[chave]: del self._em_uso[chave]
+
+    def equilibrar(self, ids_usuarios, status=None):
+        """Uma rodada de coordenação: batimento, renovação, aquisição das caixas que cabem a este worker e liberação
+        das que passaram para outro. Retorna os ids (como recebidos) que este worker deve processar."""
+        self.batimento(status)
+        self.renovar()
+        ativos = self.workers_ativos()
+        if self.id_worker not in ativos: ativos.append(self.id_worker)
+        por_chave = {str(id_usuario): id_usuario for id_usuario in ids_usuarios}
+        preferidas = {chave for chave in por_chave if self.dono_preferido(chave, ativos) == self.id_worker}
+        adquiridas = [chave for chave in preferidas - self._mantidas_agora() if self.adquirir(chave)]
+        liberadas = [chave for chave in self._mantidas_agora() - preferidas if self.liberar(chave)]
+        minhas = preferidas & self._mantidas_agora()
+        if adquiridas or liberadas:
+            logger.info("Coordenação: %d worker(s) ativo(s); %d caixa(s) adquirida(s), %d liberada(s), %d com este worker.",
+                        len(ativos), len(adquiridas), len(liberadas), len(minhas))
+        return {por_chave[chave] for chave in minhas}
+
+    def _mantidas_agora(self):
+        with self._lock:
+            return set(self._mantidas)
+
+    def encerrar(self):
+        """Saída limpa: devolve as leases e sai da lista de workers, para os demais assumirem na próxima rodada."""
+        with self._transacao() as conexao:
+            conexao.execute("DELETE FROM leases WHERE id_worker = ?", (self.id_worker,))
+            conexao.execute("DELETE FROM workers WHERE id_worker = ?", (self.id_worker,))
+            self._mantidas.clear()
+        logger.info("Coordenação: worker %s encerrado e leases devolvidas.", self.id_worker)
+
+    def status(self):
+        """Visão por worker: vivo ou não, último batimento, leases válidas e o status que ele publicou."""
+        agora = time.time()
+        with self._lock:
+            workers = self._conexao.execute("SELECT id_worker, host, pid, iniciado_em, batimento_em, status FROM workers ORDER BY id_worker").fetchall()
+            leases = dict(self._conexao.execute("SELECT id_worker, COUNT(*) FROM leases WHERE expira_em > ? GROUP BY id_worker", (agora,)).fetchall())
+        return [{"id_worker": id_worker, "host": host, "pid": pid, "vivo": batimento_em >= agora - self.duracao_lease_segundos,
+                 "iniciado_em": datetime.fromtimestamp(iniciado_em).isoformat(timespec='seconds'),
+                 "batimento_ha_segundos": round(agora - batimento_em, 1), "leases": leases.get(id_worker, 0),
+                 "status": json.loads(status) if status else None}
+                for id_worker, host, pid, iniciado_em, batimento_em, status in workers]
+
+    def leases(self):
+        agora = time.time()
+        with self._lock:
+            linhas = self._conexao.execute("SELECT id_usuario, id_worker, adquirida_em, expira_em FROM leases ORDER BY id_worker, id_usuario").fetchall()
+        return [{"id_usuario": id_usuario, "id_worker": id_worker, "desde": datetime.fromtimestamp(adquirida_em).isoformat(timespec='seconds'),
+                 "expira_em_segundos": round(expira_em - agora, 1)} for id_usuario, id_worker, adquirida_em, expira_em in linhas]
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
+
+
+class ThreadCoordenacao(threading.Thread):
+    """Roda `equilibrar` a cada terço da duração da lease e avisa `ao_mudar(ids)` quando as caixas deste worker mudam.
+
+    A lista de usuários (`listar_usuarios()`) é consultada a cada `intervalo_listagem` segundos; uma lista vazia é
+    tratada como falha da listagem e a anterior continua valendo."""
+
+    def __init__(self, coordenador, listar_usuarios, ao_mudar, intervalo_listagem=300, status=None):
+        super().__init__(name='coordenacao', daemon=True)
+        self.coordenador = coordenador
+        self.listar_usuarios = listar_usuarios
+        self.ao_mudar = ao_mudar
+        self.intervalo_listagem = intervalo_listagem
+        self.status = status
+        self.parar = threading.Event()
+
+    def run(self):
+        ids_usuarios, proxima_listagem, atuais = [], 0.0, None
+        while not self.parar.is_set():
+            try:
+                if time.monotonic() >= proxima_listagem:
+                    ids_usuarios = self.listar_usuarios() or ids_usuarios
+                    proxima_listagem = time.monotonic() + self.intervalo_listagem
+                caixas = self.coordenador.equilibrar(ids_usuarios, self.status() if self.status else None)
+                if caixas != atuais:
+                    self.ao_mudar(caixas)
+                    atuais = caixas
+            except Exception as e:
+                logger.exception("Falha na rodada de coordenação: %s", e)
+            self.parar.wait(self.coordenador.duracao_lease_segundos / 3)
+
+
+def imprimir_status(coordenador, mostrar_leases=False):
+    for worker in coordenador.status():
+        status = worker["status"] or {}
+        resumo = " ".join(f"{chave}={valor}" for chave, valor in status.items())
+        print(f"{worker['id_worker']:<32} {'vivo ' if worker['vivo'] else 'MORTO'} batimento há {worker['batimento_ha_segundos']:>7.1f}s  "
+              f"leases={worker['leases']:<4} desde {worker['iniciado_em']}  {resumo}")
+    if mostrar_leases:
+        for lease in coordenador.leases():
+            print(f"  usuário {lease['id_usuario']:<10} -> {lease['id_worker']:<32} desde {lease['desde']}  expira em {lease['expira_em_segundos']}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Status dos workers que dividem as caixas de e-mail.")
+    parser.add_argument("--arquivo", default=os.getenv('ARQUIVO_COORDENACAO', 'coordenacao.db'), help="SQLite compartilhado (ARQUIVO_COORDENACAO)")
+    parser.add_argument("--duracao-lease", type=int, default=int(os.getenv('COORDENACAO_DURACAO_LEASE_SEGUNDOS', 90)),
+                        help="Mesma COORDENACAO_DURACAO_LEASE_SEGUNDOS dos workers: sem batimento há mais que isso, o worker é dado como morto")
+    parser.add_argument("--leases", action="store_true", help="Lista também a lease de cada caixa")
+    argumentos = parser.parse_args()
+    # Só leitura: o id próprio nunca é gravado porque não há batimento
+    imprimir_status(CoordenadorLeases(argumentos.arquivo, id_worker="status-cli", duracao_lease_segundos=argumentos.duracao_lease), argumentos.leases)
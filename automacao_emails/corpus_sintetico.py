@@ -0,0 +1,161 @@
+# corpus_sintetico.py
+# Gerador determinístico de recibos sintéticos de Uber/99 para o benchmark (sem depender de uma conta real).
+# Cobre os formatos que a extração precisa aguentar: HTML da Uber com `Uber18_p3 total_head`, 99 em texto
+# e em HTML, multipart com imagens inline e PDF anexo, charsets diferentes e cabeçalhos Date fora do padrão.
+
+import base64
+import quopri
+import random
+from email.header import Header
+
+BANDEIRAS = (
+    # (texto no recibo, imagem da bandeira, descrição esperada na extração)
+    ("Visa", "visa_3x.png", "Visa"),
+    ("Mastercard", "mastercard_3x.png", "Mastercard"),
+    ("Cartão de crédito", "card_3x.png", "Cartão de Crédito/Débito"),
+)
+
+# Datas reais de clientes de e-mail: sem dia da semana, fuso nomeado, ano com 2 dígitos, espaços duplos...
+FORMATOS_DATA = (
+    "{dia_semana}, {dia:02d} {mes} {ano} {hora:02d}:{minuto:02d}:{segundo:02d} -0300",
+    "{dia_semana}, {dia} {mes} {ano} {hora:02d}:{minuto:02d}:{segundo:02d} +0000 (UTC)",
+    "{dia:02d} {mes} {ano} {hora:02d}:{minuto:02d}:{segundo:02d} GMT",
+    "{dia_semana},  {dia} {mes} {ano} {hora:02d}:{minuto:02d}:{segundo:02d} -0000",
+    "{dia_semana}, {dia:02d} {mes} {ano_curto:02d} {hora:02d}:{minuto:02d}:{segundo:02d} EST",
+)
+DIAS_SEMANA = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MESES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# Pesos de cada tipo de mensagem no corpus
+TIPOS_MENSAGEM = (
+    ("uber_html", 45),
+    ("uber_html_pdf", 5),
+    ("noventa_e_nove_texto", 20),
+    ("noventa_e_nove_html", 20),
+    ("outro_remetente", 10),
+)
+
+PNG_1X1 = base64.b64decode(b"iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==")
+
+
+def _formatar_valor(valor):
+    return f"{valor:.2f}".replace('.', ',')
+
+def _data_aleatoria(rng):
+    ano, mes, dia = rng.randint(2023, 2025), rng.randint(1, 12), rng.randint(1, 28)
+    campos = dict(dia_semana=rng.choice(DIAS_SEMANA), dia=dia, mes=MESES[mes - 1], ano=ano, ano_curto=ano % 100,
+                  hora=rng.randint(0, 23), minuto=rng.randint(0, 59), segundo=rng.randint(0, 59))
+    return rng.choice(FORMATOS_DATA).format(**campos)
+
+def _codificar(corpo_texto, charset, encoding):
+    dados = corpo_texto.encode(charset, errors='replace') if isinstance(corpo_texto, str) else corpo_texto
+    if encoding == 'base64':
+        return b"\r\n".join(base64.encodebytes(dados).splitlines())
+    if encoding == 'quoted-printable':
+        return quopri.encodestring(dados).replace(b"\n", b"\r\n")
+    return dados
+
+def _parte(tipo, corpo, charset=None, encoding='7bit', cabecalhos_extra=()):
+    content_type = f"{tipo}; charset=\"{charset}\"" if charset else tipo
+    linhas = [f"Content-Type: {content_type}", f"Content-Transfer-Encoding: {encoding}", *cabecalhos_extra]
+    return ("\r\n".join(linhas) + "\r\n\r\n").encode('ascii') + _codificar(corpo, charset or 'ascii', encoding)
+
+def _multipart(subtipo, partes, boundary):
+    corpo = b"".join(b"--" + boundary.encode() + b"\r\n" + parte + b"\r\n" for parte in partes)
+    corpo += b"--" + boundary.encode() + b"--\r\n"
+    return (f"Content-Type: multipart/{subtipo}; boundary=\"{boundary}\"\r\n\r\n").encode('ascii') + corpo
+
+def _mensagem(remetente, assunto, data, message_id, corpo_mime):
+    assunto_codificado = Header(assunto, 'utf-8').encode(linesep="\r\n")
+    cabecalhos = [
+        f"From: {remetente}",
+        "To: passageiro@example.com",
+        f"Subject: {assunto_codificado}",
+        f"Message-ID: <{message_id}>",
+        "MIME-Version: 1.0",
+    ]
+    if data: cabecalhos.insert(3, f"Date: {data}")
+    return ("\r\n".join(cabecalhos) + "\r\n").encode('ascii') + corpo_mime
+
+
+# --- Recibos ---
+def _html_uber(valor, digitos, bandeira, rng):
+    texto_bandeira, imagem_bandeira, _ = bandeira
+    # Recibos reais da Uber têm dezenas de KB de tabelas aninhadas e CSS inline
+    linhas_tarifa = "".join(
+        f'<tr><td class="Uber18_text_p1" style="font-family:\'UberMoveText\',Arial;font-size:14px;color:#000;padding:4px 0">{nome}</td>'
+        f'<td class="Uber18_text_p1" align="right" style="font-size:14px;padding:4px 0">R$ {_formatar_valor(rng.uniform(0.5, 15))}</td></tr>'
+        for nome in ("Tarifa base", "Distância", "Tempo", "Taxa de reserva", "Pedágio", "Ajuste por demanda") * rng.randint(3, 8))
+    return f"""<!DOCTYPE html><html><head><meta http-equiv="Content-Type" content="text/html; charset=utf-8">
+<style type="text/css">.Uber18_p3 {{ font-size: 28px; }} .total_head {{ font-weight: bold; }} @media only screen {{ .t {{ width: 100% }} }}</style>
+<script type="application/ld+json">{{"@context":"http://schema.org","@type":"Order","merchant":"Uber"}}</script></head>
+<body style="margin:0;padding:0"><table class="t" width="100%" cellpadding="0" cellspacing="0" role="presentation">
+<tr><td><img src="cid:logo_uber" alt="Uber" width="80"></td></tr>
+<tr><td>Obrigado por viajar, Passageiro. Esperamos que tenha gostado da sua viagem.</td></tr>
+<tr><td class="Uber18_p3 total_head" align="left">Total</td><td class="Uber18_p3 total_head" align="right">R$ {_formatar_valor(valor)}</td></tr>
+{linhas_tarifa}
+<tr><td>Pagamentos</td></tr>
+<tr><td><img src="https://d1a3f4spazzrp4.cloudfront.net/receipt_v3/{imagem_bandeira}" width="24"> {texto_bandeira} ••••{digitos}</td>
+<td align="right">R$ {_formatar_valor(valor)}</td></tr>
+<tr><td style="font-size:11px;color:#757575">Uber do Brasil Tecnologia Ltda. Av. Brigadeiro Faria Lima, 201 · São Paulo - SP</td></tr>
+</table></body></html>"""
+
+def _texto_uber(valor, digitos, bandeira):
+    return f"Obrigado por viajar.\r\nTotal R$ {_formatar_valor(valor)}\r\nPagamento: {bandeira[0]} ****{digitos}\r\n"
+
+def _texto_99(valor, bandeira):
+    return (f"Olá! Sua corrida com a 99 foi finalizada.\r\n\r\nValor total: R$ {_formatar_valor(valor)}\r\n"
+            f"Forma de pagamento: {bandeira[0]}\r\nAvalie seu motorista no aplicativo. Até a próxima, ótima viagem!\r\n")
+
+def _html_99(valor, bandeira):
+    return (f"<html><head><meta charset=\"windows-1252\"></head><body><div style=\"font-family:Arial\">"
+            f"<h2>Recibo da sua corrida</h2><p>Origem: Rua das Acácias, 120 — Destino: Praça da Sé</p>"
+            f"<p>Valor total: <b>R$ {_formatar_valor(valor)}</b></p><p>Pagamento: {bandeira[0]}</p>"
+            f"<p style=\"color:#999\">Você está recebendo este e-mail porque usou a 99. Não responda.</p></div></body></html>")
+
+def gerar_recibo(indice, rng):
+    """Gera uma mensagem RFC822. Retorna (bytes, esperado), onde `esperado` é None para mensagens que não são
+    recibos ou {'remetente', 'valor', 'cartao', 'descricao_fp'} com o que a extração deve encontrar."""
+    tipo = rng.choices([t for t, _ in TIPOS_MENSAGEM], weights=[p for _, p in TIPOS_MENSAGEM])[0]
+    valor = round(rng.uniform(6, 180), 2)
+    bandeira = rng.choice(BANDEIRAS)
+    digitos = f"{rng.randint(0, 9999):04d}"
+    data = _data_aleatoria(rng)
+    message_id = f"{indice}.{rng.getrandbits(48):x}@bench.local"
+    boundary = f"----=_Part_{indice}_{rng.getrandbits(32)}"
+
+    if tipo in ("uber_html", "uber_html_pdf"):
+        alternativa = _multipart("alternative", [
+            _parte("text/plain", _texto_uber(valor, digitos, bandeira), "utf-8", "quoted-printable"),
+            _parte("text/html", _html_uber(valor, digitos, bandeira, rng), "utf-8", rng.choice(("quoted-printable", "base64"))),
+        ], boundary + "_alt")
+        partes = [alternativa, _parte("image/png", PNG_1X1 * 40, encoding="base64", cabecalhos_extra=(
+            "Content-ID: <logo_uber>", "Content-Disposition: inline; filename=\"logo.png\""))]
+        if tipo == "uber_html_pdf":
+            pdf = b"%PDF-1.4\n" + bytes(rng.getrandbits(8) for _ in range(64 * 1024))
+            partes.append(_parte("application/pdf", pdf, encoding="base64", cabecalhos_extra=(
+                "Content-Disposition: attachment; filename=\"recibo.pdf\"",)))
+        corpo = _multipart("related", partes, boundary)
+        esperado = {"remetente": "noreply@uber.com", "valor": valor, "cartao": digitos, "descricao_fp": bandeira[2]}
+        return _mensagem('"Uber Receipts" <noreply@uber.com>', "Sua viagem de sábado com a Uber", data, message_id, corpo), esperado
+
+    if tipo == "noventa_e_nove_texto":
+        corpo = _parte("text/plain", _texto_99(valor, bandeira), rng.choice(("iso-8859-1", "utf-8")), "quoted-printable")
+        esperado = {"remetente": "voude99@99app.com", "valor": valor, "cartao": "0000", "descricao_fp": bandeira[2]}
+        return _mensagem("99 <voude99@99app.com>", "Recibo da sua corrida 99", data, message_id, corpo), esperado
+
+    if tipo == "noventa_e_nove_html":
+        corpo = _multipart("alternative", [
+            _parte("text/plain", _texto_99(valor, bandeira), "windows-1252", "quoted-printable"),
+            _parte("text/html", _html_99(valor, bandeira), "windows-1252", "quoted-printable"),
+        ], boundary)
+        esperado = {"remetente": "voude99@99app.com", "valor": valor, "cartao": "0000", "descricao_fp": bandeira[2]}
+        return _mensagem("=?utf-8?q?99_T=C3=A1xi?= <voude99@99app.com>", "Recibo — 99", data, message_id, corpo), esperado
+
+    corpo = _parte("text/html", "<html><body>" + "<p>Ofertas da semana: até 50% de desconto!</p>" * 40 + "</body></html>", "utf-8", "base64")
+    return _mensagem("Loja <news@loja.example.com>", "Ofertas imperdíveis", data, message_id, corpo), None
+
+def gerar_corpus(quantidade, semente=42):
+    """Lista de (bytes, esperado) reprodutível: a mesma semente gera sempre o mesmo corpus."""
+    rng = random.Random(semente)
+    return [gerar_recibo(indice, rng) for indice in range(quantidade)]
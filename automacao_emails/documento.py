@@ -0,0 +1,72 @@
+# documento.py
+# Modelo "parse uma vez" de um e-mail: todas as etapas de extração consultam o mesmo objeto,
+# e as visões caras (árvore lxml, texto normalizado) só são construídas se alguém pedir.
+
+import html
+import logging
+import re
+from functools import cached_property
+
+import lxml.html
+from bs4 import BeautifulSoup
+
+_BLOCOS_SEM_TEXTO = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_TAGS = re.compile(r'<[^>]+>')
+_ESPACOS = re.compile(r'\s+')
+logger = logging.getLogger(__name__)
+
+
+class MensagemParseada:
+    def __init__(self, conteudo, tipo_conteudo, remetente="", assunto="", data_email=None, message_id=None):
+        self.conteudo = conteudo or ""    # HTML (ou texto) já decodificado
+        self.tipo_conteudo = tipo_conteudo  # 'html', 'text' ou 'nenhum'
+        self.remetente = remetente
+        self.assunto = assunto
+        self.data_email = data_email
+        self.message_id = message_id
+
+    @property
+    def eh_html(self):
+        return self.tipo_conteudo == 'html'
+
+    @cached_property
+    def arvore(self):
+        """Árvore lxml do HTML, ou None se o conteúdo não for HTML ou não puder ser interpretado."""
+        if not self.eh_html or not self.conteudo.strip():
+            return None
+        try:
+            return lxml.html.fromstring(self.conteudo)
+        except ValueError:
+            # lxml recusa str com declaração de encoding (<?xml encoding=...?>); reparse a partir de bytes
+            try:
+                return lxml.html.fromstring(self.conteudo.encode('utf-8'), parser=lxml.html.HTMLParser(encoding='utf-8'))
+            except Exception as e:
+                logger.warning("Erro lxml ao interpretar HTML: %s", e)
+        except Exception as e:
+            logger.warning("Erro lxml ao interpretar HTML: %s", e)
+        return None
+
+    @cached_property
+    def texto(self):
+        """Texto visível com espaços normalizados (equivalente ao get_text do BeautifulSoup)."""
+        if not self.eh_html:
+            return _ESPACOS.sub(' ', self.conteudo).strip()
+        if self.arvore is not None:
+            partes = self.arvore.xpath('//text()[not(ancestor::script) and not(ancestor::style)]')
+            return _ESPACOS.sub(' ', " ".join(partes)).strip()
+        try:
+            return BeautifulSoup(self.conteudo, 'lxml').get_text(separator=" ", strip=True)
+        except Exception as e:
+            logger.warning("Erro BeautifulSoup ao extrair texto: %s", e)
+            return self.texto_rapido
+
+    @cached_property
+    def texto_rapido(self):
+        """Texto aproximado obtido só com regex (remove tags e decodifica entidades), sem construir árvore."""
+        if not self.eh_html:
+            return self.texto
+        sem_blocos = _BLOCOS_SEM_TEXTO.sub(' ', self.conteudo)
+        return _ESPACOS.sub(' ', html.unescape(_TAGS.sub(' ', sem_blocos))).strip()
+
+    def texto_para_busca(self, rapido=False):
+        return self.texto_rapido if rapido else self.texto
@@ -3,27 +3,45 @@
 import imaplib
 import email
 from email.header import decode_header
-import webbrowser
 import re
 import os
+import logging
 from dotenv import load_dotenv
 import requests
-from bs4 import BeautifulSoup
 from datetime import datetime
-import time 
 import json
+import random
+import threading
+from contextlib import nullcontext
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import padding as sym_padding # Para padding PKCS7
+import busca_imap
+from estado_sync import EstadoSync
+import imap_idle
+from cache_resolucao import CacheResolucao
+from sessoes_imap import GerenciadorSessoesIMAP
+from agendador import AgendadorCaixas
+from coordenacao import CoordenadorLeases, ThreadCoordenacao, id_worker_padrao
+from cliente_api import ClienteAPI, BufferCorridas
+from outbox import Outbox, DrenadorOutbox, gerar_chave_idempotencia, ESTADO_REJEITADO
+import extratores
+from documento import MensagemParseada
+import mime_stream
+from observabilidade import metricas, contexto_log, configurar_logging, iniciar_servidor_metricas, iniciar_dump_periodico, registrar_resumo_metricas, definir_provedor_status
 
 # Carrega variáveis de ambiente do arquivo .env
 load_dotenv()
+logger = logging.getLogger("email_automation")
 
 # --- Configurações ---
-IMAP_HOST = 'imap.gmail.com'
+IMAP_HOST = os.getenv('IMAP_HOST', 'imap.gmail.com')
+IMAP_PORTA = int(os.getenv('IMAP_PORTA', 993))
+IMAP_SSL = os.getenv('IMAP_SSL', 'true').strip().lower() in ('1', 'true', 'sim') # false só para servidores locais (ex: benchmark)
 API_CORRIDAS_ENDPOINT_URL = os.getenv('API_CORRIDAS_ENDPOINT_URL')
 API_APPS_ENDPOINT_URL = os.getenv('API_APPS_ENDPOINT_URL')
 API_FORMAS_PAGAMENTO_ENDPOINT_URL = os.getenv('API_FORMAS_PAGAMENTO_ENDPOINT_URL')
+API_CORRIDAS_LOTE_ENDPOINT_URL = os.getenv('API_CORRIDAS_LOTE_ENDPOINT_URL') # Opcional: envio em lote (POST /api/corridas/lote)
 PYTHON_SCRIPT_API_KEY = os.getenv('PYTHON_SCRIPT_API_KEY')
 
 # Novas configurações para credenciais IMAP por usuário
@@ -31,13 +49,78 @@ TARGET_USER_ID = os.getenv('TARGET_USER_ID')
 API_USER_IMAP_CREDS_ENDPOINT_URL_TEMPLATE = os.getenv('API_USER_IMAP_CREDS_ENDPOINT_URL_TEMPLATE')
 IMAP_ENCRYPTION_KEY_HEX = os.getenv('IMAP_ENCRYPTION_KEY')
 
+# Modo multiusuário: processa todos os usuários com IMAP configurado em um único worker
+MODO_MULTIUSUARIO = os.getenv('MODO_MULTIUSUARIO', 'false').strip().lower() in ('1', 'true', 'sim')
+API_USUARIOS_ENDPOINT_URL = os.getenv('API_USUARIOS_ENDPOINT_URL')
+MAX_USUARIOS_CONCORRENTES = int(os.getenv('MAX_USUARIOS_CONCORRENTES', 8))
+# Vale para o polling e as sessões reaproveitadas; o modo IDLE ignora o limite (uma conexão por caixa)
+MAX_CONEXOES_IMAP_POR_HOST = int(os.getenv('MAX_CONEXOES_IMAP_POR_HOST', 4))
+
 if IMAP_ENCRYPTION_KEY_HEX and len(IMAP_ENCRYPTION_KEY_HEX) == 64:
     ENCRYPTION_KEY = bytes.fromhex(IMAP_ENCRYPTION_KEY_HEX) # Chave de 32 bytes
 else:
-    print("[ERRO FATAL] IMAP_ENCRYPTION_KEY não está definida corretamente no .env ou não tem 32 bytes (64 caracteres hex).")
+    logger.critical("IMAP_ENCRYPTION_KEY não está definida corretamente no .env ou não tem 32 bytes (64 caracteres hex).")
     ENCRYPTION_KEY = None # Ou saia do script
 
-INTERVALO_VERIFICACAO_SEGUNDOS = int(os.getenv('INTERVALO_VERIFICACAO_SEGUNDOS', 300)) 
+INTERVALO_VERIFICACAO_SEGUNDOS = int(os.getenv('INTERVALO_VERIFICACAO_SEGUNDOS', 300)) # Intervalo inicial de cada caixa e de revisão da lista de usuários
+TAMANHO_LOTE_FETCH_IMAP = int(os.getenv('TAMANHO_LOTE_FETCH_IMAP', 50))
+MAX_BYTES_CORPO_EMAIL = int(os.getenv('MAX_BYTES_CORPO_EMAIL', 2 * 1024 * 1024)) # Partes maiores são ignoradas
+
+# Sincronização: 'unseen' (busca UNSEEN e marca como lido) ou 'incremental' (UID/UIDVALIDITY persistidos)
+MODO_SYNC = os.getenv('MODO_SYNC', 'unseen').strip().lower()
+ARQUIVO_ESTADO_SYNC = os.getenv('ARQUIVO_ESTADO_SYNC', 'estado_sync.db')
+CAIXA_IMAP = 'inbox'
+
+# Modo IDLE: conexão persistente por caixa, acordada por notificações EXISTS do servidor
+MODO_IDLE = os.getenv('MODO_IDLE', 'false').strip().lower() in ('1', 'true', 'sim')
+IDLE_TIMEOUT_SEGUNDOS = int(os.getenv('IDLE_TIMEOUT_SEGUNDOS', 25 * 60)) # RFC 2177: reemitir antes dos 29 min
+IDLE_BACKOFF_INICIAL_SEGUNDOS = int(os.getenv('IDLE_BACKOFF_INICIAL_SEGUNDOS', 5))
+IDLE_BACKOFF_MAXIMO_SEGUNDOS = int(os.getenv('IDLE_BACKOFF_MAXIMO_SEGUNDOS', 600))
+
+# Cliente HTTP da API de gastos (pool de conexões, retentativas e envio em lote)
+API_TIMEOUT_CONEXAO_SEGUNDOS = float(os.getenv('API_TIMEOUT_CONEXAO_SEGUNDOS', 3.05))
+API_TIMEOUT_LEITURA_SEGUNDOS = float(os.getenv('API_TIMEOUT_LEITURA_SEGUNDOS', 10))
+API_TENTATIVAS = int(os.getenv('API_TENTATIVAS', 3))
+API_BACKOFF_BASE_SEGUNDOS = float(os.getenv('API_BACKOFF_BASE_SEGUNDOS', 0.5))
+API_TAMANHO_POOL = int(os.getenv('API_TAMANHO_POOL', 10))
+TAMANHO_LOTE_CORRIDAS = int(os.getenv('TAMANHO_LOTE_CORRIDAS', 50))
+
+# Outbox durável das corridas (gravadas antes do envio, reenviadas em segundo plano até a API confirmar)
+ARQUIVO_OUTBOX = os.getenv('ARQUIVO_OUTBOX', 'outbox.db')
+OUTBOX_INTERVALO_DRENAGEM_SEGUNDOS = int(os.getenv('OUTBOX_INTERVALO_DRENAGEM_SEGUNDOS', 60))
+OUTBOX_MAX_CORRIDAS_POR_SEGUNDO = float(os.getenv('OUTBOX_MAX_CORRIDAS_POR_SEGUNDO', 20))
+OUTBOX_BACKOFF_BASE_SEGUNDOS = int(os.getenv('OUTBOX_BACKOFF_BASE_SEGUNDOS', 30))
+OUTBOX_RETENCAO_DIAS = int(os.getenv('OUTBOX_RETENCAO_DIAS', 30))
+
+# Cache das resoluções de ID (aplicativo/forma de pagamento) feitas na API de gastos
+CACHE_RESOLUCAO_MAX_ITENS = int(os.getenv('CACHE_RESOLUCAO_MAX_ITENS', 1024))
+CACHE_RESOLUCAO_TTL_SEGUNDOS = int(os.getenv('CACHE_RESOLUCAO_TTL_SEGUNDOS', 3600))
+CACHE_RESOLUCAO_TTL_NEGATIVO_SEGUNDOS = int(os.getenv('CACHE_RESOLUCAO_TTL_NEGATIVO_SEGUNDOS', 60))
+
+# Sessões IMAP e credenciais reaproveitadas entre ciclos
+PERSISTIR_SESSOES_IMAP = os.getenv('PERSISTIR_SESSOES_IMAP', 'true').strip().lower() in ('1', 'true', 'sim')
+SESSAO_IMAP_NOOP_APOS_SEGUNDOS = int(os.getenv('SESSAO_IMAP_NOOP_APOS_SEGUNDOS', 60)) # Sessão parada há mais que isso é testada com NOOP
+SESSAO_IMAP_OCIOSA_MAX_SEGUNDOS = int(os.getenv('SESSAO_IMAP_OCIOSA_MAX_SEGUNDOS', 25 * 60)) # Servidores derrubam conexões ociosas (~30 min)
+CREDENCIAIS_TTL_SEGUNDOS = int(os.getenv('CREDENCIAIS_TTL_SEGUNDOS', 3600)) # Login/senha decriptada em memória; renovados antes se o login falhar
+
+# Agendamento por caixa: o intervalo se adapta à taxa de recibos de cada usuário dentro destes limites
+AGENDADOR_INTERVALO_MINIMO_SEGUNDOS = int(os.getenv('AGENDADOR_INTERVALO_MINIMO_SEGUNDOS', 60))
+AGENDADOR_INTERVALO_MAXIMO_SEGUNDOS = int(os.getenv('AGENDADOR_INTERVALO_MAXIMO_SEGUNDOS', 1800))
+AGENDADOR_RECIBOS_POR_VERIFICACAO = float(os.getenv('AGENDADOR_RECIBOS_POR_VERIFICACAO', 1)) # Quantos recibos novos, em média, cada verificação deve encontrar
+AGENDADOR_JITTER = float(os.getenv('AGENDADOR_JITTER', 0.1)) # ±10% em cada intervalo
+AGENDADOR_BACKOFF_MAXIMO_SEGUNDOS = int(os.getenv('AGENDADOR_BACKOFF_MAXIMO_SEGUNDOS', 3600))
+AGENDADOR_VERIFICACOES_POR_MINUTO = float(os.getenv('AGENDADOR_VERIFICACOES_POR_MINUTO', 60)) # Orçamento global; 0 = sem limite
+
+# Vários workers dividindo as caixas: leases num SQLite compartilhado (mesmo volume do outbox e do estado de sync)
+ARQUIVO_COORDENACAO = os.getenv('ARQUIVO_COORDENACAO') # Vazio = worker único, sem coordenação
+COORDENACAO_ID_WORKER = os.getenv('COORDENACAO_ID_WORKER') or id_worker_padrao()
+COORDENACAO_DURACAO_LEASE_SEGUNDOS = int(os.getenv('COORDENACAO_DURACAO_LEASE_SEGUNDOS', 90)) # Renovada a cada 1/3; é o tempo para assumir as caixas de um worker morto
+
+# Logging e métricas por etapa (credenciais, login IMAP, busca, fetch, parse MIME, extração, resolução de IDs, envio)
+LOG_NIVEL = os.getenv('LOG_NIVEL', 'INFO')
+LOG_FORMATO = os.getenv('LOG_FORMATO', 'texto').strip().lower() # 'texto' ou 'json'
+METRICAS_PORTA = int(os.getenv('METRICAS_PORTA', 0)) # 0 desativa o endpoint /metrics
+METRICAS_INTERVALO_DUMP_SEGUNDOS = int(os.getenv('METRICAS_INTERVALO_DUMP_SEGUNDOS', 600)) # 0 desativa o resumo periódico no log
 
 FP_DESCRICAO_VISA = "Visa"
 FP_DESCRICAO_MASTERCARD = "Mastercard"
@@ -50,16 +133,23 @@ BANDEIRA_KEYWORDS_REGEX_MAP = {
     FP_DESCRICAO_MASTERCARD: [r'mastercard', r'master\scard'],
     # ... (outros mapeamentos) ...
 }
+TERMOS_CARTAO_GENERICO = ["cartão de crédito", "cartao de credito", "credit card", "cartão de débito", "cartao de debito", "debit card"]
+
+# Todas as palavras-chave de bandeira compiladas numa única alternação (uma varredura por e-mail)
+_detector_bandeira = extratores.DetectorBandeira(BANDEIRA_KEYWORDS_REGEX_MAP, TERMOS_CARTAO_GENERICO, FP_DESCRICAO_CARTAO_PADRAO)
+
+_cliente_api = ClienteAPI(tentativas=API_TENTATIVAS, backoff_base_segundos=API_BACKOFF_BASE_SEGUNDOS,
+                          timeout=(API_TIMEOUT_CONEXAO_SEGUNDOS, API_TIMEOUT_LEITURA_SEGUNDOS), tamanho_pool=max(API_TAMANHO_POOL, MAX_USUARIOS_CONCORRENTES))
 
 # --- Funções Auxiliares de Criptografia (Compatível com Node.js AES-256-CBC) ---
 def decrypt_imap_password(encrypted_password_with_iv):
     if not encrypted_password_with_iv or not ENCRYPTION_KEY:
-        print("  [DECRYPT] Senha encriptada ou chave de encriptação ausente.")
+        logger.error("Senha encriptada ou chave de encriptação ausente.")
         return None
     try:
         parts = encrypted_password_with_iv.split(':')
         if len(parts) != 2:
-            print("  [DECRYPT] Formato inválido para senha encriptada com IV. Esperado 'iv:textoEncriptado'.")
+            logger.error("Formato inválido para senha encriptada com IV. Esperado 'iv:textoEncriptado'.")
             return None
         
         iv = bytes.fromhex(parts[0])
@@ -76,9 +166,7 @@ def decrypt_imap_password(encrypted_password_with_iv):
         
         return decrypted_bytes.decode('utf-8')
     except Exception as e:
-        print(f"  [DECRYPT] Erro ao decriptar senha IMAP: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erro ao decriptar senha IMAP: %s", e)
         return None
 
 # --- Outras Funções Auxiliares (limpar_texto, decodificar_assunto, etc. - mantidas como antes) ---
@@ -114,14 +202,14 @@ def extrair_dados_email(msg):
         try:
             data_email_obj = email.utils.parsedate_to_datetime(data_email_str)
         except Exception as e:
-            print(f"  [AVISO] Não foi possível parsear a data (tentativa 1): {data_email_str} - Erro: {e}")
+            logger.debug("Não foi possível parsear a data (tentativa 1): %s - Erro: %s", data_email_str, e)
             for fmt in ('%a, %d %b %Y %H:%M:%S %z (%Z)', '%a, %d %b %Y %H:%M:%S %z', '%d %b %Y %H:%M:%S %z'):
                 try:
                     data_email_obj = datetime.strptime(data_email_str, fmt)
-                    print(f"  [INFO] Data parseada com formato alternativo: {fmt}")
+                    logger.debug("Data parseada com formato alternativo: %s", fmt)
                     break
                 except ValueError: continue
-            if not data_email_obj: print(f"  [AVISO] Formato de data não reconhecido: {data_email_str}")
+            if not data_email_obj: logger.warning("Formato de data não reconhecido: %s", data_email_str)
     return remetente_final, assunto, data_email_obj
 
 def extrair_conteudo_principal(msg):
@@ -135,7 +223,7 @@ def extrair_conteudo_principal(msg):
                     charset = part.get_content_charset() or 'utf-8'
                     if ctype == "text/html" and not corpo_html: corpo_html = payload.decode(charset, errors='replace')
                     elif ctype == "text/plain" and not corpo_texto: corpo_texto = payload.decode(charset, errors='replace')
-                except Exception as e: print(f"  [ERRO] ao decodificar parte: {e}")
+                except Exception as e: logger.warning("Erro ao decodificar parte: %s", e)
     else:
         ctype = msg.get_content_type()
         try:
@@ -143,7 +231,7 @@ def extrair_conteudo_principal(msg):
             charset = msg.get_content_charset() or 'utf-8'
             if ctype == "text/html": corpo_html = payload.decode(charset, errors='replace')
             elif ctype == "text/plain": corpo_texto = payload.decode(charset, errors='replace')
-        except Exception as e: print(f"  [ERRO] ao decodificar payload simples: {e}")
+        except Exception as e: logger.warning("Erro ao decodificar payload simples: %s", e)
     if corpo_html and len(corpo_html) > 100: return corpo_html, "html"
     elif corpo_texto: return corpo_texto, "text"
     return "", "nenhum"
@@ -153,252 +241,716 @@ def _get_api_headers():
     if PYTHON_SCRIPT_API_KEY:
         headers['x-api-key'] = PYTHON_SCRIPT_API_KEY
     else:
-        print("[AVISO API] PYTHON_SCRIPT_API_KEY não definida no .env.")
+        logger.warning("PYTHON_SCRIPT_API_KEY não definida no .env.")
     return headers
 
+_cache_resolucao_ids = CacheResolucao(CACHE_RESOLUCAO_MAX_ITENS, CACHE_RESOLUCAO_TTL_SEGUNDOS, CACHE_RESOLUCAO_TTL_NEGATIVO_SEGUNDOS)
+
+class _FalhaTransitoriaAPI(Exception):
+    # Erros de rede/servidor: não entram no cache negativo
+    pass
+
+def _chave_cache_resolucao(endpoint_url, params_get, campo_id_resposta):
+    return (endpoint_url, tuple(sorted(params_get.items())), campo_id_resposta)
+
+@metricas.cronometrar("resolucao_ids", falhou=lambda item_id: item_id is None)
 def obter_ou_criar_id_via_api(endpoint_url, params_get=None, payload_post=None, campo_id_resposta='id', nome_entidade="Item"):
     if not endpoint_url:
-        print(f"  [ERRO API] URL do endpoint para {nome_entidade} não configurada.")
+        logger.error("URL do endpoint para %s não configurada.", nome_entidade)
+        return None
+    try:
+        if not params_get:
+            return _obter_ou_criar_id_via_api_sem_cache(endpoint_url, params_get, payload_post, campo_id_resposta, nome_entidade)
+        chave = _chave_cache_resolucao(endpoint_url, params_get, campo_id_resposta)
+        encontrado, item_id = _cache_resolucao_ids.obter(chave)
+        if encontrado:
+            metricas.incrementar("cache_resolucao", resultado="acerto")
+            logger.debug("[CACHE %s] %s -> %s = %s", nome_entidade, params_get, campo_id_resposta, item_id)
+            return item_id
+        metricas.incrementar("cache_resolucao", resultado="falha")
+        return _cache_resolucao_ids.obter_ou_calcular(chave, lambda: _obter_ou_criar_id_via_api_sem_cache(endpoint_url, params_get, payload_post, campo_id_resposta, nome_entidade))
+    except _FalhaTransitoriaAPI:
         return None
+
+def _obter_ou_criar_id_via_api_sem_cache(endpoint_url, params_get=None, payload_post=None, campo_id_resposta='id', nome_entidade="Item"):
     headers = _get_api_headers() 
     item_id, tentar_criar = None, False
     if params_get:
         try:
-            print(f"  [API GET {nome_entidade}] Consultando {endpoint_url} com params: {params_get}")
-            response_get = requests.get(endpoint_url, params=params_get, headers=headers, timeout=10)
+            logger.debug("[API GET %s] Consultando %s com params: %s", nome_entidade, endpoint_url, params_get)
+            response_get = _cliente_api.get(endpoint_url, params=params_get, headers=headers)
             if response_get.status_code == 200:
                 dados_resposta = response_get.json()
                 item_encontrado = dados_resposta[0] if isinstance(dados_resposta, list) and dados_resposta else (dados_resposta if isinstance(dados_resposta, dict) and dados_resposta else None)
                 if item_encontrado and campo_id_resposta in item_encontrado:
                     item_id = item_encontrado[campo_id_resposta]
-                    print(f"  [API GET {nome_entidade}] {nome_entidade} encontrado: {campo_id_resposta} = {item_id}")
+                    logger.info("%s encontrado: %s = %s", nome_entidade, campo_id_resposta, item_id)
                     return item_id 
                 else:
-                    print(f"  [API GET {nome_entidade}] {nome_entidade} não encontrado (200 mas '{campo_id_resposta}' ausente ou dados inválidos).")
+                    logger.info("%s não encontrado (200 mas '%s' ausente ou dados inválidos).", nome_entidade, campo_id_resposta)
                     tentar_criar = bool(payload_post)
             elif response_get.status_code == 404:
-                print(f"  [API GET {nome_entidade}] {nome_entidade} não encontrado (404).")
+                logger.info("%s não encontrado (404).", nome_entidade)
                 tentar_criar = bool(payload_post)
             else: 
-                print(f"  [ERRO API GET {nome_entidade}] {response_get.status_code} - {response_get.text}")
-                return None 
+                logger.error("[API GET %s] %s - %s", nome_entidade, response_get.status_code, response_get.text)
+                raise _FalhaTransitoriaAPI()
         except requests.exceptions.RequestException as e:
-            print(f"  [ERRO API GERAL {nome_entidade}] GET: {e}")
-            return None 
+            logger.error("[API GET %s] Erro na requisição: %s", nome_entidade, e)
+            raise _FalhaTransitoriaAPI()
     if (not params_get or tentar_criar) and payload_post:
         try:
-            print(f"  [API POST {nome_entidade}] Criando {nome_entidade} em {endpoint_url} payload: {payload_post}")
-            response_post = requests.post(endpoint_url, json=payload_post, headers=headers, timeout=10)
+            logger.debug("[API POST %s] Criando em %s, payload: %s", nome_entidade, endpoint_url, payload_post)
+            response_post = _cliente_api.post(endpoint_url, json=payload_post, headers=headers)
             if response_post.status_code == 409 and params_get:
-                 print(f"  [API POST {nome_entidade}] Conflito (409). Buscando novamente...")
-                 return obter_ou_criar_id_via_api(endpoint_url, params_get=params_get, payload_post=None, campo_id_resposta=campo_id_resposta, nome_entidade=nome_entidade)
+                 logger.info("[API POST %s] Conflito (409). Buscando novamente...", nome_entidade)
+                 # Outro processo criou o item: qualquer resolução em cache para esta chave está desatualizada
+                 _cache_resolucao_ids.invalidar(_chave_cache_resolucao(endpoint_url, params_get, campo_id_resposta))
+                 return _obter_ou_criar_id_via_api_sem_cache(endpoint_url, params_get=params_get, payload_post=None, campo_id_resposta=campo_id_resposta, nome_entidade=nome_entidade)
             response_post.raise_for_status() 
             novo_item = response_post.json()
             if campo_id_resposta in novo_item:
                 item_id = novo_item[campo_id_resposta]
-                print(f"  [API POST {nome_entidade}] Criado: {campo_id_resposta} = {item_id}")
+                logger.info("%s criado: %s = %s", nome_entidade, campo_id_resposta, item_id)
                 return item_id
             else:
-                print(f"  [ERRO API POST {nome_entidade}] Campo '{campo_id_resposta}' não na resposta: {novo_item}")
+                logger.error("[API POST %s] Campo '%s' não está na resposta: %s", nome_entidade, campo_id_resposta, novo_item)
                 return None
         except requests.exceptions.HTTPError as http_err:
             if not (http_err.response and http_err.response.status_code == 409): 
-                 print(f"  [ERRO API HTTP POST {nome_entidade}] {http_err} - Resposta: {http_err.response.text if http_err.response else 'Sem resposta'}")
-            return None 
+                 logger.error("[API POST %s] HTTP: %s - Resposta: %s", nome_entidade, http_err, http_err.response.text if http_err.response else 'Sem resposta')
+            raise _FalhaTransitoriaAPI()
         except requests.exceptions.RequestException as e:
-            print(f"  [ERRO API GERAL {nome_entidade}] POST: {e}")
-            return None
+            logger.error("[API POST %s] Erro na requisição: %s", nome_entidade, e)
+            raise _FalhaTransitoriaAPI()
     return item_id
 
-def inferir_forma_pagamento_e_digitos(remetente, conteudo_bruto, tipo_conteudo):
-    descricao_fp_inferida = FP_DESCRICAO_DESCONHECIDO
+def inferir_forma_pagamento_e_digitos(remetente, conteudo_bruto, tipo_conteudo, documento=None):
+    if documento is None: documento = MensagemParseada(conteudo_bruto, tipo_conteudo, remetente)
     ultimos_digitos_cartao_str = "0000" 
-    texto_para_busca_keywords = conteudo_bruto.lower()
-    if tipo_conteudo == 'html':
-        try:
-            soup = BeautifulSoup(conteudo_bruto, 'lxml')
-            texto_para_busca_keywords = soup.get_text(separator=" ", strip=True).lower()
-        except Exception as e: print(f"  [AVISO] Erro BeautifulSoup para inferir FP: {e}")
-    for bandeira, patterns in BANDEIRA_KEYWORDS_REGEX_MAP.items():
-        for pattern in patterns:
-            source_text = conteudo_bruto if ".png" in pattern else texto_para_busca_keywords
-            if re.search(pattern, source_text, re.IGNORECASE):
-                descricao_fp_inferida = bandeira; break
-        if descricao_fp_inferida not in [FP_DESCRICAO_DESCONHECIDO, FP_DESCRICAO_CARTAO_PADRAO]: break
-    if descricao_fp_inferida == FP_DESCRICAO_DESCONHECIDO:
-        if any(term in texto_para_busca_keywords for term in ["cartão de crédito", "cartao de credito", "credit card", "cartão de débito", "cartao de debito", "debit card"]):
-            descricao_fp_inferida = FP_DESCRICAO_CARTAO_PADRAO
-    if remetente == 'noreply@uber.com':
-        match_cartao = re.search(r'[•*]{4}(\d{4})', conteudo_bruto)
-        if match_cartao: ultimos_digitos_cartao_str = match_cartao.group(1)
-        print(f"    [UBER] Dígitos cartão: {ultimos_digitos_cartao_str if match_cartao else 'não encontrados, padrão 0000'}.")
-    elif remetente == 'voude99@99app.com':
-        print(f"    [99APP] Dígitos cartão: não disponíveis, padrão '{ultimos_digitos_cartao_str}'.")
-    print(f"    Descrição FP Inferida Final: {descricao_fp_inferida}")
+    extrator = extratores.obter_extrator(remetente)
+    texto_para_busca_keywords = documento.texto_para_busca(rapido=bool(extrator and extrator.usa_texto_rapido))
+    descricao_fp_inferida = _detector_bandeira.detectar(texto_para_busca_keywords, documento.conteudo) or FP_DESCRICAO_DESCONHECIDO
+    if extrator:
+        digitos = extrator.extrair_digitos(documento)
+        if digitos: ultimos_digitos_cartao_str = digitos
+        logger.debug("[%s] Dígitos cartão: %s", extrator.nome, digitos or f"não encontrados, padrão {ultimos_digitos_cartao_str}")
+    logger.debug("Descrição FP inferida: %s", descricao_fp_inferida)
     return descricao_fp_inferida, ultimos_digitos_cartao_str
 
+# Resultado do envio de cada corrida: aceita, falha (tenta de novo depois) ou rejeitada (a API nunca vai aceitar)
+ENVIO_ACEITA, ENVIO_FALHA, ENVIO_REJEITADA = 'aceita', 'falha', 'rejeitada'
+
+def _rejeicao_definitiva(status_code):
+    # 4xx de validação não muda com o tempo; autenticação, timeout e limite de taxa sim
+    return 400 <= status_code < 500 and status_code not in (401, 403, 408, 429)
+
+@metricas.cronometrar("envio_api", falhou=lambda resultado: resultado != ENVIO_ACEITA)
 def enviar_dados_corrida_para_api(dados_corrida):
     if not API_CORRIDAS_ENDPOINT_URL:
-        print("  [ERRO API CORRIDAS] URL não configurada.")
-        return False
+        logger.error("URL da API de corridas não configurada.")
+        return ENVIO_FALHA
     headers = _get_api_headers()
     try:
-        print(f"  [API CORRIDAS] Enviando: {API_CORRIDAS_ENDPOINT_URL}, Payload: {dados_corrida}")
-        response = requests.post(API_CORRIDAS_ENDPOINT_URL, json=dados_corrida, headers=headers, timeout=10)
+        logger.debug("[API CORRIDAS] Enviando para %s, payload: %s", API_CORRIDAS_ENDPOINT_URL, dados_corrida)
+        response = _cliente_api.post(API_CORRIDAS_ENDPOINT_URL, json=dados_corrida, headers=headers)
         response.raise_for_status()
-        print(f"  [API CORRIDAS] Sucesso! Status: {response.status_code}, Resposta: {response.json()}")
-        return True
+        logger.info("Corrida registrada na API (status %s).", response.status_code)
+        return ENVIO_ACEITA
     except requests.exceptions.HTTPError as http_err:
         try:
-            error_details = http_err.response.json() if http_err.response else None
-            print(f"  [ERRO API CORRIDAS] HTTP: {http_err} - Detalhes: {error_details}")
-        except json.JSONDecodeError:
-            print(f"  [ERRO API CORRIDAS] HTTP: {http_err} - Resposta (não JSON): {http_err.response.text if http_err.response else 'Sem resposta'}")
+            error_details = http_err.response.json() if http_err.response is not None else None
+            logger.error("[API CORRIDAS] HTTP: %s - Detalhes: %s", http_err, error_details)
+        except ValueError: # JSONDecodeError do requests/simplejson
+            logger.error("[API CORRIDAS] HTTP: %s - Resposta (não JSON): %s", http_err, http_err.response.text if http_err.response is not None else 'Sem resposta')
+        if http_err.response is not None and _rejeicao_definitiva(http_err.response.status_code):
+            return ENVIO_REJEITADA
     except requests.exceptions.RequestException as e:
-        print(f"  [ERRO API CORRIDAS] Requisição: {e}")
-    return False
+        logger.error("[API CORRIDAS] Erro na requisição: %s", e)
+    return ENVIO_FALHA
+
+@metricas.cronometrar("envio_api", falhou=lambda resultados: any(resultado != ENVIO_ACEITA for resultado in resultados))
+def enviar_lote_corridas_para_api(lote_corridas):
+    """Envia um lote de corridas. Sem endpoint de lote (ou se o lote for rejeitado), envia uma a uma.
+    Retorna uma lista alinhada com `lote_corridas` com o resultado de cada uma (ENVIO_ACEITA/FALHA/REJEITADA)."""
+    if not lote_corridas: return []
+    if not API_CORRIDAS_LOTE_ENDPOINT_URL:
+        return [enviar_dados_corrida_para_api(dados_corrida) for dados_corrida in lote_corridas]
+    headers = _get_api_headers()
+    try:
+        logger.debug("[API CORRIDAS LOTE] Enviando %d corrida(s) para %s", len(lote_corridas), API_CORRIDAS_LOTE_ENDPOINT_URL)
+        response = _cliente_api.post(API_CORRIDAS_LOTE_ENDPOINT_URL, json={"corridas": lote_corridas}, headers=headers)
+        if 400 <= response.status_code < 500:
+            # Lote rejeitado por validação: reenvia individualmente para isolar a corrida inválida
+            logger.error("[API CORRIDAS LOTE] %s - %s. Reenviando individualmente.", response.status_code, response.text)
+            return [enviar_dados_corrida_para_api(dados_corrida) for dados_corrida in lote_corridas]
+        response.raise_for_status()
+        logger.info("Lote de %d corrida(s) registrado na API (status %s).", len(lote_corridas), response.status_code)
+        return [ENVIO_ACEITA] * len(lote_corridas)
+    except requests.exceptions.RequestException as e:
+        logger.error("[API CORRIDAS LOTE] %s. %d corrida(s) ficam pendentes no outbox.", e, len(lote_corridas))
+    return [ENVIO_FALHA] * len(lote_corridas)
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def _obter_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(ARQUIVO_OUTBOX, OUTBOX_BACKOFF_BASE_SEGUNDOS)
+        return _outbox
+
+def completar_ids_corrida(corrida):
+    """Troca remetente/descrição da forma de pagamento da corrida do outbox pelos IDs da API.
+    Retorna None se algum ID não pôde ser obtido agora; a corrida continua pendente."""
+    if "id_apps" in corrida: return corrida # Gravada já com os IDs (outbox de versões anteriores)
+    remetente, descricao_fp = corrida["remetente"], corrida["descricao_fp"]
+    payload_criar_app = {"email": remetente, "nome_apps": f"App_{remetente.split('@')[0]}"}
+    app_id = obter_ou_criar_id_via_api(API_APPS_ENDPOINT_URL, params_get={"email": remetente}, payload_post=payload_criar_app, campo_id_resposta='id_apps', nome_entidade="Aplicativo")
+    if not app_id: logger.warning("App ID não obtido/criado para '%s'. Corrida fica pendente.", remetente); return None
+
+    payload_criar_fp = {"descricao": descricao_fp, "bandeira": descricao_fp, "ativo": True }
+    id_fp = obter_ou_criar_id_via_api(API_FORMAS_PAGAMENTO_ENDPOINT_URL, params_get={"descricao": descricao_fp}, payload_post=payload_criar_fp, campo_id_resposta='id_forma_pagamento', nome_entidade="FormaPagamento")
+    if not id_fp: logger.warning("ID Forma Pagamento não obtido/criado para '%s'. Corrida fica pendente.", descricao_fp); return None
+
+    dados_para_api = {campo: valor for campo, valor in corrida.items() if campo not in ("remetente", "descricao_fp")}
+    dados_para_api.update(id_apps=app_id, id_forma_pagamento=id_fp)
+    return dados_para_api
+
+def enviar_corridas_do_outbox(itens):
+    """Envia pares (chave_idempotencia, corrida) e registra o resultado no outbox. Retorna quantas foram confirmadas."""
+    if not itens: return 0
+    outbox = _obter_outbox()
+    prontas, sem_ids, nao_resolvidos = [], [], set()
+    for chave, corrida in itens:
+        # Com a API fora, não repete a resolução (e as retentativas) para cada corrida do mesmo remetente
+        origem = (corrida.get("remetente"), corrida.get("descricao_fp"))
+        dados_para_api = None if origem in nao_resolvidos else completar_ids_corrida(corrida)
+        if dados_para_api is None:
+            nao_resolvidos.add(origem); sem_ids.append(chave)
+        else: prontas.append((chave, dados_para_api))
+    resultados = enviar_lote_corridas_para_api([dados_para_api for _, dados_para_api in prontas])
+    por_resultado = {ENVIO_ACEITA: [], ENVIO_FALHA: [], ENVIO_REJEITADA: []}
+    for (chave, _), resultado in zip(prontas, resultados):
+        por_resultado[resultado].append(chave)
+    confirmadas, rejeitadas = por_resultado[ENVIO_ACEITA], por_resultado[ENVIO_REJEITADA]
+    metricas.incrementar("corridas_enviadas", len(confirmadas), resultado="aceita")
+    metricas.incrementar("corridas_enviadas", len(rejeitadas), resultado="rejeitada")
+    metricas.incrementar("corridas_enviadas", len(itens) - len(confirmadas) - len(rejeitadas), resultado="falha")
+    outbox.confirmar(confirmadas)
+    outbox.registrar_falha(por_resultado[ENVIO_FALHA], "envio para a API falhou")
+    outbox.registrar_falha(sem_ids, "IDs de aplicativo/forma de pagamento não obtidos")
+    if rejeitadas:
+        # Não voltam a ser enviadas: sem isso, cada lote com uma delas cairia no envio individual a cada drenagem
+        outbox.rejeitar(rejeitadas, "recusada pela API (4xx)")
+        logger.error("%d corrida(s) recusada(s) pela API ficam no outbox como '%s' e não serão reenviadas: %s",
+                     len(rejeitadas), ESTADO_REJEITADO, ", ".join(chave[:12] for chave in rejeitadas))
+    return len(confirmadas)
+
+def registrar_corrida(dados_corrida, id_usuario, message_id):
+    # Grava no outbox antes de enviar: se a API estiver fora, a corrida fica pendente para o drenador
+    chave = gerar_chave_idempotencia(id_usuario, message_id, dados_corrida)
+    dados_corrida = dict(dados_corrida, chave_idempotencia=chave)
+    if not _obter_outbox().registrar(chave, dados_corrida, carencia_segundos=OUTBOX_INTERVALO_DRENAGEM_SEGUNDOS):
+        metricas.incrementar("corridas", resultado="duplicada")
+        logger.info("Corrida deste e-mail já foi confirmada ou recusada anteriormente (%s...). Ignorando.", chave[:12])
+        return False
+    metricas.incrementar("corridas", resultado="registrada")
+    _buffer_corridas.adicionar((chave, dados_corrida)) # Enviado em lote ao fim do ciclo (ou quando o lote enche)
+    return True
+
+def iniciar_drenador_outbox():
+    drenador = DrenadorOutbox(_obter_outbox(), enviar_corridas_do_outbox, OUTBOX_INTERVALO_DRENAGEM_SEGUNDOS,
+                              TAMANHO_LOTE_CORRIDAS, OUTBOX_MAX_CORRIDAS_POR_SEGUNDO, OUTBOX_RETENCAO_DIAS)
+    drenador.start()
+    pendentes = _obter_outbox().contar_pendentes()
+    if pendentes: logger.info("Outbox com %d corrida(s) pendente(s) de envio.", pendentes)
+    return drenador
+
+_buffer_corridas = BufferCorridas(enviar_corridas_do_outbox, TAMANHO_LOTE_CORRIDAS)
 
 # --- NOVA FUNÇÃO PARA OBTER CREDENCIAIS IMAP DO USUÁRIO ---
-def obter_credenciais_imap_usuario(id_usuario_alvo):
+# Falhas não são guardadas (TTL negativo 0): a próxima chamada tenta a API de novo
+_cache_credenciais_imap = CacheResolucao(CACHE_RESOLUCAO_MAX_ITENS, CREDENCIAIS_TTL_SEGUNDOS, ttl_negativo_segundos=0)
+
+def obter_credenciais_imap_usuario(id_usuario_alvo, forcar_atualizacao=False):
+    # Evita um GET + decriptação por ciclo; `forcar_atualizacao` descarta o que estiver em cache (ex: login recusado)
+    chave = str(id_usuario_alvo)
+    if forcar_atualizacao:
+        _cache_credenciais_imap.invalidar(chave)
+    else:
+        encontrado, credenciais = _cache_credenciais_imap.obter(chave)
+        if encontrado:
+            metricas.incrementar("cache_credenciais", resultado="acerto")
+            return credenciais
+    metricas.incrementar("cache_credenciais", resultado="falha")
+    credenciais = _cache_credenciais_imap.obter_ou_calcular(chave, lambda: _buscar_credenciais_imap_usuario(id_usuario_alvo))
+    return credenciais or (None, None)
+
+@metricas.cronometrar("credenciais", falhou=lambda credenciais: credenciais is None)
+def _buscar_credenciais_imap_usuario(id_usuario_alvo):
     if not API_USER_IMAP_CREDS_ENDPOINT_URL_TEMPLATE:
-        print("  [ERRO FATAL] API_USER_IMAP_CREDS_ENDPOINT_URL_TEMPLATE não definido no .env")
-        return None, None
+        logger.critical("API_USER_IMAP_CREDS_ENDPOINT_URL_TEMPLATE não definido no .env")
+        return None
     if not id_usuario_alvo:
-        print("  [ERRO] ID do usuário alvo não fornecido para buscar credenciais IMAP.")
-        return None, None
+        logger.error("ID do usuário alvo não fornecido para buscar credenciais IMAP.")
+        return None
 
     endpoint_url = API_USER_IMAP_CREDS_ENDPOINT_URL_TEMPLATE.replace("{id_usuario}", str(id_usuario_alvo))
     headers = _get_api_headers()
-    
-    print(f"  [API IMAP CREDS] Buscando credenciais IMAP para usuário ID {id_usuario_alvo} em {endpoint_url}")
+
+    logger.debug("Buscando credenciais IMAP para usuário ID %s em %s", id_usuario_alvo, endpoint_url)
     try:
-        response = requests.get(endpoint_url, headers=headers, timeout=10)
+        response = _cliente_api.get(endpoint_url, headers=headers)
         response.raise_for_status() # Lança erro para status ruins (4xx, 5xx)
-        
+
         credenciais_encriptadas = response.json()
         email_login = credenciais_encriptadas.get('email_login')
         encrypted_password_with_iv = credenciais_encriptadas.get('encrypted_password_with_iv')
 
         if not email_login or not encrypted_password_with_iv:
-            print("  [ERRO API IMAP CREDS] Resposta da API não continha email_login ou encrypted_password_with_iv.")
-            return None, None
+            logger.error("Resposta da API não continha email_login ou encrypted_password_with_iv.")
+            return None
 
-        print("  [API IMAP CREDS] Credenciais encriptadas recebidas. Tentando decriptar...")
         decrypted_password = decrypt_imap_password(encrypted_password_with_iv)
 
         if not decrypted_password:
-            print("  [ERRO] Falha ao decriptar a senha do aplicativo IMAP.")
-            return None, None
-        
-        print("  [API IMAP CREDS] Senha IMAP decriptada com sucesso.")
+            logger.error("Falha ao decriptar a senha do aplicativo IMAP.")
+            return None
+
+        logger.debug("Senha IMAP decriptada com sucesso.")
         return email_login, decrypted_password
 
     except requests.exceptions.HTTPError as http_err:
-        print(f"  [ERRO API IMAP CREDS] Erro HTTP: {http_err} - Resposta: {http_err.response.text if http_err.response else 'Sem resposta'}")
+        logger.error("[API IMAP CREDS] Erro HTTP: %s - Resposta: %s", http_err, http_err.response.text if http_err.response else 'Sem resposta')
     except requests.exceptions.RequestException as e:
-        print(f"  [ERRO API IMAP CREDS] Erro na Requisição: {e}")
+        logger.error("[API IMAP CREDS] Erro na requisição: %s", e)
     except Exception as e:
-        print(f"  [ERRO INESPERADO em obter_credenciais_imap_usuario]: {e}")
-    return None, None
+        logger.exception("Erro inesperado em _buscar_credenciais_imap_usuario: %s", e)
+    return None
+
+
+# --- Controle de concorrência IMAP (modo multiusuário) ---
+_semaforos_imap_por_host = {}
+_semaforos_imap_lock = threading.Lock()
+
+def _obter_semaforo_imap(host):
+    # Um semáforo por host limita quantas conexões IMAP simultâneas abrimos contra o mesmo servidor
+    with _semaforos_imap_lock:
+        semaforo = _semaforos_imap_por_host.get(host)
+        if semaforo is None:
+            semaforo = threading.BoundedSemaphore(MAX_CONEXOES_IMAP_POR_HOST)
+            _semaforos_imap_por_host[host] = semaforo
+        return semaforo
+
+def listar_usuarios_com_imap():
+    if not API_USUARIOS_ENDPOINT_URL:
+        logger.critical("API_USUARIOS_ENDPOINT_URL não definido no .env")
+        return []
+    headers = _get_api_headers()
+    try:
+        logger.debug("Listando usuários em %s", API_USUARIOS_ENDPOINT_URL)
+        response = _cliente_api.get(API_USUARIOS_ENDPOINT_URL, headers=headers)
+        if response.status_code == 404:
+            logger.info("Nenhum usuário cadastrado.")
+            return []
+        response.raise_for_status()
+        usuarios = response.json()
+        if isinstance(usuarios, dict): usuarios = [usuarios]
+        ids_usuarios = [u.get('id_usuario') for u in usuarios if u.get('id_usuario') and u.get('email_login') and u.get('email_app_password_encrypted')]
+        logger.info("%d usuário(s) com IMAP configurado.", len(ids_usuarios))
+        return ids_usuarios
+    except requests.exceptions.HTTPError as http_err:
+        logger.error("[API USUARIOS] Erro HTTP: %s - Resposta: %s", http_err, http_err.response.text if http_err.response else 'Sem resposta')
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error("[API USUARIOS] Erro na requisição: %s", e)
+    return []
 
 
 # --- Função Principal de Processamento ---
-def processar_emails():
-    # Obter credenciais IMAP para o TARGET_USER_ID no início
-    if not TARGET_USER_ID:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [ERRO] TARGET_USER_ID não definido no .env. Não é possível buscar e-mails.")
+@metricas.cronometrar("imap_login")
+def conectar_imap(usuario_email_login, usuario_imap_password):
+    mail = imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORTA) if IMAP_SSL else imaplib.IMAP4(IMAP_HOST, IMAP_PORTA)
+    try:
+        mail.login(usuario_email_login, usuario_imap_password) # USA AS CREDENCIAIS DO USUÁRIO
+        logger.debug("Login IMAP OK.")
+        mail.select(CAIXA_IMAP)
+    except BaseException:
+        mail.shutdown()
+        raise
+    return mail
+
+class CredenciaisIndisponiveis(RuntimeError):
+    pass
+
+def conectar_imap_usuario(id_usuario):
+    # Conecta com as credenciais em cache; se o servidor recusar o login (senha trocada), busca na API e tenta uma vez mais
+    for tentativa in range(2):
+        usuario_email_login, usuario_imap_password = obter_credenciais_imap_usuario(id_usuario, forcar_atualizacao=tentativa > 0)
+        if not usuario_email_login or not usuario_imap_password:
+            raise CredenciaisIndisponiveis(f"credenciais IMAP indisponíveis para o usuário {id_usuario}")
+        try:
+            return conectar_imap(usuario_email_login, usuario_imap_password), usuario_email_login
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            if tentativa: raise
+            metricas.incrementar("cache_credenciais", resultado="recusada")
+            logger.warning("Login IMAP recusado com as credenciais em cache (%s). Renovando na API.", e)
+
+# As sessões paradas também ocupam conexões: o gerenciador mantém o total dentro do limite por host
+_sessoes_imap = GerenciadorSessoesIMAP(conectar_imap_usuario, SESSAO_IMAP_NOOP_APOS_SEGUNDOS, SESSAO_IMAP_OCIOSA_MAX_SEGUNDOS,
+                                      persistir=PERSISTIR_SESSOES_IMAP, max_sessoes=MAX_CONEXOES_IMAP_POR_HOST)
+
+def processar_emails_usuario(id_usuario):
+    # Retorna quantos recibos foram processados, ou None se a verificação falhou
+    with contexto_log(id_usuario=id_usuario), metricas.medir("ciclo_usuario") as medicao:
+        try:
+            # A sessão fica aberta (e com a caixa selecionada) entre ciclos; o semáforo limita as que estão em uso ao mesmo tempo
+            with _obter_semaforo_imap(IMAP_HOST), _sessoes_imap.sessao(id_usuario) as sessao:
+                recibos = processar_caixa_entrada(sessao.mail, id_usuario, sessao.login)
+            if recibos is None:
+                medicao.erro()
+            else:
+                logger.info("Verificação concluída para %s.", sessao.login)
+            return recibos
+        except CredenciaisIndisponiveis:
+            medicao.erro()
+            logger.error("Não foi possível obter/decriptar credenciais IMAP. Verificação de e-mail abortada para este ciclo.")
+        except imaplib.IMAP4.error as e:
+            medicao.erro()
+            logger.error("Erro IMAP: %s", e)
+        except Exception as e:
+            medicao.erro()
+            logger.exception("Erro geral ao processar o usuário: %s", e)
+
+_estado_sync = None
+_estado_sync_lock = threading.Lock()
+
+def _obter_estado_sync():
+    global _estado_sync
+    with _estado_sync_lock:
+        if _estado_sync is None:
+            _estado_sync = EstadoSync(ARQUIVO_ESTADO_SYNC)
+        return _estado_sync
+
+def processar_caixa_entrada(mail, id_usuario, usuario_email_login):
+    if MODO_SYNC == 'incremental':
+        return processar_caixa_entrada_incremental(mail, id_usuario, usuario_email_login)
+    criterio = busca_imap.montar_criterio_busca(extratores.remetentes_para_busca(), "UNSEEN")
+    email_ids = busca_imap.buscar_uids(mail, criterio)
+    if email_ids is None:
+        logger.error("Falha ao buscar e-mails."); return None
+    if not email_ids:
+        logger.info("Nenhum e-mail novo para %s.", usuario_email_login)
+        return 0
+    logger.info("%d e-mails novos de remetentes de corrida para %s.", len(email_ids), usuario_email_login)
+    processados, falhas = processar_uids(mail, email_ids, id_usuario)
+    # BODY.PEEK não marca como lido; marcamos só os recibos processados (antes o FETCH RFC822 marcava tudo)
+    if processados: busca_imap.marcar_como_lidas(mail, processados, TAMANHO_LOTE_FETCH_IMAP)
+    # As que falharam continuam não lidas e voltam no próximo ciclo
+    return None if falhas else len(processados)
+
+def processar_caixa_entrada_incremental(mail, id_usuario, usuario_email_login):
+    estado_sync = _obter_estado_sync()
+    # UIDNEXT é lido antes do SEARCH: o que chegar depois fica para o próximo ciclo
+    uidvalidity, uidnext = busca_imap.obter_uidvalidity_uidnext(mail, CAIXA_IMAP)
+    if uidvalidity is None:
+        logger.error("Servidor não informou UIDVALIDITY. Sincronização incremental abortada."); return None
+    estado = estado_sync.obter(id_usuario, CAIXA_IMAP)
+    if estado and estado[0] == uidvalidity:
+        ultimo_uid = estado[1]
+        criterio = busca_imap.montar_criterio_busca(extratores.remetentes_para_busca(), f"UID {ultimo_uid + 1}:*")
+    else:
+        # Primeira execução ou UIDVALIDITY mudou: UIDs antigos não valem mais, ressincroniza pelos não lidos
+        logger.info("%s para %s. Sincronização completa.", 'UIDVALIDITY alterado' if estado else 'Sem estado salvo', usuario_email_login)
+        ultimo_uid = 0
+        criterio = busca_imap.montar_criterio_busca(extratores.remetentes_para_busca(), "UNSEEN")
+    email_ids = busca_imap.buscar_uids(mail, criterio)
+    if email_ids is None:
+        logger.error("Falha ao buscar e-mails."); return None
+    # "UID n:*" sempre devolve ao menos a última mensagem, mesmo que já processada
+    email_ids = [uid for uid in email_ids if int(uid) > ultimo_uid]
+    processados, falhas = [], []
+    if email_ids:
+        logger.info("%d e-mails novos de remetentes de corrida para %s.", len(email_ids), usuario_email_login)
+        processados, falhas = processar_uids(mail, email_ids, id_usuario)
+    else:
+        logger.info("Nenhum e-mail novo para %s.", usuario_email_login)
+    if falhas:
+        # O cursor para antes do primeiro UID que falhou; os já processados depois dele são barrados pelo outbox
+        novo_ultimo_uid = max(ultimo_uid, min(int(uid) for uid in falhas) - 1)
+        logger.warning("%d e-mail(s) não processado(s). Serão tentados de novo a partir do UID %d.", len(falhas), novo_ultimo_uid + 1)
+    else:
+        novo_ultimo_uid = max([ultimo_uid, (uidnext - 1) if uidnext else 0] + [int(uid) for uid in email_ids])
+    estado_sync.salvar(id_usuario, CAIXA_IMAP, uidvalidity, novo_ultimo_uid)
+    return None if falhas else len(processados)
+
+def processar_uids(mail, email_ids, id_usuario):
+    # 1) cabeçalhos + BODYSTRUCTURE em lote, 2) só a parte principal das mensagens que interessam
+    # Retorna (processados, falhas): falhas são UIDs que não puderam ser lidos agora e devem ser tentados de novo
+    cabecalhos_por_uid, partes_por_uid, recebidos, grandes_demais = {}, {}, set(), []
+    for uid, msg_cabecalhos, estrutura in busca_imap.buscar_cabecalhos_em_lote(mail, email_ids, TAMANHO_LOTE_FETCH_IMAP):
+        recebidos.add(uid)
+        remetente = extrair_dados_email(msg_cabecalhos)[0]
+        if extratores.obter_extrator(remetente) is None:
+            metricas.incrementar("emails", resultado="ignorado")
+            logger.info("Remetente '%s' não é de corrida. Ignorando.", remetente, extra={"uid": uid.decode()})
+            continue
+        parte = busca_imap.escolher_parte_principal(estrutura)
+        if parte and parte["tamanho"] > MAX_BYTES_CORPO_EMAIL:
+            metricas.incrementar("emails", resultado="ignorado")
+            logger.warning("Parte %s com %d bytes excede MAX_BYTES_CORPO_EMAIL. Ignorando.", parte['tipo'], parte['tamanho'], extra={"uid": uid.decode()})
+            grandes_demais.append(uid)
+            continue
+        cabecalhos_por_uid[uid] = msg_cabecalhos
+        if parte: partes_por_uid[uid] = parte
+
+    # UIDs sem resposta de cabeçalho (lote com FETCH não-OK) contam como falha
+    falhas = [uid for uid in email_ids if uid not in recebidos]
+    if falhas: metricas.incrementar("emails", len(falhas), resultado="falha_fetch")
+    conteudos = busca_imap.buscar_partes_em_lote(mail, partes_por_uid, TAMANHO_LOTE_FETCH_IMAP)
+    # Ignorados de vez: entram como processados para serem marcados como lidos e não voltarem a cada ciclo
+    processados = list(grandes_demais)
+    for uid, msg_cabecalhos in cabecalhos_por_uid.items():
+        with contexto_log(uid=uid.decode()):
+            if uid in conteudos:
+                tipo_conteudo = "html" if partes_por_uid[uid]["tipo"] == "text/html" else "text"
+                processar_dados_mensagem(msg_cabecalhos, conteudos[uid], tipo_conteudo, id_usuario)
+            else:
+                # BODYSTRUCTURE não interpretável: recorre à mensagem completa, varrida sem decodificar anexos
+                dados_brutos = busca_imap.buscar_mensagem_bruta(mail, uid)
+                if dados_brutos is None:
+                    metricas.incrementar("emails", resultado="falha_fetch")
+                    logger.error("Falha ao buscar e-mail.")
+                    falhas.append(uid); continue
+                processar_mensagem_bruta(dados_brutos, id_usuario)
+        metricas.incrementar("emails", resultado="processado")
+        processados.append(uid)
+    return processados, falhas
+
+def processar_mensagem_bruta(dados_brutos, id_usuario):
+    cabecalhos, conteudo_bruto, tipo_conteudo = mime_stream.parse_mensagem_stream(dados_brutos, MAX_BYTES_CORPO_EMAIL)
+    processar_dados_mensagem(cabecalhos, conteudo_bruto, tipo_conteudo, id_usuario)
+
+def processar_dados_mensagem(msg, conteudo_bruto, tipo_conteudo, id_usuario):
+    remetente, assunto, data_email = extrair_dados_email(msg)
+    logger.info("Processando e-mail de %s: '%s' (%s)", remetente, assunto, data_email.strftime('%Y-%m-%d %H:%M:%S') if data_email else 'sem data',
+                extra={"tipo_conteudo": tipo_conteudo})
+    if not conteudo_bruto: logger.warning("Conteúdo vazio. Pulando."); return
+    # Um único documento por e-mail, consultado por todas as etapas (bandeira, dígitos, valor, data)
+    documento = MensagemParseada(conteudo_bruto, tipo_conteudo, remetente, assunto, data_email, msg.get("Message-ID"))
+    extracao = extrair_corrida(documento)
+    if extracao: registrar_corrida_extraida(extracao, id_usuario)
+
+@metricas.cronometrar("extracao", falhou=lambda extracao: extracao is None)
+def extrair_corrida(documento):
+    """Etapas de extração que não dependem da API (bandeira, dígitos, valor, data). Retorna um dict ou None."""
+    descricao_fp_inferida, ultimos_digitos_cartao_str = inferir_forma_pagamento_e_digitos(documento.remetente, documento.conteudo, documento.tipo_conteudo, documento)
+    extrator = extratores.obter_extrator(documento.remetente)
+    valor_extraido_str = extrator.extrair_valor(documento) if extrator else None
+    logger.debug("Valor extraído: %s", valor_extraido_str)
+
+    if not valor_extraido_str or not documento.data_email:
+        metricas.incrementar("corridas", resultado="sem_dados")
+        logger.warning("Dados insuficientes para API de Corridas (valor: %s, data: %s).", valor_extraido_str, documento.data_email); return None
+    try:
+        valor_float = float(valor_extraido_str.replace('R$', '').replace(',', '.').strip())
+    except (ValueError, AttributeError): logger.error("Conversão de valor '%s' falhou.", valor_extraido_str); return None
+    return {"remetente": documento.remetente, "data": documento.data_email.strftime('%Y-%m-%d'), "valor": valor_float,
+            "cartao": ultimos_digitos_cartao_str, "descricao_fp": descricao_fp_inferida, "message_id": documento.message_id}
+
+def registrar_corrida_extraida(extracao, id_usuario):
+    """Grava a corrida no outbox. Retorna True se registrada.
+
+    Nenhuma chamada à API acontece aqui: os IDs de aplicativo/forma de pagamento são resolvidos no envio
+    (completar_ids_corrida), então a corrida não se perde se a API estiver fora durante a leitura da caixa."""
+    corrida = {"data": extracao["data"], "valor": extracao["valor"], "cartao": extracao["cartao"], "remetente": extracao["remetente"],
+               "descricao_fp": extracao["descricao_fp"], "id_usuario": int(id_usuario)}
+    logger.info("Corrida extraída: R$ %.2f em %s (%s, final %s).", extracao["valor"], extracao["data"], extracao["descricao_fp"], extracao["cartao"])
+    return registrar_corrida(corrida, id_usuario, extracao["message_id"])
+
+# --- Modo polling: cada caixa no seu ritmo ---
+def verificar_caixa_agendada(id_usuario):
+    with _reservar_caixa(id_usuario) as possui:
+        if not possui:
+            logger.info("Caixa do usuário %s está com outro worker. Ignorando.", id_usuario)
+            return 0
+        recibos = processar_emails_usuario(id_usuario)
+        _buffer_corridas.descarregar()
+        return recibos
+
+def listar_caixas_agendadas():
+    _sessoes_imap.fechar_ociosas() # ex: usuários que saíram da lista
+    if not MODO_MULTIUSUARIO:
+        return [TARGET_USER_ID]
+    ids_usuarios = listar_usuarios_com_imap()
+    if not ids_usuarios:
+        logger.info("Nenhum usuário com IMAP configurado para processar.")
+    return ids_usuarios
+
+def criar_agendador():
+    return AgendadorCaixas(verificar_caixa_agendada, INTERVALO_VERIFICACAO_SEGUNDOS, AGENDADOR_INTERVALO_MINIMO_SEGUNDOS,
+                           AGENDADOR_INTERVALO_MAXIMO_SEGUNDOS, AGENDADOR_BACKOFF_MAXIMO_SEGUNDOS,
+                           max_concorrentes=MAX_USUARIOS_CONCORRENTES if MODO_MULTIUSUARIO else 1,
+                           verificacoes_por_minuto=AGENDADOR_VERIFICACOES_POR_MINUTO, jitter=AGENDADOR_JITTER,
+                           alvo_recibos_por_verificacao=AGENDADOR_RECIBOS_POR_VERIFICACAO)
+
+def _resumo_agendador(agendador):
+    caixas = agendador.instantaneo()
+    return {"modo": "polling", "caixas": len(caixas), "em_execucao": sum(1 for c in caixas if c["em_execucao"]),
+            "com_falha": sum(1 for c in caixas if c["falhas_consecutivas"])}
+
+def executar_modo_agendado(parar):
+    logger.info("Intervalo por caixa entre %ds e %ds, até %d em paralelo (%d conexões IMAP por host).", AGENDADOR_INTERVALO_MINIMO_SEGUNDOS,
+                AGENDADOR_INTERVALO_MAXIMO_SEGUNDOS, MAX_USUARIOS_CONCORRENTES if MODO_MULTIUSUARIO else 1, MAX_CONEXOES_IMAP_POR_HOST)
+    # Cada usuário roda isolado: uma falha em um não interrompe os demais
+    agendador = criar_agendador()
+    definir_provedor_status(lambda: _status_worker(agendador.instantaneo()))
+    if _coordenador is None:
+        agendador.executar(parar, listar_caixas_agendadas, INTERVALO_VERIFICACAO_SEGUNDOS)
         return
-
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] Tentando obter credenciais IMAP para o usuário ID: {TARGET_USER_ID}")
-    usuario_email_login, usuario_imap_password = obter_credenciais_imap_usuario(TARGET_USER_ID)
-
-    if not usuario_email_login or not usuario_imap_password:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [ERRO] Não foi possível obter/decriptar credenciais IMAP para o usuário {TARGET_USER_ID}. Verificação de e-mail abortada para este ciclo.")
+    # Com coordenação, as caixas do agendador são as que este worker detém; a thread de coordenação as atualiza
+    coordenacao = iniciar_coordenacao(agendador.sincronizar, lambda: _resumo_agendador(agendador))
+    try:
+        agendador.executar(parar)
+    finally:
+        coordenacao.parar.set()
+
+# --- Coordenação entre workers ---
+_coordenador = CoordenadorLeases(ARQUIVO_COORDENACAO, COORDENACAO_ID_WORKER, COORDENACAO_DURACAO_LEASE_SEGUNDOS) if ARQUIVO_COORDENACAO else None
+
+def _reservar_caixa(id_usuario):
+    # Sem coordenação toda caixa listada é deste worker
+    return _coordenador.reservar(id_usuario) if _coordenador is not None else nullcontext(True)
+
+def iniciar_coordenacao(ao_mudar, status):
+    logger.info("Coordenação ativa como worker %s (%s, lease de %ds).", COORDENACAO_ID_WORKER, ARQUIVO_COORDENACAO, COORDENACAO_DURACAO_LEASE_SEGUNDOS)
+    thread = ThreadCoordenacao(_coordenador, listar_caixas_agendadas, ao_mudar, INTERVALO_VERIFICACAO_SEGUNDOS, status)
+    thread.start()
+    return thread
+
+def encerrar_coordenacao():
+    if _coordenador is None: return
+    try: _coordenador.encerrar()
+    except Exception as e: logger.exception("Falha ao devolver as leases: %s", e)
+
+def _status_worker(caixas):
+    return {"id_worker": COORDENACAO_ID_WORKER, "caixas": caixas, "workers": _coordenador.status() if _coordenador is not None else None}
+
+# --- Modo IDLE ---
+_semaforo_processamento_idle = threading.BoundedSemaphore(MAX_USUARIOS_CONCORRENTES)
+
+def _encerrar_conexao_imap(mail):
+    try: mail.logout()
+    except Exception: pass
+
+def vigiar_caixa_idle(id_usuario, parar):
+    with contexto_log(id_usuario=id_usuario), _reservar_caixa(id_usuario) as possui:
+        if not possui:
+            logger.info("Caixa está com outro worker. IDLE não iniciado.")
+            return
+        _vigiar_caixa_idle(id_usuario, parar)
+
+def _vigiar_caixa_idle(id_usuario, parar):
+    backoff = IDLE_BACKOFF_INICIAL_SEGUNDOS
+    while not parar.is_set():
+        mail = None
+        try:
+            # Conexão própria, fora do gerenciador de sessões e de MAX_CONEXOES_IMAP_POR_HOST: fica presa em IDLE e não é compartilhada
+            mail, usuario_email_login = conectar_imap_usuario(id_usuario)
+            if not imap_idle.suporta_idle(mail):
+                logger.warning("Servidor sem IDLE para %s. Usando polling a cada %ds.", usuario_email_login, INTERVALO_VERIFICACAO_SEGUNDOS)
+                _encerrar_conexao_imap(mail); mail = None
+                while not parar.is_set():
+                    processar_emails_usuario(id_usuario)
+                    _buffer_corridas.descarregar()
+                    parar.wait(INTERVALO_VERIFICACAO_SEGUNDOS)
+                return
+            backoff = IDLE_BACKOFF_INICIAL_SEGUNDOS
+            # Processa o que chegou enquanto estávamos desconectados antes de entrar em IDLE
+            novidade = True
+            while not parar.is_set():
+                if novidade:
+                    with _semaforo_processamento_idle:
+                        falhou = processar_caixa_entrada(mail, id_usuario, usuario_email_login) is None
+                        _buffer_corridas.descarregar()
+                logger.debug("IDLE em %s (até %ds).", usuario_email_login, IDLE_TIMEOUT_SEGUNDOS)
+                # Mensagens que falharam continuam não lidas (ou antes do cursor) e nenhuma EXISTS virá para elas:
+                # uma passagem que falhou é refeita ao fim do IDLE, mesmo sem novidade
+                novidade = imap_idle.aguardar_idle(mail, IDLE_TIMEOUT_SEGUNDOS, interromper=parar) or falhou
+        except (imaplib.IMAP4.error, OSError, RuntimeError) as e:
+            metricas.incrementar("reconexoes_idle")
+            logger.error("Erro IDLE: %s. Reconectando em ~%ss.", e, backoff)
+        except Exception as e:
+            metricas.incrementar("reconexoes_idle")
+            logger.exception("Erro geral IDLE: %s. Reconectando em ~%ss.", e, backoff)
+        finally:
+            if mail is not None: _encerrar_conexao_imap(mail)
+        if parar.wait(backoff * random.uniform(0.5, 1.5)): break
+        backoff = min(backoff * 2, IDLE_BACKOFF_MAXIMO_SEGUNDOS)
+
+def executar_modo_idle(parar):
+    if not MODO_MULTIUSUARIO and _coordenador is None:
+        vigiar_caixa_idle(TARGET_USER_ID, parar)
         return
-    
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] Credenciais IMAP obtidas para {usuario_email_login}. Iniciando verificação de e-mails...")
+    # Uma thread (e uma conexão persistente) por caixa
+    vigias = {}
+    def sincronizar_vigias(ids_usuarios):
+        for id_usuario in set(ids_usuarios) - set(vigias):
+            parar_usuario = threading.Event()
+            thread = threading.Thread(target=vigiar_caixa_idle, args=(id_usuario, parar_usuario), name=f"idle-{id_usuario}", daemon=True)
+            vigias[id_usuario] = (thread, parar_usuario)
+            thread.start()
+        for id_usuario in set(vigias) - set(ids_usuarios):
+            logger.info("Usuário %s %s. Encerrando IDLE.", id_usuario, 'passou para outro worker' if _coordenador is not None else 'sem IMAP configurado')
+            vigias.pop(id_usuario)[1].set()
+    definir_provedor_status(lambda: _status_worker(list(vigias)))
+    if _coordenador is None:
+        # A lista de usuários é revista periodicamente; uma lista vazia é tratada como falha da listagem
+        # (como no agendador) para que um erro na API não derrube todas as conexões IDLE de uma vez
+        while not parar.is_set():
+            ids_usuarios = listar_usuarios_com_imap()
+            if ids_usuarios: sincronizar_vigias(ids_usuarios)
+            parar.wait(INTERVALO_VERIFICACAO_SEGUNDOS)
+    else:
+        coordenacao = iniciar_coordenacao(sincronizar_vigias, lambda: {"modo": "idle", "caixas": len(vigias)})
+        parar.wait()
+        coordenacao.parar.set()
+    for _, parar_usuario in list(vigias.values()):
+        parar_usuario.set()
 
-    try:
-        mail = imaplib.IMAP4_SSL(IMAP_HOST)
-        mail.login(usuario_email_login, usuario_imap_password) # USA AS CREDENCIAIS DO USUÁRIO
-        print("[INFO] Login IMAP OK.")
-        mail.select("inbox")
-        status, messages_ids_bytes = mail.search(None, "UNSEEN")
-        if status != "OK":
-            print("[ERRO] Falha ao buscar e-mails."); mail.logout(); return
-        email_ids = messages_ids_bytes[0].split()
-        if not email_ids or email_ids == [b'']:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] Nenhum e-mail novo para {usuario_email_login}.")
-        else:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] {len(email_ids)} e-mails novos para {usuario_email_login}.")
-            for email_id_bytes in email_ids:
-                email_id_str = email_id_bytes.decode()
-                print(f"\n--- Processando E-mail ID: {email_id_str} ---")
-                status, msg_data = mail.fetch(email_id_bytes, "(RFC822)")
-                if status != "OK": print(f"  [ERRO] Falha ao buscar e-mail ID {email_id_str}"); continue
-                for response_part in msg_data:
-                    if not isinstance(response_part, tuple): continue
-                    msg = email.message_from_bytes(response_part[1])
-                    remetente, assunto, data_email = extrair_dados_email(msg)
-                    print(f"  De: {remetente}\n  Assunto: {assunto}\n  Data: {data_email.strftime('%Y-%m-%d %H:%M:%S') if data_email else 'N/A'}")
-
-                    payload_criar_app = {"email": remetente, "nome_apps": f"App_{remetente.split('@')[0]}"} 
-                    app_id = obter_ou_criar_id_via_api(API_APPS_ENDPOINT_URL, params_get={"email": remetente}, payload_post=payload_criar_app, campo_id_resposta='id_apps', nome_entidade="Aplicativo")
-                    if not app_id: print(f"  [INFO] App ID não obtido/criado para '{remetente}'. Pulando."); continue
-                    
-                    conteudo_bruto, tipo_conteudo = extrair_conteudo_principal(msg)
-                    print(f"  [DEBUG] Conteúdo principal: {tipo_conteudo}")
-                    if not conteudo_bruto: print("  [AVISO] Conteúdo vazio. Pulando."); continue
-                    
-                    descricao_fp_inferida, ultimos_digitos_cartao_str = inferir_forma_pagamento_e_digitos(remetente, conteudo_bruto, tipo_conteudo)
-                    payload_criar_fp = {"descricao": descricao_fp_inferida, "bandeira": descricao_fp_inferida, "ativo": True }
-                    id_fp = obter_ou_criar_id_via_api(API_FORMAS_PAGAMENTO_ENDPOINT_URL, params_get={"descricao": descricao_fp_inferida}, payload_post=payload_criar_fp, campo_id_resposta='id_forma_pagamento', nome_entidade="FormaPagamento")
-                    if not id_fp: print(f"  [AVISO] ID Forma Pagamento não obtido/criado para '{descricao_fp_inferida}'.")
-                    
-                    valor_extraido_str = None
-                    if remetente == 'noreply@uber.com':
-                        match_valor_uber_total = re.search(r'<td class="Uber18_p3 total_head"[^>]*>R\$\s*([\d,]+)<\/td>', conteudo_bruto, re.IGNORECASE)
-                        if match_valor_uber_total: valor_extraido_str = f"R$ {match_valor_uber_total.group(1).replace('.', ',')}"
-                        else:
-                            match_valor_geral = re.search(r'R\$\s*(\d+,\d{2})', conteudo_bruto)
-                            if match_valor_geral: valor_extraido_str = f"R$ {match_valor_geral.group(1)}"
-                    elif remetente == 'voude99@99app.com':
-                        match_valor = re.search(r'R\$\s*(\d+,\d{2})', conteudo_bruto)
-                        if match_valor: valor_extraido_str = f"R$ {match_valor.group(1)}"
-                    
-                    if valor_extraido_str: print(f"    Valor extraído: {valor_extraido_str}")
-                    else: print("    Valor não extraído.")
-
-                    if valor_extraido_str and data_email and app_id:
-                        valor_float = None
-                        try:
-                            valor_float = float(valor_extraido_str.replace('R$', '').replace(',', '.').strip())
-                        except (ValueError, AttributeError): print(f"  [ERRO] Conversão de valor '{valor_extraido_str}' falhou."); continue
-                        
-                        dados_para_api = {"data": data_email.strftime('%Y-%m-%d'), "valor": valor_float, "cartao": ultimos_digitos_cartao_str, "id_forma_pagamento": id_fp, "id_apps": app_id, "id_usuario": int(TARGET_USER_ID) } # Adiciona id_usuario
-                        enviar_dados_corrida_para_api(dados_para_api)
-                    else: print("  [AVISO] Dados insuficientes para API de Corridas.")
-                # mail.store(email_id_bytes, '+FLAGS', '\\Seen') 
-        mail.close()
-        mail.logout()
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] Verificação concluída.")
-    except imaplib.IMAP4.error as e: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [ERRO IMAP] {e}")
-    except Exception as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [ERRO GERAL] {e}")
-        import traceback; traceback.print_exc()
+def iniciar_observabilidade(parar):
+    if METRICAS_PORTA: iniciar_servidor_metricas(METRICAS_PORTA)
+    if METRICAS_INTERVALO_DUMP_SEGUNDOS: iniciar_dump_periodico(METRICAS_INTERVALO_DUMP_SEGUNDOS, parar)
 
 if __name__ == "__main__":
-    if not all([API_CORRIDAS_ENDPOINT_URL, API_APPS_ENDPOINT_URL, API_FORMAS_PAGAMENTO_ENDPOINT_URL, PYTHON_SCRIPT_API_KEY, TARGET_USER_ID, API_USER_IMAP_CREDS_ENDPOINT_URL_TEMPLATE, IMAP_ENCRYPTION_KEY_HEX]):
-        print("[ERRO FATAL] Configurações ausentes no .env. Verifique todas as URLs de API, PYTHON_SCRIPT_API_KEY, TARGET_USER_ID, IMAP_ENCRYPTION_KEY e credenciais de e-mail (se ainda usadas globalmente).")
+    configurar_logging(LOG_NIVEL, LOG_FORMATO)
+    configuracoes_obrigatorias = [API_CORRIDAS_ENDPOINT_URL, API_APPS_ENDPOINT_URL, API_FORMAS_PAGAMENTO_ENDPOINT_URL, PYTHON_SCRIPT_API_KEY, API_USER_IMAP_CREDS_ENDPOINT_URL_TEMPLATE, IMAP_ENCRYPTION_KEY_HEX]
+    configuracoes_obrigatorias.append(API_USUARIOS_ENDPOINT_URL if MODO_MULTIUSUARIO else TARGET_USER_ID)
+    if not all(configuracoes_obrigatorias):
+        logger.critical("Configurações ausentes no .env. Verifique todas as URLs de API, PYTHON_SCRIPT_API_KEY, TARGET_USER_ID (ou API_USUARIOS_ENDPOINT_URL com MODO_MULTIUSUARIO), IMAP_ENCRYPTION_KEY e credenciais de e-mail (se ainda usadas globalmente).")
     else:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] Automação iniciada. Verificando a cada {INTERVALO_VERIFICACAO_SEGUNDOS}s.")
+        logger.info("Automação iniciada (%s%s). %s", 'multiusuário' if MODO_MULTIUSUARIO else 'usuário único', ', IDLE' if MODO_IDLE else '',
+                    'Aguardando notificações IMAP IDLE.' if MODO_IDLE else 'Verificação agendada por caixa.')
+        parar = threading.Event()
+        iniciar_observabilidade(parar)
+        drenador_outbox = iniciar_drenador_outbox()
         try:
-            while True:
-                processar_emails()
-                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] Próxima verificação em {INTERVALO_VERIFICACAO_SEGUNDOS}s...")
-                time.sleep(INTERVALO_VERIFICACAO_SEGUNDOS) 
-        except KeyboardInterrupt: print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] Interrompido.")
-        except Exception as e: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [ERRO FATAL LOOP] {e}"); import traceback; traceback.print_exc()
-        finally: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [INFO] Execução finalizada.")
+            if MODO_IDLE:
+                executar_modo_idle(parar)
+            else:
+                executar_modo_agendado(parar)
+        except KeyboardInterrupt: parar.set(); logger.info("Interrompido.")
+        except Exception as e: logger.exception("Erro fatal no loop principal: %s", e)
+        finally:
+            parar.set()
+            drenador_outbox.parar.set()
+            _buffer_corridas.descarregar()
+            _sessoes_imap.fechar_todas()
+            encerrar_coordenacao()
+            registrar_resumo_metricas()
+            logger.info("Execução finalizada.")
 
 # --- Fim do arquivo email_automation.py ---
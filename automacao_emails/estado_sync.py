@@ -0,0 +1,46 @@
+# estado_sync.py
+# Armazena, por usuário e caixa, o UIDVALIDITY e o último UID processado (sincronização incremental).
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class EstadoSync:
+    def __init__(self, caminho_arquivo):
+        diretorio = os.path.dirname(caminho_arquivo)
+        if diretorio: os.makedirs(diretorio, exist_ok=True)
+        # Uma conexão compartilhada entre as threads do modo multiusuário, protegida por lock
+        self._conexao = sqlite3.connect(caminho_arquivo, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conexao:
+            self._conexao.execute("""
+                CREATE TABLE IF NOT EXISTS estado_sync (
+                    id_usuario TEXT NOT NULL,
+                    caixa TEXT NOT NULL,
+                    uidvalidity INTEGER NOT NULL,
+                    ultimo_uid INTEGER NOT NULL,
+                    atualizado_em TEXT NOT NULL,
+                    PRIMARY KEY (id_usuario, caixa)
+                )""")
+
+    def obter(self, id_usuario, caixa):
+        """Retorna (uidvalidity, ultimo_uid) ou None se a caixa nunca foi sincronizada."""
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT uidvalidity, ultimo_uid FROM estado_sync WHERE id_usuario = ? AND caixa = ?",
+                (str(id_usuario), caixa)).fetchone()
+        return (linha[0], linha[1]) if linha else None
+
+    def salvar(self, id_usuario, caixa, uidvalidity, ultimo_uid):
+        with self._lock, self._conexao:
+            self._conexao.execute(
+                "INSERT INTO estado_sync (id_usuario, caixa, uidvalidity, ultimo_uid, atualizado_em) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id_usuario, caixa) DO UPDATE SET uidvalidity = excluded.uidvalidity, "
+                "ultimo_uid = excluded.ultimo_uid, atualizado_em = excluded.atualizado_em",
+                (str(id_usuario), caixa, int(uidvalidity), int(ultimo_uid), datetime.now().isoformat(timespec='seconds')))
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
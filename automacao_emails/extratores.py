@@ -0,0 +1,111 @@
+# extratores.py
+# Registro de extratores de recibo por remetente/domínio, com padrões pré-compilados.
+# Para suportar um novo provedor (iFood, Rappi, Cabify...), basta registrar um ExtratorRecibo aqui.
+
+import re
+
+PADRAO_VALOR_GERAL = re.compile(r'R\$\s*(\d+,\d{2})')
+
+
+class ExtratorRecibo:
+    def __init__(self, nome, remetentes=(), dominios=(), padroes_valor=(), padrao_digitos=None, usa_texto_rapido=False):
+        self.nome = nome
+        self.remetentes = tuple(r.lower() for r in remetentes)
+        self.dominios = tuple(d.lower() for d in dominios)
+        self.padroes_valor = tuple(padroes_valor)  # tentados em ordem sobre o HTML bruto; group(1) é o valor
+        self.padrao_digitos = padrao_digitos       # group(1) são os últimos 4 dígitos do cartão
+        # True quando o extrator só precisa de regex sobre o HTML bruto: a busca de bandeira usa o
+        # texto aproximado por regex e a árvore lxml nunca é construída
+        self.usa_texto_rapido = usa_texto_rapido
+
+    def extrair_valor(self, documento):
+        for padrao in self.padroes_valor:
+            match = padrao.search(documento.conteudo)
+            if match: return f"R$ {match.group(1).replace('.', ',')}"
+        return None
+
+    def extrair_digitos(self, documento):
+        if not self.padrao_digitos: return None
+        match = self.padrao_digitos.search(documento.conteudo)
+        return match.group(1) if match else None
+
+
+_extratores_por_remetente = {}
+_extratores_por_dominio = {}
+
+def registrar_extrator(extrator):
+    for remetente in extrator.remetentes:
+        _extratores_por_remetente[remetente] = extrator
+    for dominio in extrator.dominios:
+        _extratores_por_dominio[dominio] = extrator
+    return extrator
+
+def obter_extrator(remetente):
+    """Seleciona o extrator pelo endereço exato e, na falta dele, pelo domínio do remetente."""
+    if not remetente: return None
+    remetente = remetente.lower()
+    extrator = _extratores_por_remetente.get(remetente)
+    if extrator is None and '@' in remetente:
+        extrator = _extratores_por_dominio.get(remetente.rsplit('@', 1)[1])
+    return extrator
+
+def remetentes_para_busca():
+    """Termos para o filtro FROM do SEARCH IMAP (endereços exatos e domínios registrados)."""
+    return tuple(_extratores_por_remetente) + tuple(f"@{dominio}" for dominio in _extratores_por_dominio)
+
+
+class DetectorBandeira:
+    """Junta todos os padrões de bandeira numa única alternação compilada, para varrer o texto uma vez só.
+
+    A prioridade segue a ordem do mapa de bandeiras; termos genéricos de cartão têm a menor prioridade.
+    Padrões com '.png' procuram no conteúdo bruto (nomes de imagens no HTML), os demais no texto.
+    """
+
+    def __init__(self, mapa_bandeiras, termos_cartao_generico=(), descricao_generica=None):
+        self._bandeira_por_grupo = {}
+        partes_texto, partes_bruto = [], []
+        for prioridade, (bandeira, padroes) in enumerate(mapa_bandeiras.items()):
+            for indice, padrao in enumerate(padroes):
+                grupo = f"b{prioridade}_{indice}"
+                self._bandeira_por_grupo[grupo] = (prioridade, bandeira)
+                (partes_bruto if ".png" in padrao else partes_texto).append(f"(?P<{grupo}>{padrao})")
+        if termos_cartao_generico and descricao_generica:
+            self._bandeira_por_grupo["generico"] = (len(mapa_bandeiras), descricao_generica)
+            partes_texto.append("(?P<generico>" + "|".join(re.escape(t) for t in termos_cartao_generico) + ")")
+        self._regex_texto = re.compile("|".join(partes_texto), re.IGNORECASE) if partes_texto else None
+        self._regex_bruto = re.compile("|".join(partes_bruto), re.IGNORECASE) if partes_bruto else None
+
+    def _melhor(self, regex, texto, melhor):
+        if regex is None or not texto: return melhor
+        for match in regex.finditer(texto):
+            candidato = self._bandeira_por_grupo[match.lastgroup]
+            if melhor is None or candidato[0] < melhor[0]:
+                melhor = candidato
+                if melhor[0] == 0: break
+        return melhor
+
+    def detectar(self, texto, conteudo_bruto=None):
+        melhor = self._melhor(self._regex_texto, texto, None)
+        if melhor is None or melhor[0] > 0:
+            melhor = self._melhor(self._regex_bruto, conteudo_bruto, melhor)
+        return melhor[1] if melhor else None
+
+
+# --- Extratores registrados ---
+EXTRATOR_UBER = registrar_extrator(ExtratorRecibo(
+    nome="UBER",
+    remetentes=('noreply@uber.com',),
+    padroes_valor=(
+        re.compile(r'<td class="Uber18_p3 total_head"[^>]*>R\$\s*([\d,]+)<\/td>', re.IGNORECASE),
+        PADRAO_VALOR_GERAL,
+    ),
+    padrao_digitos=re.compile(r'[•*]{4}(\d{4})'),
+    usa_texto_rapido=True,
+))
+
+EXTRATOR_99 = registrar_extrator(ExtratorRecibo(
+    nome="99APP",
+    remetentes=('voude99@99app.com',),
+    padroes_valor=(PADRAO_VALOR_GERAL,),
+    usa_texto_rapido=True,
+))
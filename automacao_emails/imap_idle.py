@@ -0,0 +1,70 @@
+# imap_idle.py
+# Suporte a IMAP IDLE (RFC 2177) sobre o imaplib, que não implementa o comando nativamente.
+
+import imaplib
+import re
+import socket
+import time
+
+_NOTIFICACAO_NOVIDADE = re.compile(rb'^\* \d+ (EXISTS|RECENT)\b', re.IGNORECASE)
+INTERVALO_CHECAGEM_SEGUNDOS = 5  # de quanto em quanto tempo o IDLE confere se deve ser interrompido
+
+
+def suporta_idle(mail):
+    return 'IDLE' in mail.capabilities
+
+def _ler_linha_ate(mail, segundos):
+    # Lê pelo arquivo bufferizado do imaplib com timeout no socket. Um select() no socket não enxerga o que já
+    # está no buffer (ex: "* n EXISTS" chegando no mesmo pacote que "+ idling") nem o que o SSL já decifrou.
+    mail.sock.settimeout(segundos)
+    try:
+        return mail.readline()
+    except socket.timeout:
+        # O SocketIO do makefile() recusa novas leituras depois de um timeout; reabre o arquivo sobre o mesmo socket
+        mail.file = mail.sock.makefile('rb')
+        return None
+
+def aguardar_idle(mail, timeout_segundos, interromper=None):
+    """Entra em IDLE e bloqueia até EXISTS/RECENT, timeout ou `interromper` (threading.Event) ser sinalizado.
+
+    Retorna True se o servidor notificou mensagens novas. Sempre encerra o IDLE com DONE antes de retornar,
+    deixando a conexão pronta para os próximos comandos.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    linha = mail.readline()
+    if not linha.startswith(b'+'):
+        raise imaplib.IMAP4.error(f"Servidor recusou IDLE: {linha!r}")
+
+    novidade = False
+    timeout_original = mail.sock.gettimeout()
+    limite = time.monotonic() + timeout_segundos
+    try:
+        while not novidade:
+            restante = limite - time.monotonic()
+            if restante <= 0 or (interromper is not None and interromper.is_set()):
+                break
+            linha = _ler_linha_ate(mail, min(restante, INTERVALO_CHECAGEM_SEGUNDOS))
+            if linha is None:
+                continue
+            if not linha:
+                raise imaplib.IMAP4.abort("Conexão encerrada pelo servidor durante IDLE")
+            if linha.upper().startswith(b'* BYE'):
+                raise imaplib.IMAP4.abort(f"Servidor encerrou a sessão durante IDLE: {linha!r}")
+            if _NOTIFICACAO_NOVIDADE.match(linha):
+                novidade = True
+    finally:
+        mail.sock.settimeout(timeout_original)
+
+    mail.send(b'DONE\r\n')
+    while True:
+        linha = mail.readline()
+        if not linha:
+            raise imaplib.IMAP4.abort("Conexão encerrada pelo servidor ao finalizar IDLE")
+        if linha.startswith(tag):
+            if not linha[len(tag):].strip().upper().startswith(b'OK'):
+                raise imaplib.IMAP4.error(f"IDLE finalizado com erro: {linha!r}")
+            break
+        if _NOTIFICACAO_NOVIDADE.match(linha):
+            novidade = True
+    return novidade
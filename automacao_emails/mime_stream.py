@@ -0,0 +1,106 @@
+# mime_stream.py
+# Varredura leve de mensagens MIME: lê só os cabeçalhos de cada parte, pula anexos/imagens sem
+# decodificá-los e para na primeira parte text/html aceitável. Só a parte escolhida é decodificada.
+
+import base64
+import binascii
+import logging
+import quopri
+from email.parser import BytesHeaderParser
+
+from observabilidade import metricas
+
+MAX_PROFUNDIDADE = 10
+_parser_cabecalhos = BytesHeaderParser()
+logger = logging.getLogger(__name__)
+
+
+def _fim_cabecalhos(dados, inicio, fim):
+    """Posição onde começa o corpo (logo após a linha em branco que encerra os cabeçalhos)."""
+    if dados.startswith(b'\r\n', inicio) or dados.startswith(b'\n', inicio):
+        return inicio, dados.find(b'\n', inicio) + 1  # parte sem cabeçalhos
+    candidatos = [(p, p + 4) for p in [dados.find(b'\r\n\r\n', inicio, fim)] if p != -1]
+    candidatos += [(p, p + 2) for p in [dados.find(b'\n\n', inicio, fim)] if p != -1]
+    if not candidatos:
+        return fim, fim
+    return min(candidatos)
+
+def _decodificar(corpo, cabecalhos):
+    encoding = (cabecalhos.get('Content-Transfer-Encoding') or '').strip().lower()
+    try:
+        if encoding == 'base64': corpo = base64.b64decode(corpo)
+        elif encoding == 'quoted-printable': corpo = quopri.decodestring(corpo)
+    except (binascii.Error, ValueError) as e:
+        logger.warning("Erro ao decodificar parte (%s): %s", encoding, e)
+    charset = cabecalhos.get_content_charset() or 'utf-8'
+    try:
+        return corpo.decode(charset, errors='replace')
+    except LookupError:
+        return corpo.decode('utf-8', errors='replace')
+
+
+class _Varredura:
+    def __init__(self, dados, max_bytes_corpo):
+        self.dados = dados
+        self.max_bytes_corpo = max_bytes_corpo
+        self.corpo_html = None
+        self.corpo_texto = None
+
+    def concluida(self):
+        return self.corpo_html is not None and len(self.corpo_html) > 100
+
+    def varrer(self, inicio, fim, profundidade=0):
+        fim_cab, inicio_corpo = _fim_cabecalhos(self.dados, inicio, fim)
+        cabecalhos = _parser_cabecalhos.parsebytes(self.dados[inicio:fim_cab])
+        tipo = cabecalhos.get_content_type()
+        if tipo.startswith('multipart/'):
+            if profundidade < MAX_PROFUNDIDADE:
+                self._varrer_multipart(cabecalhos, inicio_corpo, fim, profundidade)
+            return cabecalhos
+        if tipo not in ('text/html', 'text/plain') or 'attachment' in str(cabecalhos.get('Content-Disposition', '')).lower():
+            return cabecalhos  # image/*, application/*, anexos...: nunca decodificados
+        if (tipo == 'text/html' and self.corpo_html is not None) or (tipo == 'text/plain' and self.corpo_texto is not None):
+            return cabecalhos
+        tamanho = fim - inicio_corpo
+        if self.max_bytes_corpo and tamanho > self.max_bytes_corpo:
+            logger.warning("Parte %s com %d bytes excede o limite de %d. Ignorada.", tipo, tamanho, self.max_bytes_corpo)
+            return cabecalhos
+        conteudo = _decodificar(self.dados[inicio_corpo:fim], cabecalhos)
+        if tipo == 'text/html': self.corpo_html = conteudo
+        else: self.corpo_texto = conteudo
+        return cabecalhos
+
+    def _varrer_multipart(self, cabecalhos, inicio, fim, profundidade):
+        boundary = cabecalhos.get_boundary()
+        if not boundary:
+            return
+        delimitador = b'\n--' + boundary.encode('ascii', errors='replace')
+        # O primeiro delimitador pode estar logo no início do corpo (sem quebra de linha antes)
+        pos = inicio - 1 if self.dados.startswith(delimitador[1:], inicio) else self.dados.find(delimitador, inicio, fim)
+        while pos != -1 and not self.concluida():
+            fim_delimitador = pos + len(delimitador)
+            if self.dados.startswith(b'--', fim_delimitador):
+                return  # delimitador de fechamento
+            inicio_parte = self.dados.find(b'\n', fim_delimitador, fim)
+            if inicio_parte == -1:
+                return
+            inicio_parte += 1
+            proximo = self.dados.find(delimitador, inicio_parte, fim)
+            fim_parte = proximo if proximo != -1 else fim
+            if fim_parte > inicio_parte and self.dados[fim_parte - 1:fim_parte] == b'\r':
+                fim_parte -= 1
+            self.varrer(inicio_parte, fim_parte, profundidade + 1)
+            pos = proximo
+
+
+@metricas.cronometrar("parse_mime")
+def parse_mensagem_stream(dados, max_bytes_corpo=None):
+    """Retorna (cabeçalhos da mensagem, conteúdo principal, tipo) a partir dos bytes RFC822.
+
+    O tipo segue a mesma regra de extrair_conteudo_principal: 'html' se houver HTML com mais de 100
+    caracteres, senão 'text', senão 'nenhum'."""
+    varredura = _Varredura(dados, max_bytes_corpo)
+    cabecalhos = varredura.varrer(0, len(dados))
+    if varredura.concluida(): return cabecalhos, varredura.corpo_html, "html"
+    if varredura.corpo_texto: return cabecalhos, varredura.corpo_texto, "text"
+    return cabecalhos, "", "nenhum"
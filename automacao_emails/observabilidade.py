@@ -0,0 +1,257 @@
+# observabilidade.py
+# Logging estruturado (texto ou JSON, com nível configurável) e métricas por etapa do pipeline:
+# contadores de sucesso/erro e histogramas de latência, expostos num endpoint HTTP local
+# (formato Prometheus em /metrics, JSON em /metrics.json, status do worker em /status.json) e/ou num
+# dump periódico no log.
+
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites superiores dos baldes do histograma de latência (segundos)
+LIMITES_HISTOGRAMA_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+
+# --- Logging ---
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+_contexto_log = contextvars.ContextVar('contexto_log', default={})
+
+@contextmanager
+def contexto_log(**campos):
+    """Anexa `campos` (ex: id_usuario) a todo log emitido dentro do bloco, nesta thread."""
+    token = _contexto_log.set({**_contexto_log.get(), **campos})
+    try:
+        yield
+    finally:
+        _contexto_log.reset(token)
+
+class _FiltroContexto(logging.Filter):
+    def filter(self, registro):
+        for chave, valor in _contexto_log.get().items():
+            if not hasattr(registro, chave): setattr(registro, chave, valor)
+        return True
+
+def _campos_extras(registro):
+    return {chave: valor for chave, valor in vars(registro).items() if chave not in _ATRIBUTOS_PADRAO}
+
+class FormatadorTexto(logging.Formatter):
+    """Linha legível com os campos estruturados no final: `... mensagem id_usuario=3 uid=120`."""
+
+    def __init__(self):
+        super().__init__("[%(asctime)s] [%(levelname)s] %(name)s: %(message)s", "%Y-%m-%d %H:%M:%S")
+
+    def formatMessage(self, registro):
+        linha = super().formatMessage(registro)
+        extras = _campos_extras(registro)
+        return linha + "".join(f" {chave}={valor}" for chave, valor in extras.items()) if extras else linha
+
+class FormatadorJSON(logging.Formatter):
+    """Um objeto JSON por linha, pronto para Loki/Elastic/CloudWatch."""
+
+    def format(self, registro):
+        dados = {"ts": self.formatTime(registro, "%Y-%m-%dT%H:%M:%S"), "nivel": registro.levelname, "logger": registro.name,
+                 "thread": registro.threadName, "msg": registro.getMessage(), **_campos_extras(registro)}
+        if registro.exc_info: dados["exc"] = self.formatException(registro.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+def configurar_logging(nivel="INFO", formato="texto"):
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(FormatadorJSON() if formato == "json" else FormatadorTexto())
+    handler.addFilter(_FiltroContexto())
+    raiz = logging.getLogger()
+    for anterior in list(raiz.handlers): raiz.removeHandler(anterior)
+    raiz.addHandler(handler)
+    raiz.setLevel(nivel.upper() if isinstance(nivel, str) else nivel)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+
+# --- Métricas ---
+class Histograma:
+    def __init__(self, limites=LIMITES_HISTOGRAMA_SEGUNDOS):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)  # o último balde é o +Inf
+        self.soma = 0.0
+        self.total = 0
+        self.maximo = 0.0
+
+    def observar(self, valor):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+        self.maximo = max(self.maximo, valor)
+
+    def quantil(self, q):
+        """Estimativa pelo limite superior do balde onde o quantil cai (como o histogram_quantile, sem interpolar)."""
+        if not self.total: return None
+        alvo, acumulado = q * self.total, 0
+        for indice, contagem in enumerate(self.contagens):
+            acumulado += contagem
+            if acumulado >= alvo:
+                return self.limites[indice] if indice < len(self.limites) else self.maximo
+        return self.maximo
+
+
+class _Medicao:
+    def __init__(self):
+        self.resultado = "ok"
+
+    def erro(self):
+        self.resultado = "erro"
+
+
+class RegistroMetricas:
+    """Contadores e histogramas de latência por etapa, seguros entre threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._histogramas = {}
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, etapa, segundos, resultado="ok"):
+        with self._lock:
+            histograma = self._histogramas.get(etapa)
+            if histograma is None:
+                histograma = self._histogramas[etapa] = Histograma()
+            histograma.observar(segundos)
+            chave = ("etapa", (("etapa", etapa), ("resultado", resultado)))
+            self._contadores[chave] = self._contadores.get(chave, 0) + 1
+
+    @contextmanager
+    def medir(self, etapa):
+        """Mede o bloco como uma execução de `etapa`. Exceções (ou medicao.erro()) contam como erro."""
+        medicao, inicio = _Medicao(), time.perf_counter()
+        try:
+            yield medicao
+        except BaseException:
+            medicao.erro()
+            raise
+        finally:
+            self.observar(etapa, time.perf_counter() - inicio, medicao.resultado)
+
+    def cronometrar(self, etapa, falhou=None):
+        """Decorador de `medir`. `falhou(resultado)` permite contar como erro funções que sinalizam falha pelo retorno."""
+        def decorador(funcao):
+            @functools.wraps(funcao)
+            def cronometrada(*args, **kwargs):
+                with self.medir(etapa) as medicao:
+                    resultado = funcao(*args, **kwargs)
+                    if falhou is not None and falhou(resultado): medicao.erro()
+                    return resultado
+            return cronometrada
+        return decorador
+
+    def zerar(self):
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+
+    def instantaneo(self):
+        """Cópia consistente das métricas: {'etapas': {...}, 'contadores': {...}}."""
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {etapa: (list(h.contagens), h.soma, h.total, h.maximo, h.quantil(0.5), h.quantil(0.95))
+                           for etapa, h in self._histogramas.items()}
+        etapas = {}
+        for etapa, (contagens, soma, total, maximo, p50, p95) in histogramas.items():
+            etapas[etapa] = {
+                "chamadas": total, "erros": contadores.get(("etapa", (("etapa", etapa), ("resultado", "erro"))), 0),
+                "soma_segundos": soma, "media_ms": soma / total * 1000 if total else None,
+                "p50_ms": p50 * 1000 if p50 is not None else None, "p95_ms": p95 * 1000 if p95 is not None else None,
+                "max_ms": maximo * 1000, "baldes": contagens,
+            }
+        outros = {}
+        for (nome, rotulos), valor in contadores.items():
+            if nome == "etapa": continue
+            sufixo = ",".join(f"{chave}={valor_rotulo}" for chave, valor_rotulo in rotulos)
+            outros[f"{nome}{{{sufixo}}}" if sufixo else nome] = valor
+        return {"etapas": etapas, "contadores": outros}
+
+    def formato_prometheus(self, prefixo="automacao_emails"):
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {etapa: (h.limites, list(h.contagens), h.soma, h.total) for etapa, h in self._histogramas.items()}
+        linhas = [f"# TYPE {prefixo}_etapa_duracao_segundos histogram"]
+        for etapa, (limites, contagens, soma, total) in sorted(histogramas.items()):
+            acumulado = 0
+            for limite, contagem in zip(list(limites) + ["+Inf"], contagens):
+                acumulado += contagem
+                linhas.append(f'{prefixo}_etapa_duracao_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+            linhas.append(f'{prefixo}_etapa_duracao_segundos_sum{{etapa="{etapa}"}} {soma}')
+            linhas.append(f'{prefixo}_etapa_duracao_segundos_count{{etapa="{etapa}"}} {total}')
+        nomes_vistos = set()
+        for (nome, rotulos), valor in sorted(contadores.items()):
+            if nome not in nomes_vistos:
+                linhas.append(f"# TYPE {prefixo}_{nome}_total counter")
+                nomes_vistos.add(nome)
+            rotulos_texto = ",".join(f'{chave}="{valor_rotulo}"' for chave, valor_rotulo in rotulos)
+            linhas.append(f"{prefixo}_{nome}_total{{{rotulos_texto}}} {valor}" if rotulos_texto else f"{prefixo}_{nome}_total {valor}")
+        return "\n".join(linhas) + "\n"
+
+
+metricas = RegistroMetricas()
+
+
+# --- Exposição ---
+_provedor_status = None
+
+def definir_provedor_status(funcao):
+    """`funcao()` devolve um objeto serializável em JSON, servido em /status.json."""
+    global _provedor_status
+    _provedor_status = funcao
+
+class _ManipuladorMetricas(BaseHTTPRequestHandler):
+    def log_message(self, formato, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            corpo, tipo = metricas.formato_prometheus().encode('utf-8'), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            corpo, tipo = json.dumps(metricas.instantaneo(), ensure_ascii=False).encode('utf-8'), "application/json"
+        elif self.path == "/status.json" and _provedor_status is not None:
+            corpo, tipo = json.dumps(_provedor_status(), ensure_ascii=False, default=str).encode('utf-8'), "application/json"
+        else:
+            self.send_error(404); return
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+def iniciar_servidor_metricas(porta, host="0.0.0.0"):
+    servidor = ThreadingHTTPServer((host, porta), _ManipuladorMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    logger.info("Métricas disponíveis em http://%s:%s/metrics", host, servidor.server_address[1])
+    return servidor
+
+def registrar_resumo_metricas(nivel=logging.INFO):
+    instantaneo = metricas.instantaneo()
+    for etapa, dados in sorted(instantaneo["etapas"].items()):
+        logger.log(nivel, "Métricas da etapa %s: %d chamada(s), %d erro(s), média %.1f ms, p95 <= %.1f ms, máx %.1f ms",
+                   etapa, dados["chamadas"], dados["erros"], dados["media_ms"], dados["p95_ms"], dados["max_ms"],
+                   extra={"etapa": etapa, "chamadas": dados["chamadas"], "erros": dados["erros"]})
+    if instantaneo["contadores"]:
+        logger.log(nivel, "Contadores: %s", instantaneo["contadores"])
+
+def iniciar_dump_periodico(intervalo_segundos, parar):
+    def executar():
+        while not parar.wait(intervalo_segundos):
+            registrar_resumo_metricas()
+    thread = threading.Thread(target=executar, name="metricas-dump", daemon=True)
+    thread.start()
+    return thread
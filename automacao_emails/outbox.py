@@ -0,0 +1,164 @@
+# outbox.py
+# Outbox durável (write-ahead) das corridas extraídas: cada corrida é gravada antes do envio,
+# confirmada quando a API responde 2xx e reenviada em segundo plano enquanto estiver pendente.
+
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+ESTADO_PENDENTE = 'pendente'
+ESTADO_CONFIRMADO = 'confirmado'
+ESTADO_REJEITADO = 'rejeitado'  # recusada pela API (4xx): fica guardada para consulta, mas não é reenviada
+
+logger = logging.getLogger(__name__)
+
+
+def gerar_chave_idempotencia(id_usuario, message_id, dados_corrida):
+    """Chave estável por e-mail: o mesmo Message-ID do mesmo usuário sempre gera a mesma chave.
+
+    Sem Message-ID, usa o conteúdo da corrida, o que ainda evita duplicatas em reprocessamentos do mesmo e-mail."""
+    if message_id:
+        base = f"{id_usuario}|{message_id.strip()}"
+    else:
+        base = f"{id_usuario}|{json.dumps(dados_corrida, sort_keys=True)}"
+    return hashlib.sha256(base.encode('utf-8')).hexdigest()
+
+
+class Outbox:
+    def __init__(self, caminho_arquivo, backoff_base_segundos=30, backoff_maximo_segundos=3600):
+        diretorio = os.path.dirname(caminho_arquivo)
+        if diretorio: os.makedirs(diretorio, exist_ok=True)
+        self.backoff_base_segundos = backoff_base_segundos
+        self.backoff_maximo_segundos = backoff_maximo_segundos
+        self._conexao = sqlite3.connect(caminho_arquivo, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conexao:
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    chave_idempotencia TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    tentativas INTEGER NOT NULL DEFAULT 0,
+                    proxima_tentativa REAL NOT NULL,
+                    ultimo_erro TEXT,
+                    criado_em TEXT NOT NULL,
+                    confirmado_em TEXT
+                )""")
+            self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pendentes ON outbox (estado, proxima_tentativa)")
+
+    def registrar(self, chave, dados_corrida, carencia_segundos=0):
+        """Grava a corrida como pendente. Retorna False se a chave já foi confirmada ou rejeitada (e-mail já enviado antes).
+
+        `carencia_segundos` adia a primeira tentativa do drenador, deixando o envio imediato do ciclo acontecer antes."""
+        with self._lock, self._conexao:
+            self._conexao.execute(
+                "INSERT OR IGNORE INTO outbox (chave_idempotencia, payload, estado, proxima_tentativa, criado_em) VALUES (?, ?, ?, ?, ?)",
+                (chave, json.dumps(dados_corrida), ESTADO_PENDENTE, time.time() + carencia_segundos, datetime.now().isoformat(timespec='seconds')))
+            estado = self._conexao.execute("SELECT estado FROM outbox WHERE chave_idempotencia = ?", (chave,)).fetchone()[0]
+        return estado == ESTADO_PENDENTE
+
+    def confirmar(self, chaves):
+        if not chaves: return
+        agora = datetime.now().isoformat(timespec='seconds')
+        with self._lock, self._conexao:
+            self._conexao.executemany(
+                "UPDATE outbox SET estado = ?, confirmado_em = ?, ultimo_erro = NULL WHERE chave_idempotencia = ?",
+                [(ESTADO_CONFIRMADO, agora, chave) for chave in chaves])
+
+    def registrar_falha(self, chaves, erro=None):
+        if not chaves: return
+        with self._lock, self._conexao:
+            for chave in chaves:
+                linha = self._conexao.execute("SELECT tentativas FROM outbox WHERE chave_idempotencia = ?", (chave,)).fetchone()
+                if not linha: continue
+                tentativas = linha[0] + 1
+                espera = min(self.backoff_maximo_segundos, self.backoff_base_segundos * (2 ** (tentativas - 1))) * random.uniform(0.8, 1.2)
+                self._conexao.execute(
+                    "UPDATE outbox SET tentativas = ?, proxima_tentativa = ?, ultimo_erro = ? WHERE chave_idempotencia = ? AND estado = ?",
+                    (tentativas, time.time() + espera, erro, chave, ESTADO_PENDENTE))
+
+    def rejeitar(self, chaves, erro=None):
+        if not chaves: return
+        with self._lock, self._conexao:
+            self._conexao.executemany(
+                "UPDATE outbox SET estado = ?, ultimo_erro = ? WHERE chave_idempotencia = ? AND estado = ?",
+                [(ESTADO_REJEITADO, erro, chave, ESTADO_PENDENTE) for chave in chaves])
+
+    def pendentes_prontos(self, limite, reserva_segundos=0):
+        """Retorna até `limite` pares (chave, dados_corrida) pendentes cuja próxima tentativa já venceu.
+
+        Com `reserva_segundos`, os itens devolvidos têm a próxima tentativa adiada por esse tempo na mesma transação,
+        para que outro processo drenando o mesmo arquivo (vários workers) não os envie também."""
+        agora = time.time()
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                linhas = self._conexao.execute(
+                    "SELECT chave_idempotencia, payload FROM outbox WHERE estado = ? AND proxima_tentativa <= ? ORDER BY proxima_tentativa LIMIT ?",
+                    (ESTADO_PENDENTE, agora, limite)).fetchall()
+                if reserva_segundos:
+                    self._conexao.executemany("UPDATE outbox SET proxima_tentativa = ? WHERE chave_idempotencia = ?",
+                                              [(agora + reserva_segundos, chave) for chave, _ in linhas])
+            except BaseException:
+                self._conexao.rollback()
+                raise
+            self._conexao.commit()
+        return [(chave, json.loads(payload)) for chave, payload in linhas]
+
+    def contar_pendentes(self):
+        with self._lock:
+            return self._conexao.execute("SELECT COUNT(*) FROM outbox WHERE estado = ?", (ESTADO_PENDENTE,)).fetchone()[0]
+
+    def remover_confirmados_antigos(self, dias_retencao):
+        # As chaves confirmadas ficam guardadas por um tempo para barrar reprocessamentos do mesmo e-mail
+        limite = (datetime.now() - timedelta(days=dias_retencao)).isoformat(timespec='seconds')
+        with self._lock, self._conexao:
+            return self._conexao.execute("DELETE FROM outbox WHERE estado = ? AND confirmado_em < ?", (ESTADO_CONFIRMADO, limite)).rowcount
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
+
+
+class DrenadorOutbox(threading.Thread):
+    """Thread que reenvia periodicamente as corridas pendentes, limitando a vazão a `max_por_segundo`."""
+
+    def __init__(self, outbox, enviar_itens, intervalo_segundos=60, tamanho_lote=50, max_por_segundo=20, dias_retencao=30, reserva_segundos=300):
+        super().__init__(name='drenador-outbox', daemon=True)
+        self.outbox = outbox
+        self.enviar_itens = enviar_itens  # recebe [(chave, dados_corrida)], confirma/registra falha no outbox
+        self.intervalo_segundos = intervalo_segundos
+        self.tamanho_lote = tamanho_lote
+        self.max_por_segundo = max_por_segundo
+        self.dias_retencao = dias_retencao
+        self.reserva_segundos = reserva_segundos  # itens em envio ficam fora do alcance de outros drenadores por esse tempo
+        self.parar = threading.Event()
+
+    def drenar(self):
+        enviados = 0
+        while not self.parar.is_set():
+            itens = self.outbox.pendentes_prontos(self.tamanho_lote, self.reserva_segundos)
+            if not itens: break
+            inicio = time.monotonic()
+            logger.info("Reenviando %d corrida(s) pendente(s) do outbox.", len(itens))
+            self.enviar_itens(itens)
+            enviados += len(itens)
+            # Limite de vazão: cada lote "custa" len(itens)/max_por_segundo segundos
+            espera = len(itens) / self.max_por_segundo - (time.monotonic() - inicio)
+            if espera > 0 and self.parar.wait(espera): break
+        return enviados
+
+    def run(self):
+        while not self.parar.wait(self.intervalo_segundos):
+            try:
+                self.drenar()
+                self.outbox.remover_confirmados_antigos(self.dias_retencao)
+            except Exception as e:
+                logger.exception("Falha ao drenar pendentes do outbox: %s", e)
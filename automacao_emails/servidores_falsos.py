@@ -0,0 +1,339 @@
+# servidores_falsos.py
+# Servidor IMAP e API de gastos falsos, em memória, para o benchmark rodar offline.
+# O IMAP implementa só o subconjunto que a automação usa (LOGIN, SELECT, STATUS, UID SEARCH/FETCH/STORE,
+# NOOP, IDLE); a API imita as rotas do gastos_ consultadas pelo script e conta o que recebeu.
+
+import email
+import json
+import os
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding as sym_padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+UIDVALIDITY = 1
+_COMANDO_REGEX = re.compile(rb'^(\S+) (UID )?(\S+)(?: (.*))?$', re.IGNORECASE)
+_SECAO_REGEX = re.compile(r'BODY\.PEEK\[([^\]]*)\]', re.IGNORECASE)
+_CAMPOS_REGEX = re.compile(r'HEADER\.FIELDS \(([^)]*)\)', re.IGNORECASE)
+
+
+def encriptar_senha_imap(senha, chave):
+    """Mesmo formato do backend Node.js (AES-256-CBC, 'iv_hex:texto_hex'), aceito por decrypt_imap_password."""
+    iv = os.urandom(16)
+    preenchedor = sym_padding.PKCS7(algorithms.AES.block_size).padder()
+    dados = preenchedor.update(senha.encode('utf-8')) + preenchedor.finalize()
+    encriptador = Cipher(algorithms.AES(chave), modes.CBC(iv), backend=default_backend()).encryptor()
+    return f"{iv.hex()}:{(encriptador.update(dados) + encriptador.finalize()).hex()}"
+
+
+# --- IMAP ---
+def _quote(valor):
+    return '"' + str(valor).replace('\\', '\\\\').replace('"', '\\"') + '"' if valor is not None else "NIL"
+
+def _bytes_da_parte(parte):
+    payload = parte.get_payload()
+    return payload.encode('ascii', errors='surrogateescape') if isinstance(payload, str) else b""
+
+def _bodystructure(parte):
+    if parte.is_multipart():
+        return "(" + "".join(_bodystructure(filho) for filho in parte.get_payload()) + f" {_quote(parte.get_content_subtype().upper())})"
+    params = (parte.get_params(header='content-type') or [])[1:]  # o primeiro par é o próprio tipo
+    lista_params = "(" + " ".join(f"{_quote(k.upper())} {_quote(v)}" for k, v in params) + ")" if params else "NIL"
+    corpo = _bytes_da_parte(parte)
+    campos = [_quote(parte.get_content_maintype().upper()), _quote(parte.get_content_subtype().upper()), lista_params,
+              _quote(parte.get("Content-ID")) if parte.get("Content-ID") else "NIL", "NIL",
+              _quote((parte.get("Content-Transfer-Encoding") or "7bit").upper()), str(len(corpo))]
+    if parte.get_content_maintype() == "text":
+        campos.append(str(corpo.count(b"\n") + 1))
+    disposicao = parte.get_content_disposition()
+    campos += ["NIL", f"({_quote(disposicao.upper())} NIL)" if disposicao else "NIL", "NIL"]
+    return "(" + " ".join(campos) + ")"
+
+def _secoes(parte, prefixo=""):
+    if not parte.is_multipart():
+        return {prefixo.rstrip('.') or "1": _bytes_da_parte(parte)}
+    secoes = {}
+    for indice, filho in enumerate(parte.get_payload(), start=1):
+        secoes.update(_secoes(filho, f"{prefixo}{indice}."))
+    return secoes
+
+
+class MensagemIMAP:
+    def __init__(self, uid, dados):
+        self.uid = uid
+        self.dados = dados
+        self.flags = set()
+        fim_cabecalhos = dados.find(b"\r\n\r\n")
+        self.cabecalhos_brutos = dados[:fim_cabecalhos + 2] if fim_cabecalhos != -1 else dados
+        msg = email.message_from_bytes(dados)
+        self.remetente = (msg.get("From") or "").lower()
+        self.bodystructure = _bodystructure(msg)
+        self.secoes = _secoes(msg)
+
+    def campos_cabecalho(self, nomes):
+        # Cabeçalhos dobrados (continuação iniciada por espaço) ficam junto com a linha anterior
+        nomes = {n.lower() for n in nomes}
+        linhas, incluir = [], False
+        for linha in self.cabecalhos_brutos.split(b"\r\n"):
+            if linha[:1] in (b" ", b"\t"):
+                if incluir: linhas.append(linha)
+                continue
+            incluir = linha.split(b":", 1)[0].decode('ascii', errors='replace').lower() in nomes
+            if incluir: linhas.append(linha)
+        return b"\r\n".join(linhas) + b"\r\n\r\n"
+
+
+class CaixaIMAP:
+    def __init__(self, mensagens=()):
+        self.mensagens = []
+        self._lock = threading.Lock()
+        for dados in mensagens:
+            self.adicionar(dados)
+
+    def adicionar(self, dados):
+        with self._lock:
+            uid = self.mensagens[-1].uid + 1 if self.mensagens else 1
+            self.mensagens.append(MensagemIMAP(uid, dados))
+            return uid
+
+    @property
+    def uidnext(self):
+        return self.mensagens[-1].uid + 1 if self.mensagens else 1
+
+    def por_conjunto(self, conjunto):
+        """Mensagens de um conjunto de UIDs como '1,3,5:7' ou '10:*'."""
+        uids = set()
+        maior = self.uidnext - 1
+        for faixa in conjunto.split(","):
+            inicio, _, fim = faixa.partition(":")
+            inicio = maior if inicio == "*" else int(inicio)
+            fim = inicio if not fim else (maior if fim == "*" else int(fim))
+            uids.update(range(min(inicio, fim), max(inicio, fim) + 1))
+        return [(seq, m) for seq, m in enumerate(self.mensagens, start=1) if m.uid in uids]
+
+    def buscar(self, criterio):
+        # Avaliação simplificada: OR entre os FROM, UNSEEN e "UID n:*"; SINCE/BEFORE são ignorados
+        remetentes = [r.lower() for r in re.findall(r'FROM "([^"]*)"', criterio, re.IGNORECASE)]
+        faixa_uid = re.search(r'UID (\S+?)\)?(?:\s|$)', criterio)
+        candidatas = [m for _, m in self.por_conjunto(faixa_uid.group(1))] if faixa_uid else list(self.mensagens)
+        return [m.uid for m in candidatas
+                if (not remetentes or any(r in m.remetente for r in remetentes))
+                and not ("UNSEEN" in criterio.upper() and "\\Seen" in m.flags)]
+
+
+class _ManipuladorIMAP(socketserver.StreamRequestHandler):
+    wbufsize = 64 * 1024  # respostas de um comando saem juntas, não uma escrita por linha
+
+    def _enviar(self, *linhas):
+        self.wfile.write(b"".join(l if isinstance(l, bytes) else l.encode('utf-8') for l in linhas))
+
+    def handle(self):
+        servidor = self.server
+        self._enviar("* OK [CAPABILITY IMAP4rev1 IDLE] Servidor IMAP falso pronto\r\n")
+        self.wfile.flush()
+        while True:
+            linha = self.rfile.readline()
+            if not linha: return
+            m = _COMANDO_REGEX.match(linha.rstrip(b"\r\n"))
+            if not m:
+                self._enviar("* BAD comando inválido\r\n"); continue
+            if servidor.latencia_segundos: time.sleep(servidor.latencia_segundos)
+            tag, comando, argumentos = m.group(1).decode(), m.group(3).decode().upper(), (m.group(4) or b"").decode('utf-8', errors='replace')
+            servidor.contar(comando)
+            continuar = self._executar(tag, comando, argumentos)
+            self.wfile.flush()
+            if not continuar:
+                return
+
+    def _executar(self, tag, comando, argumentos):
+        caixa = self.server.caixa
+        if comando == "CAPABILITY":
+            self._enviar("* CAPABILITY IMAP4rev1 IDLE\r\n", f"{tag} OK CAPABILITY concluído\r\n")
+        elif comando == "LOGIN":
+            senha = self.server.senha
+            if senha is not None and argumentos.rsplit(" ", 1)[-1].strip('"') != senha:
+                self._enviar(f"{tag} NO [AUTHENTICATIONFAILED] Credenciais inválidas\r\n")
+            else:
+                self._enviar(f"{tag} OK [CAPABILITY IMAP4rev1 IDLE] LOGIN concluído\r\n")
+        elif comando in ("SELECT", "EXAMINE"):
+            self._enviar(f"* {len(caixa.mensagens)} EXISTS\r\n", "* 0 RECENT\r\n",
+                         f"* OK [UIDVALIDITY {UIDVALIDITY}] UIDs válidos\r\n", f"* OK [UIDNEXT {caixa.uidnext}] Próximo UID\r\n",
+                         f"{tag} OK [READ-WRITE] {comando} concluído\r\n")
+        elif comando == "STATUS":
+            self._enviar(f"* STATUS inbox (UIDVALIDITY {UIDVALIDITY} UIDNEXT {caixa.uidnext})\r\n", f"{tag} OK STATUS concluído\r\n")
+        elif comando == "SEARCH":
+            self._enviar(f"* SEARCH {' '.join(str(uid) for uid in caixa.buscar(argumentos))}".rstrip() + "\r\n", f"{tag} OK SEARCH concluído\r\n")
+        elif comando == "FETCH":
+            conjunto, _, itens = argumentos.partition(" ")
+            for seq, mensagem in caixa.por_conjunto(conjunto):
+                self._enviar(*self._resposta_fetch(seq, mensagem, itens))
+            self._enviar(f"{tag} OK FETCH concluído\r\n")
+        elif comando == "STORE":
+            conjunto, _, _ = argumentos.partition(" ")
+            for seq, mensagem in caixa.por_conjunto(conjunto):
+                if "\\Seen" in argumentos: mensagem.flags.add("\\Seen")
+                self._enviar(f"* {seq} FETCH (UID {mensagem.uid} FLAGS ({' '.join(sorted(mensagem.flags))}))\r\n")
+            self._enviar(f"{tag} OK STORE concluído\r\n")
+        elif comando == "IDLE":
+            self._enviar("+ idling\r\n")
+            self.wfile.flush()
+            while self.rfile.readline().strip().upper() != b"DONE":
+                pass
+            self._enviar(f"{tag} OK IDLE encerrado\r\n")
+        elif comando in ("NOOP", "CLOSE"):
+            self._enviar(f"{tag} OK {comando} concluído\r\n")
+        elif comando == "LOGOUT":
+            self._enviar("* BYE até logo\r\n", f"{tag} OK LOGOUT concluído\r\n")
+            return False
+        else:
+            self._enviar(f"{tag} BAD comando não suportado: {comando}\r\n")
+        return True
+
+    def _resposta_fetch(self, seq, mensagem, itens):
+        partes = [f"* {seq} FETCH (UID {mensagem.uid}"]
+        if "BODYSTRUCTURE" in itens.upper():
+            partes.append(f" BODYSTRUCTURE {mensagem.bodystructure}")
+        secao = _SECAO_REGEX.search(itens)
+        if secao:
+            nome_secao = secao.group(1)
+            campos = _CAMPOS_REGEX.match(nome_secao)
+            if campos: literal = mensagem.campos_cabecalho(campos.group(1).split())
+            elif nome_secao == "": literal = mensagem.dados
+            else: literal = mensagem.secoes.get(nome_secao, b"")
+            partes.append(f" BODY[{nome_secao}] {{{len(literal)}}}\r\n")
+            partes.append(literal)
+        partes.append(")\r\n")
+        return partes
+
+
+class ServidorIMAPFalso(socketserver.ThreadingTCPServer):
+    """IMAP sem TLS que serve uma única caixa em memória. Aceita qualquer login, a menos que `senha` seja definida."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mensagens=(), host="127.0.0.1", porta=0, latencia_segundos=0, senha=None):
+        super().__init__((host, porta), _ManipuladorIMAP)
+        self.caixa = CaixaIMAP(mensagens)
+        self.senha = senha  # pode ser trocada em execução para simular a rotação da senha de app
+        self.latencia_segundos = latencia_segundos  # simula a ida e volta até o servidor real
+        self.contagem_comandos = {}
+        self._lock_contagem = threading.Lock()
+
+    @property
+    def porta(self):
+        return self.server_address[1]
+
+    def contar(self, comando):
+        with self._lock_contagem:
+            self.contagem_comandos[comando] = self.contagem_comandos.get(comando, 0) + 1
+
+    def iniciar(self):
+        threading.Thread(target=self.serve_forever, name="imap-falso", daemon=True).start()
+        return self
+
+
+# --- API de gastos ---
+class _ManipuladorAPI(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como o Express
+    wbufsize = 64 * 1024  # cabeçalhos e corpo no mesmo envio (evita a espera do Nagle/ACK atrasado)
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, status, corpo):
+        dados = json.dumps(corpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _corpo_json(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(tamanho) or b"{}")
+
+    def do_GET(self):
+        api, url = self.server, urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if api.latencia_segundos: time.sleep(api.latencia_segundos)
+        api.contar(f"GET {url.path}")
+        if url.path.endswith("/obter-credenciais-imap"):
+            self._responder(200, {"email_login": api.email_login, "encrypted_password_with_iv": api.senha_encriptada})
+        elif url.path == "/api/usuarios":
+            self._responder(200, [{"id_usuario": id_usuario, "email_login": api.email_login, "email_app_password_encrypted": api.senha_encriptada}
+                                  for id_usuario in api.ids_usuarios])
+        elif url.path in ("/api/aplicativos", "/api/formas-pagamentos"):
+            tabela, campo = api.tabela(url.path)
+            item = tabela.get(params.get(campo))
+            if item: self._responder(200, [item])
+            else: self._responder(404, {"message": "Nenhum item encontrado"})
+        else:
+            self._responder(404, {"message": "Rota não encontrada"})
+
+    def do_POST(self):
+        api, url = self.server, urlparse(self.path)
+        corpo = self._corpo_json()
+        if api.latencia_segundos: time.sleep(api.latencia_segundos)
+        api.contar(f"POST {url.path}")
+        if url.path in ("/api/aplicativos", "/api/formas-pagamentos"):
+            tabela, campo = api.tabela(url.path)
+            with api.lock:
+                if corpo.get(campo) in tabela:
+                    self._responder(409, {"message": "Já existe"}); return
+                item = dict(corpo, **{api.CAMPOS_ID[url.path]: len(tabela) + 1})
+                tabela[corpo.get(campo)] = item
+            self._responder(201, item)
+        elif url.path == "/api/corridas":
+            self._responder(*api.registrar_corridas([corpo]))
+        elif url.path == "/api/corridas/lote":
+            self._responder(*api.registrar_corridas(corpo.get("corridas") or []))
+        else:
+            self._responder(404, {"message": "Rota não encontrada"})
+
+
+class APIGastosFalsa(ThreadingHTTPServer):
+    """Rotas do gastos_ usadas pela automação, com a mesma deduplicação por `chave_idempotencia`."""
+    daemon_threads = True
+    CAMPOS_ID = {"/api/aplicativos": "id_apps", "/api/formas-pagamentos": "id_forma_pagamento"}
+
+    def __init__(self, chave_encriptacao, email_login="passageiro@example.com", senha="senha-de-app",
+                 ids_usuarios=(1,), host="127.0.0.1", porta=0, latencia_segundos=0):
+        super().__init__((host, porta), _ManipuladorAPI)
+        self.email_login = email_login
+        self.senha_encriptada = encriptar_senha_imap(senha, chave_encriptacao)
+        self.ids_usuarios = list(ids_usuarios)
+        self.latencia_segundos = latencia_segundos
+        self.aplicativos, self.formas_pagamento = {}, {}
+        self.corridas = {}
+        self.duplicadas = 0
+        self.contagem_requisicoes = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url_base(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/api"
+
+    def tabela(self, caminho):
+        return (self.aplicativos, "email") if caminho == "/api/aplicativos" else (self.formas_pagamento, "descricao")
+
+    def contar(self, rota):
+        with self.lock:
+            self.contagem_requisicoes[rota] = self.contagem_requisicoes.get(rota, 0) + 1
+
+    def registrar_corridas(self, corridas):
+        with self.lock:
+            for corrida in corridas:
+                chave = corrida.get("chave_idempotencia") or f"sem-chave-{len(self.corridas)}"
+                if chave in self.corridas: self.duplicadas += 1
+                else: self.corridas[chave] = corrida
+        return 201, {"quantidade": len(corridas)}
+
+    def iniciar(self):
+        threading.Thread(target=self.serve_forever, name="api-gastos-falsa", daemon=True).start()
+        return self
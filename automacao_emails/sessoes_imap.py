@@ -0,0 +1,172 @@
+# sessoes_imap.py
+# Conexões IMAP autenticadas reaproveitadas entre ciclos: cada caixa mantém sua conexão aberta,
+# verificada com NOOP quando ficou parada, e só é refeita quando cai, falha ou fica ociosa demais.
+
+import imaplib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from observabilidade import metricas
+
+logger = logging.getLogger(__name__)
+
+
+class SessaoIMAP:
+    def __init__(self, mail, login):
+        self.mail = mail
+        self.login = login
+        self.criada_em = time.monotonic()
+        self.ultimo_uso = self.criada_em
+
+
+def _encerrar(mail):
+    try: mail.logout()
+    except Exception: pass
+
+
+class GerenciadorSessoesIMAP:
+    """Mantém uma sessão por usuário. `conectar(id_usuario)` deve devolver (mail, login) já autenticado e com a
+    caixa selecionada, ou levantar exceção.
+
+    Sessões usadas há menos de `noop_apos_segundos` são reaproveitadas direto; acima disso passam por um NOOP;
+    acima de `ociosa_max_segundos` são descartadas sem teste (o servidor provavelmente já as encerrou).
+    Cada usuário usa a própria sessão com exclusividade; usuários diferentes não se bloqueiam.
+
+    `max_sessoes` limita as conexões abertas (em uso ou paradas): no limite, a sessão ociosa usada há mais tempo
+    é encerrada antes de abrir outra; se todas estiverem em uso, espera uma ser devolvida. 0 = sem limite.
+    """
+
+    def __init__(self, conectar, noop_apos_segundos=60, ociosa_max_segundos=1500, persistir=True, max_sessoes=0):
+        self._conectar = conectar
+        self.noop_apos_segundos = noop_apos_segundos
+        self.ociosa_max_segundos = ociosa_max_segundos
+        self.persistir = persistir
+        self.max_sessoes = max_sessoes
+        self._sessoes = {}
+        self._abrindo = 0  # conexões sendo abertas agora, já contadas no limite
+        self._locks_usuario = {}
+        self._lock = threading.Lock()
+        self._devolvida = threading.Condition(self._lock)
+
+    def _lock_do_usuario(self, chave):
+        with self._lock:
+            lock = self._locks_usuario.get(chave)
+            if lock is None:
+                lock = self._locks_usuario[chave] = threading.Lock()
+            return lock
+
+    def _ainda_valida(self, sessao):
+        parada = time.monotonic() - sessao.ultimo_uso
+        if parada > self.ociosa_max_segundos: return False
+        if parada < self.noop_apos_segundos: return True
+        try:
+            status, _ = sessao.mail.noop()
+            return status == 'OK'
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.info("Sessão IMAP de %s não respondeu ao NOOP (%s).", sessao.login, e)
+            return False
+
+    def _reservar_vaga(self):
+        """Reserva espaço para uma conexão nova, encerrando a sessão ociosa menos recente se o limite foi atingido."""
+        while True:
+            with self._lock:
+                if not self.max_sessoes or len(self._sessoes) + self._abrindo < self.max_sessoes:
+                    self._abrindo += 1
+                    return
+                for chave, sessao in sorted(self._sessoes.items(), key=lambda item: item[1].ultimo_uso):
+                    lock = self._locks_usuario[chave]
+                    if lock.acquire(blocking=False): # em uso agora: não pode ser encerrada
+                        del self._sessoes[chave]
+                        self._abrindo += 1
+                        break
+                else:
+                    # Todas em uso: espera uma ser devolvida (o timeout cobre a devolução sem notificação)
+                    self._devolvida.wait(1)
+                    continue
+            try:
+                metricas.incrementar("sessoes_imap", resultado="encerrada_por_limite")
+                logger.info("Limite de %d conexões IMAP atingido. Encerrando a sessão ociosa de %s.", self.max_sessoes, sessao.login)
+                _encerrar(sessao.mail)
+            finally:
+                lock.release()
+            return
+
+    def _conectar_na_vaga(self, chave, id_usuario):
+        self._reservar_vaga()
+        try:
+            mail, login = self._conectar(id_usuario)
+        except BaseException:
+            with self._lock:
+                self._abrindo -= 1
+                self._devolvida.notify()
+            raise
+        sessao = SessaoIMAP(mail, login)
+        with self._lock:
+            self._abrindo -= 1
+            self._sessoes[chave] = sessao
+        metricas.incrementar("sessoes_imap", resultado="nova")
+        return sessao
+
+    def _descartar(self, chave):
+        with self._lock:
+            sessao = self._sessoes.pop(chave, None)
+        if sessao is not None:
+            metricas.incrementar("sessoes_imap", resultado="descartada")
+            _encerrar(sessao.mail)
+            with self._lock:
+                self._devolvida.notify()
+
+    @contextmanager
+    def sessao(self, id_usuario):
+        """Empresta a sessão do usuário (reaproveitada ou nova). Erros IMAP/de rede dentro do bloco descartam a conexão."""
+        chave = str(id_usuario)
+        with self._lock_do_usuario(chave):
+            with self._lock:
+                sessao = self._sessoes.get(chave)
+            if sessao is not None and not self._ainda_valida(sessao):
+                self._descartar(chave)
+                sessao = None
+            if sessao is None:
+                sessao = self._conectar_na_vaga(chave, id_usuario)
+            else:
+                # Respostas não solicitadas (EXISTS, RECENT...) se acumulariam indefinidamente numa conexão longa
+                sessao.mail.untagged_responses.clear()
+                metricas.incrementar("sessoes_imap", resultado="reutilizada")
+            try:
+                yield sessao
+            except (imaplib.IMAP4.error, OSError):
+                self._descartar(chave)
+                raise
+            sessao.ultimo_uso = time.monotonic()
+            if not self.persistir:
+                self._descartar(chave)
+        with self._lock:
+            self._devolvida.notify()  # a sessão ficou ociosa: quem espera uma vaga pode encerrá-la
+
+    def descartar(self, id_usuario):
+        with self._lock_do_usuario(str(id_usuario)):
+            self._descartar(str(id_usuario))
+
+    def fechar_ociosas(self):
+        """Encerra sessões paradas há mais de `ociosa_max_segundos` (ex: usuários que saíram da lista)."""
+        limite = time.monotonic() - self.ociosa_max_segundos
+        with self._lock:
+            ociosas = [chave for chave, sessao in self._sessoes.items() if sessao.ultimo_uso < limite]
+        for chave in ociosas:
+            lock = self._lock_do_usuario(chave)
+            if lock.acquire(blocking=False):  # em uso agora: não está ociosa
+                try: self._descartar(chave)
+                finally: lock.release()
+        return len(ociosas)
+
+    def fechar_todas(self):
+        with self._lock:
+            chaves = list(self._sessoes)
+        for chave in chaves:
+            self._descartar(chave)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessoes)
@@ -0,0 +1,79 @@
+# test_agendador.py
+# Intervalo adaptativo, backoff e orçamento do agendador, sem threads (jitter zerado para valores exatos).
+# Executar com: python -m unittest discover -s automacao_emails
+
+import time
+import unittest
+
+from agendador import AgendadorCaixas, OrcamentoVerificacoes
+
+
+def agendador(verificar=lambda id_usuario: 0, **opcoes):
+    return AgendadorCaixas(verificar, intervalo_inicial=300, intervalo_minimo=60, intervalo_maximo=1800, backoff_maximo=600, jitter=0, **opcoes)
+
+
+class TesteIntervaloAdaptativo(unittest.TestCase):
+    def setUp(self):
+        self.agendador = agendador()
+        self.agendador.sincronizar([1])
+        self.caixa = self.agendador._caixas[1]
+
+    def atraso(self):
+        return self.caixa.proxima_verificacao - time.monotonic()
+
+    def test_muitos_recibos_limitam_ao_minimo(self):
+        for _ in range(3):
+            self.agendador._registrar_sucesso(self.caixa, 50, time.monotonic())
+        self.assertEqual(self.caixa.intervalo, 60)
+        self.assertAlmostEqual(self.atraso(), 60, delta=1)
+
+    def test_caixa_parada_cresce_ate_o_maximo(self):
+        intervalos = []
+        for _ in range(20):
+            self.agendador._registrar_sucesso(self.caixa, 0, time.monotonic())
+            intervalos.append(self.caixa.intervalo)
+        self.assertEqual(intervalos, sorted(intervalos))
+        self.assertEqual(intervalos[-1], 1800)
+        self.assertTrue(all(60 <= intervalo <= 1800 for intervalo in intervalos))
+
+    def test_backoff_cresce_e_para_no_maximo(self):
+        atrasos = []
+        for _ in range(6):
+            self.agendador._registrar_falha(self.caixa)
+            atrasos.append(round(self.atraso()))
+        # intervalo normal (300) é o piso; depois 60 * 2^n até backoff_maximo
+        self.assertEqual(atrasos, [300, 300, 480, 600, 600, 600])
+        self.assertEqual(self.caixa.falhas_consecutivas, 6)
+        self.agendador._registrar_sucesso(self.caixa, 1, time.monotonic())
+        self.assertEqual(self.caixa.falhas_consecutivas, 0)
+
+    def test_excecao_na_verificacao_conta_como_falha(self):
+        def verificar(id_usuario): raise OSError("conexão recusada")
+        ag = agendador(verificar)
+        ag.sincronizar([1])
+        caixa = ag._caixas[1]
+        caixa.em_execucao, ag._em_execucao = True, 1
+        with self.assertLogs("agendador", "ERROR"):
+            ag._executar_caixa(caixa)
+        self.assertEqual((caixa.falhas_consecutivas, caixa.em_execucao, ag._em_execucao), (1, False, 0))
+
+    def test_caixa_removida_sai_do_estado(self):
+        self.agendador.sincronizar([2, 3])
+        self.assertEqual(sorted(c["id_usuario"] for c in self.agendador.instantaneo()), [2, 3])
+
+
+class TesteOrcamento(unittest.TestCase):
+    def test_recusa_quando_as_fichas_acabam(self):
+        orcamento = OrcamentoVerificacoes(60)  # 1/s, rajada de 10
+        self.assertEqual(sum(orcamento.consumir() for _ in range(15)), 10)
+        self.assertFalse(orcamento.consumir())
+        self.assertAlmostEqual(orcamento.espera(), 1.0, delta=0.1)
+
+    def test_sem_limite(self):
+        orcamento = OrcamentoVerificacoes(0)
+        self.assertTrue(all(orcamento.consumir() for _ in range(1000)))
+        self.assertEqual(orcamento.espera(), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
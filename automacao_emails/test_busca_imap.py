@@ -0,0 +1,91 @@
+# test_busca_imap.py
+# Parser de respostas FETCH/BODYSTRUCTURE. Os dados imitam o formato devolvido pelo imaplib:
+# literais {n} chegam como tuplas (prefixo, literal) intercaladas com bytes.
+# Executar com: python -m unittest discover -s automacao_emails
+
+import unittest
+
+import busca_imap
+
+ALTERNATIVA = (b'("text" "plain" ("charset" "iso-8859-1") NIL NIL "quoted-printable" 120 4 NIL NIL NIL NIL)'
+               b'("text" "html" ("charset" "utf-8") NIL NIL "base64" 3400 44 NIL NIL NIL NIL) "alternative" ("boundary" "alt") NIL NIL NIL')
+
+
+class TesteParseRespostaFetch(unittest.TestCase):
+    def test_varias_mensagens_com_cabecalhos_literais(self):
+        dados = [
+            (b'1 (UID 10 BODYSTRUCTURE ("text" "html" ("charset" "utf-8") NIL NIL "7bit" 50 2 NIL NIL NIL NIL) BODY[HEADER.FIELDS (FROM)] {24}',
+             b'From: noreply@uber.com\r\n'), b')',
+            (b'2 (UID 11 BODYSTRUCTURE ("text" "plain" NIL NIL NIL "7bit" 5 1 NIL NIL NIL NIL) BODY[HEADER.FIELDS (FROM)] {22}',
+             b'From: outro@exemplo.br'), b')',
+        ]
+        mensagens = busca_imap.parse_resposta_fetch(dados)
+        self.assertEqual([m["UID"] for m in mensagens], [b'10', b'11'])
+        self.assertEqual(mensagens[0]["BODY[HEADER.FIELDS (FROM)]"], b'From: noreply@uber.com\r\n')
+        self.assertEqual(busca_imap.listar_partes(mensagens[1]["BODYSTRUCTURE"])[0]["charset"], "utf-8")  # NIL: padrão
+
+    def test_literal_dentro_do_bodystructure(self):
+        dados = [
+            (b'1 (UID 12 BODYSTRUCTURE (("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 10 1 NIL NIL NIL NIL)'
+             b'("application" "pdf" ("name" {10}', b'recibo.pdf'),
+            (b') NIL NIL "base64" 2000 NIL ("attachment" ("filename" "recibo.pdf")) NIL NIL) "mixed" ("boundary" "x") NIL NIL NIL)'
+             b' BODY[HEADER.FIELDS (FROM)] {20}', b'From: a@uber.com\r\n\r\n'), b')',
+        ]
+        itens = busca_imap.parse_resposta_fetch(dados)[0]
+        self.assertEqual(itens["UID"], b'12')
+        self.assertEqual(itens["BODY[HEADER.FIELDS (FROM)]"], b'From: a@uber.com\r\n\r\n')
+        partes = busca_imap.listar_partes(itens["BODYSTRUCTURE"])
+        self.assertEqual([(p["secao"], p["tipo"], p["anexo"]) for p in partes], [("1", "text/plain", False), ("2", "application/pdf", True)])
+
+    def test_string_com_aspas_escapadas(self):
+        itens = busca_imap.parse_resposta_fetch([b'1 (UID 3 X-ITEM "a \\"b\\" c")'])[0]
+        self.assertEqual(itens["X-ITEM"], b'a "b" c')
+
+    def test_corpo_com_crlf_e_lf(self):
+        for corpo in (b'<p>R$ 12,50</p>\r\n<p>fim</p>\r\n', b'<p>R$ 12,50</p>\n<p>fim</p>\n'):
+            dados = [(b'4 (UID 40 BODY[1.2] {%d}' % len(corpo), corpo), b')']
+            itens = busca_imap.parse_resposta_fetch(dados)[0]
+            self.assertEqual(itens["UID"], b'40')
+            self.assertEqual(itens["BODY[1.2]"], corpo)
+
+
+class TesteBodystructure(unittest.TestCase):
+    def _estrutura(self, texto):
+        return busca_imap.parse_resposta_fetch([b'1 (UID 1 BODYSTRUCTURE ' + texto + b')'])[0]["BODYSTRUCTURE"]
+
+    def test_alternative_dentro_de_mixed(self):
+        estrutura = self._estrutura(
+            b'((' + ALTERNATIVA + b')("application" "pdf" ("name" "r.pdf") NIL NIL "base64" 9000 NIL ("attachment" ("filename" "r.pdf")) NIL NIL)'
+            b' "mixed" ("boundary" "mix") NIL NIL NIL)')
+        partes = busca_imap.listar_partes(estrutura)
+        self.assertEqual([p["secao"] for p in partes], ["1.1", "1.2", "2"])
+        principal = busca_imap.escolher_parte_principal(estrutura)
+        self.assertEqual((principal["secao"], principal["tipo"], principal["encoding"], principal["tamanho"]), ("1.2", "text/html", "base64", 3400))
+
+    def test_prefere_texto_quando_nao_ha_html(self):
+        estrutura = self._estrutura(b'("text" "plain" ("charset" "iso-8859-1") NIL NIL "quoted-printable" 120 4 NIL NIL NIL NIL)')
+        principal = busca_imap.escolher_parte_principal(estrutura)
+        self.assertEqual((principal["secao"], principal["charset"]), ("1", "iso-8859-1"))
+
+    def test_html_anexado_nao_e_parte_principal(self):
+        estrutura = self._estrutura(
+            b'(("text" "plain" NIL NIL NIL "7bit" 5 1 NIL NIL NIL NIL)'
+            b'("text" "html" ("charset" "utf-8") NIL NIL "7bit" 80 3 NIL ("attachment" ("filename" "a.html")) NIL NIL) "mixed" ("boundary" "b") NIL NIL NIL)')
+        self.assertEqual(busca_imap.escolher_parte_principal(estrutura)["tipo"], "text/plain")
+
+    def test_decodificar_parte(self):
+        parte = {"secao": "1", "encoding": "quoted-printable", "charset": "iso-8859-1"}
+        self.assertEqual(busca_imap.decodificar_parte(b'Cart=E3o', parte), "Cartão")
+        parte = {"secao": "1", "encoding": "base64", "charset": "charset-inexistente"}
+        self.assertEqual(busca_imap.decodificar_parte(b'b2k=', parte), "oi")  # charset desconhecido: cai para utf-8
+
+
+class TesteCriterioBusca(unittest.TestCase):
+    def test_or_binario_aninhado(self):
+        self.assertEqual(busca_imap.montar_criterio_busca(["a@x", "b@x", "c@x"], "UNSEEN"),
+                         '(UNSEEN OR FROM "a@x" OR FROM "b@x" FROM "c@x")')
+        self.assertEqual(busca_imap.montar_criterio_busca([], "UID 5:*"), "(UID 5:*)")
+
+
+if __name__ == "__main__":
+    unittest.main()
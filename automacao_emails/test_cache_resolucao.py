@@ -0,0 +1,88 @@
+# test_cache_resolucao.py
+# LRU + TTL, cache negativo e coalescência de consultas concorrentes.
+# Executar com: python -m unittest discover -s automacao_emails
+
+import threading
+import time
+import unittest
+
+from cache_resolucao import CacheResolucao
+
+
+class TesteCoalescencia(unittest.TestCase):
+    def test_uma_consulta_para_varias_threads(self):
+        cache, liberar, chamadas = CacheResolucao(), threading.Event(), []
+
+        def calcular():
+            chamadas.append(1)
+            liberar.wait(5)
+            return 42
+        resultados = []
+        threads = [threading.Thread(target=lambda: resultados.append(cache.obter_ou_calcular("app", calcular))) for _ in range(8)]
+        for thread in threads: thread.start()
+        time.sleep(0.1)  # as demais chegam enquanto a primeira ainda calcula
+        liberar.set()
+        for thread in threads: thread.join(5)
+        self.assertEqual(len(chamadas), 1)
+        self.assertEqual(resultados, [42] * 8)
+
+    def test_em_espera_tentam_de_novo_se_o_calculo_falha(self):
+        cache, calculando, liberar, chamadas = CacheResolucao(), threading.Event(), threading.Event(), []
+
+        def calcular():
+            chamadas.append(1)
+            if len(chamadas) == 1:
+                calculando.set()
+                liberar.wait(5)
+                raise ConnectionError("API fora")
+            return 42
+        erros, resultados = [], []
+
+        def primeira():
+            try: cache.obter_ou_calcular("app", calcular)
+            except ConnectionError as e: erros.append(e)
+        threads = [threading.Thread(target=primeira)]
+        threads[0].start()
+        calculando.wait(5)
+        threads += [threading.Thread(target=lambda: resultados.append(cache.obter_ou_calcular("app", calcular))) for _ in range(4)]
+        for thread in threads[1:]: thread.start()
+        time.sleep(0.1)
+        liberar.set()
+        for thread in threads: thread.join(5)
+        self.assertEqual(len(erros), 1)  # a exceção vai só para quem calculou
+        self.assertEqual(resultados, [42] * 4)
+        self.assertEqual(len(chamadas), 2)  # uma das que esperavam recalculou; as outras aproveitaram
+        self.assertEqual(cache.obter("app"), (True, 42))
+
+
+class TesteExpiracao(unittest.TestCase):
+    def test_none_expira_apos_ttl_negativo(self):
+        cache = CacheResolucao(ttl_segundos=60, ttl_negativo_segundos=0.05)
+        cache.definir("inexistente", None)
+        self.assertEqual(cache.obter("inexistente"), (True, None))
+        time.sleep(0.1)
+        self.assertEqual(cache.obter("inexistente"), (False, None))
+        cache.definir("app", 7)
+        self.assertEqual(cache.obter("app"), (True, 7))  # o TTL positivo é outro
+
+    def test_ttl_zero_nao_guarda(self):
+        cache, chamadas = CacheResolucao(ttl_negativo_segundos=0), []
+        calcular = lambda: chamadas.append(1)  # devolve None
+        cache.obter_ou_calcular("inexistente", calcular)
+        cache.obter_ou_calcular("inexistente", calcular)
+        self.assertEqual(len(chamadas), 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_descarta_o_menos_usado(self):
+        cache = CacheResolucao(max_itens=2)
+        cache.definir("a", 1)
+        cache.definir("b", 2)
+        cache.obter("a")  # "b" passa a ser o menos recente
+        cache.definir("c", 3)
+        self.assertEqual([cache.obter(chave)[0] for chave in ("a", "b", "c")], [True, False, True])
+        cache.invalidar("a")
+        self.assertEqual(len(cache), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# test_coordenacao.py
+# Leases de caixas entre dois workers no mesmo SQLite (arquivo temporário, sem threads de coordenação).
+# Executar com: python -m unittest discover -s automacao_emails
+
+import os
+import tempfile
+import time
+import unittest
+
+from coordenacao import CoordenadorLeases
+
+USUARIOS = list(range(1, 21))
+
+
+class TesteCoordenadorLeases(unittest.TestCase):
+    def setUp(self):
+        diretorio = tempfile.TemporaryDirectory(prefix="coordenacao_")
+        self.addCleanup(diretorio.cleanup)
+        self.arquivo = os.path.join(diretorio.name, "coordenacao.db")
+
+    def worker(self, id_worker, duracao_lease_segundos=90):
+        coordenador = CoordenadorLeases(self.arquivo, id_worker, duracao_lease_segundos)
+        self.addCleanup(coordenador.fechar)
+        return coordenador
+
+    def preferidas(self, id_worker, workers):
+        return {u for u in USUARIOS if CoordenadorLeases.dono_preferido(str(u), workers) == id_worker}
+
+    def dono_da_lease(self, coordenador, id_usuario):
+        return next(lease["id_worker"] for lease in coordenador.leases() if lease["id_usuario"] == str(id_usuario))
+
+    def test_segundo_worker_divide_as_caixas(self):
+        a, b = self.worker("a"), self.worker("b")
+        self.assertEqual(a.equilibrar(USUARIOS), set(USUARIOS))
+        # b entra: as preferidas dele ainda estão com a, que só as solta na rodada seguinte
+        self.assertEqual(b.equilibrar(USUARIOS), set())
+        caixas_a = a.equilibrar(USUARIOS)
+        caixas_b = b.equilibrar(USUARIOS)
+        self.assertEqual(caixas_a, self.preferidas("a", ["a", "b"]))
+        self.assertEqual(caixas_b, self.preferidas("b", ["a", "b"]))
+        self.assertEqual(caixas_a | caixas_b, set(USUARIOS))
+        self.assertFalse(caixas_a & caixas_b)
+        self.assertTrue(caixas_a and caixas_b)
+        self.assertEqual({lease["id_worker"] for lease in a.leases()}, {"a", "b"})
+
+    def test_caixa_em_uso_nao_e_liberada(self):
+        a, b = self.worker("a"), self.worker("b")
+        a.equilibrar(USUARIOS)
+        b.batimento()
+        em_uso = min(self.preferidas("b", ["a", "b"]))
+        with a.reservar(em_uso) as possui:
+            self.assertTrue(possui)
+            a.equilibrar(USUARIOS)  # já não é preferida de a, mas está em verificação
+            self.assertFalse(a.liberar(str(em_uso)))
+            self.assertEqual(self.dono_da_lease(a, em_uso), "a")
+            self.assertNotIn(em_uso, b.equilibrar(USUARIOS))
+            with b.reservar(em_uso) as possui_b:
+                self.assertFalse(possui_b)
+        a.equilibrar(USUARIOS)  # fora do bloco, a solta a caixa
+        self.assertIn(em_uso, b.equilibrar(USUARIOS))
+
+    def test_lease_vencida_passa_para_o_worker_vivo(self):
+        a, b = self.worker("a", 0.3), self.worker("b", 0.3)
+        a.equilibrar(USUARIOS)
+        time.sleep(0.4)  # a parou de bater e renovar
+        self.assertEqual(b.equilibrar(USUARIOS), set(USUARIOS))
+        a.renovar()  # a percebe que perdeu tudo
+        self.assertEqual(a._mantidas_agora(), set())
+
+    def test_saida_limpa_devolve_as_leases_na_hora(self):
+        a, b = self.worker("a"), self.worker("b")
+        a.equilibrar(USUARIOS)
+        b.equilibrar(USUARIOS)
+        a.equilibrar(USUARIOS)
+        b.equilibrar(USUARIOS)
+        a.encerrar()
+        self.assertEqual(b.equilibrar(USUARIOS), set(USUARIOS))
+        self.assertEqual([worker["id_worker"] for worker in b.status()], ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
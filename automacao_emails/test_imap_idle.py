@@ -0,0 +1,71 @@
+# test_imap_idle.py
+# IDLE sobre um par de sockets locais, sem servidor IMAP.
+# Executar com: python -m unittest discover -s automacao_emails
+
+import socket
+import threading
+import time
+import unittest
+
+import imap_idle
+
+
+class ConexaoFalsa:
+    """O mínimo do imaplib.IMAP4 que o aguardar_idle usa: sock, file bufferizado, readline, send e tags."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile('rb')
+
+    def _new_tag(self):
+        return b'A1'
+
+    def readline(self):
+        return self.file.readline()
+
+    def send(self, dados):
+        self.sock.sendall(dados)
+
+
+class TesteAguardarIdle(unittest.TestCase):
+    def setUp(self):
+        self.cliente, self.servidor = socket.socketpair()
+        self.arquivo_servidor = self.servidor.makefile('rb')
+        self.mail = ConexaoFalsa(self.cliente)
+        self.addCleanup(self.cliente.close)
+        self.addCleanup(self.servidor.close)
+        self.addCleanup(self.arquivo_servidor.close)
+
+    def _responder(self, *linhas_apos_idle):
+        """Responde ao IDLE com `linhas_apos_idle` num único envio e confirma o DONE."""
+        def servidor():
+            self.arquivo_servidor.readline()  # A1 IDLE
+            self.servidor.sendall(b''.join(linhas_apos_idle))
+            self.arquivo_servidor.readline()  # DONE
+            self.servidor.sendall(b'A1 OK IDLE terminated\r\n')
+        thread = threading.Thread(target=servidor, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+
+    def test_exists_no_mesmo_pacote_da_continuacao(self):
+        # "* 3 EXISTS" fica no buffer do arquivo junto com "+ idling"; não pode esperar o timeout
+        self._responder(b'+ idling\r\n* 3 EXISTS\r\n')
+        inicio = time.monotonic()
+        self.assertTrue(imap_idle.aguardar_idle(self.mail, 30))
+        self.assertLess(time.monotonic() - inicio, 1)
+
+    def test_timeout_sem_novidade_deixa_conexao_utilizavel(self):
+        self._responder(b'+ idling\r\n')
+        self.mail.sock.settimeout(7)
+        self.assertFalse(imap_idle.aguardar_idle(self.mail, 0.2))
+        self.assertEqual(self.mail.sock.gettimeout(), 7)  # timeout original restaurado
+
+    def test_interromper(self):
+        self._responder(b'+ idling\r\n')
+        parar = threading.Event()
+        parar.set()
+        self.assertFalse(imap_idle.aguardar_idle(self.mail, 30, interromper=parar))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# test_mime_stream.py
+# Varredura MIME sem o pacote email: multipart aninhado, anexos, quebras CRLF/LF e limite de tamanho.
+# Executar com: python -m unittest discover -s automacao_emails
+
+import base64
+import unittest
+
+import mime_stream
+
+HTML = "<html><body><p>Total R$ 23,40</p>" + "<p>Obrigado por viajar com a gente.</p>" * 3 + "</body></html>"
+
+
+def mensagem(quebra=b'\r\n'):
+    """multipart/mixed com um multipart/alternative (texto QP + HTML base64) e um PDF anexado."""
+    linhas = [
+        b'From: Uber Receipts <noreply@uber.com>',
+        b'Subject: Recibo da viagem',
+        b'Message-ID: <abc@uber.com>',
+        b'MIME-Version: 1.0',
+        b'Content-Type: multipart/mixed; boundary="mix"',
+        b'',
+        b'--mix',
+        b'Content-Type: multipart/alternative; boundary="alt"',
+        b'',
+        b'--alt',
+        b'Content-Type: text/plain; charset="iso-8859-1"',
+        b'Content-Transfer-Encoding: quoted-printable',
+        b'',
+        b'Cart=E3o final 1234',
+        b'--alt',
+        b'Content-Type: text/html; charset="utf-8"',
+        b'Content-Transfer-Encoding: base64',
+        b'',
+        base64.b64encode(HTML.encode('utf-8')),
+        b'--alt--',
+        b'--mix',
+        b'Content-Type: application/pdf; name="recibo.pdf"',
+        b'Content-Disposition: attachment; filename="recibo.pdf"',
+        b'Content-Transfer-Encoding: base64',
+        b'',
+        b'JVBERi0xLjQK',
+        b'--mix--',
+        b'',
+    ]
+    return quebra.join(linhas)
+
+
+class TesteParseMensagemStream(unittest.TestCase):
+    def test_html_dentro_de_alternative_aninhado(self):
+        for quebra in (b'\r\n', b'\n'):
+            with self.subTest(quebra=quebra):
+                cabecalhos, conteudo, tipo = mime_stream.parse_mensagem_stream(mensagem(quebra))
+                self.assertEqual(tipo, "html")
+                self.assertEqual(conteudo.strip(), HTML)
+                self.assertEqual(cabecalhos["Message-ID"], "<abc@uber.com>")
+
+    def test_texto_quando_html_e_curto(self):
+        dados = mensagem().replace(base64.b64encode(HTML.encode('utf-8')), base64.b64encode(b'<p>oi</p>'))
+        _, conteudo, tipo = mime_stream.parse_mensagem_stream(dados)
+        self.assertEqual((tipo, conteudo.strip()), ("text", "Cartão final 1234"))
+
+    def test_parte_acima_do_limite_e_ignorada(self):
+        with self.assertLogs("mime_stream", "WARNING"):
+            _, conteudo, tipo = mime_stream.parse_mensagem_stream(mensagem(), max_bytes_corpo=30)
+        self.assertEqual((tipo, conteudo.strip()), ("text", "Cartão final 1234"))  # só o texto QP cabe
+
+    def test_mensagem_simples_sem_multipart(self):
+        dados = b'From: a@99app.com\nContent-Type: text/plain; charset=utf-8\n\nValor R$ 9,90\n'
+        _, conteudo, tipo = mime_stream.parse_mensagem_stream(dados)
+        self.assertEqual((tipo, conteudo), ("text", "Valor R$ 9,90\n"))
+
+
+class TesteVarredura(unittest.TestCase):
+    def test_anexo_nunca_e_decodificado(self):
+        # O único HTML da mensagem está anexado; a parte inline vira imagem
+        dados = mensagem().replace(b'text/html; charset="utf-8"', b'image/png').replace(b'application/pdf', b'text/html')
+        varredura = mime_stream._Varredura(dados, None)
+        varredura.varrer(0, len(dados))
+        self.assertIsNone(varredura.corpo_html)
+        self.assertEqual(varredura.corpo_texto.strip(), "Cartão final 1234")
+
+    def test_para_na_primeira_parte_html_aceitavel(self):
+        segundo = b'\r\n--mix\r\nContent-Type: text/html\r\n\r\n<p>outro</p>\r\n--mix--'
+        dados = mensagem().replace(b'\r\n--mix--', segundo, 1)
+        varredura = mime_stream._Varredura(dados, None)
+        varredura.varrer(0, len(dados))
+        self.assertTrue(varredura.concluida())
+        self.assertEqual(varredura.corpo_html.strip(), HTML)
+
+    def test_profundidade_maxima(self):
+        partes = [b'Content-Type: multipart/mixed; boundary="b%dx"\n\n--b%dx\n' % (i, i) for i in range(mime_stream.MAX_PROFUNDIDADE + 2)]
+        dados = b''.join(partes) + b'Content-Type: text/plain\n\nfundo demais\n'
+        varredura = mime_stream._Varredura(dados, None)
+        varredura.varrer(0, len(dados))
+        self.assertIsNone(varredura.corpo_texto)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+# test_outbox.py
+# Outbox das corridas num SQLite temporário: estados, backoff, reserva entre leitores e resolução de IDs no envio.
+# Executar com: python -m unittest discover -s automacao_emails
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+os.environ.setdefault("IMAP_ENCRYPTION_KEY", "00" * 32)  # só para a importação não reclamar da chave ausente
+import email_automation
+from outbox import Outbox, gerar_chave_idempotencia
+
+CORRIDA = {"data": "2024-05-10", "valor": 23.4, "cartao": "1234", "remetente": "noreply@uber.com", "descricao_fp": "Visa", "id_usuario": 1}
+
+
+class BaseOutbox(unittest.TestCase):
+    def setUp(self):
+        diretorio = tempfile.TemporaryDirectory(prefix="outbox_")
+        self.addCleanup(diretorio.cleanup)
+        self.arquivo = os.path.join(diretorio.name, "outbox.db")
+        self.outbox = self.abrir()
+
+    def abrir(self):
+        outbox = Outbox(self.arquivo, backoff_base_segundos=30)
+        self.addCleanup(outbox.fechar)
+        return outbox
+
+    def linha(self, chave):
+        return self.outbox._conexao.execute("SELECT estado, tentativas, proxima_tentativa, ultimo_erro FROM outbox WHERE chave_idempotencia = ?",
+                                            (chave,)).fetchone()
+
+
+class TesteOutbox(BaseOutbox):
+    def test_chave_estavel_por_message_id(self):
+        self.assertEqual(gerar_chave_idempotencia(1, " <a@uber.com> ", CORRIDA), gerar_chave_idempotencia(1, "<a@uber.com>", {"outro": 1}))
+        self.assertNotEqual(gerar_chave_idempotencia(1, "<a@uber.com>", CORRIDA), gerar_chave_idempotencia(2, "<a@uber.com>", CORRIDA))
+
+    def test_registrar_recusa_chave_confirmada_ou_rejeitada(self):
+        self.assertTrue(self.outbox.registrar("a", CORRIDA))
+        self.assertTrue(self.outbox.registrar("a", CORRIDA))  # ainda pendente: reprocessar o e-mail não duplica a linha
+        self.outbox.confirmar(["a"])
+        self.assertFalse(self.outbox.registrar("a", CORRIDA))
+        self.outbox.registrar("b", CORRIDA)
+        self.outbox.rejeitar(["b"], "400")
+        self.assertFalse(self.outbox.registrar("b", CORRIDA))
+        self.assertEqual(self.outbox.contar_pendentes(), 0)
+
+    def test_falha_adia_a_proxima_tentativa(self):
+        self.outbox.registrar("a", CORRIDA)
+        self.assertEqual([chave for chave, _ in self.outbox.pendentes_prontos(10)], ["a"])
+        antes = time.time()
+        self.outbox.registrar_falha(["a"], "API fora")
+        estado, tentativas, proxima, erro = self.linha("a")
+        self.assertEqual((estado, tentativas, erro), ("pendente", 1, "API fora"))
+        self.assertGreaterEqual(proxima, antes + 30 * 0.8)
+        self.outbox.registrar_falha(["a"])
+        self.assertGreaterEqual(self.linha("a")[2], antes + 60 * 0.8)  # backoff exponencial
+        self.assertEqual(self.outbox.pendentes_prontos(10), [])
+        self.outbox.confirmar(["a"])
+        self.assertEqual(self.linha("a")[0], "confirmado")
+        self.outbox.registrar_falha(["a"])  # confirmada não volta a ser pendente
+        self.assertEqual(self.linha("a")[:2], ("confirmado", 2))
+
+    def test_rejeitada_sai_da_fila(self):
+        self.outbox.registrar("a", CORRIDA)
+        self.outbox.rejeitar(["a"], "recusada pela API (4xx)")
+        self.assertEqual(self.linha("a")[0], "rejeitado")
+        self.assertEqual(self.outbox.pendentes_prontos(10), [])
+        self.assertEqual(self.outbox.contar_pendentes(), 0)
+
+    def test_reserva_esconde_itens_de_outro_leitor(self):
+        for chave in ("a", "b", "c"):
+            self.outbox.registrar(chave, dict(CORRIDA, chave_idempotencia=chave))
+        outro = self.abrir()  # outro worker no mesmo arquivo
+        primeiros = self.outbox.pendentes_prontos(2, reserva_segundos=300)
+        restantes = outro.pendentes_prontos(10, reserva_segundos=300)
+        self.assertEqual(len(primeiros), 2)
+        self.assertEqual({chave for chave, _ in primeiros} | {chave for chave, _ in restantes}, {"a", "b", "c"})
+        self.assertFalse({chave for chave, _ in primeiros} & {chave for chave, _ in restantes})
+        self.assertEqual(self.outbox.pendentes_prontos(10), [])
+        self.assertEqual(primeiros[0][1]["remetente"], "noreply@uber.com")
+
+
+class TesteEnvioDoOutbox(BaseOutbox):
+    def setUp(self):
+        super().setUp()
+        self.outbox.registrar("a", dict(CORRIDA, chave_idempotencia="a"))
+        patcher = mock.patch.object(email_automation, "_outbox", self.outbox)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sem_ids_a_corrida_fica_pendente(self):
+        with mock.patch.object(email_automation, "obter_ou_criar_id_via_api", return_value=None), \
+             mock.patch.object(email_automation, "enviar_lote_corridas_para_api", return_value=[]) as enviar, \
+             self.assertLogs("email_automation", "WARNING"):
+            self.assertIsNone(email_automation.completar_ids_corrida(CORRIDA))
+            self.assertEqual(email_automation.enviar_corridas_do_outbox(self.outbox.pendentes_prontos(10)), 0)
+        enviar.assert_called_once_with([])
+        estado, tentativas, _, erro = self.linha("a")
+        self.assertEqual((estado, tentativas), ("pendente", 1))
+        self.assertIn("IDs", erro)
+
+    def test_ids_resolvidos_no_envio(self):
+        ids = {"id_apps": 7, "id_forma_pagamento": 3}
+        with mock.patch.object(email_automation, "obter_ou_criar_id_via_api", side_effect=lambda *a, campo_id_resposta, **k: ids[campo_id_resposta]), \
+             mock.patch.object(email_automation, "enviar_lote_corridas_para_api", return_value=[email_automation.ENVIO_ACEITA]) as enviar:
+            self.assertEqual(email_automation.enviar_corridas_do_outbox(self.outbox.pendentes_prontos(10)), 1)
+        enviado = enviar.call_args[0][0][0]
+        self.assertEqual((enviado["id_apps"], enviado["id_forma_pagamento"], enviado["chave_idempotencia"]), (7, 3, "a"))
+        self.assertNotIn("remetente", enviado)
+        self.assertEqual(self.linha("a")[0], "confirmado")
+
+    def test_rejeitada_pela_api(self):
+        corrida_resolvida = dict(CORRIDA, id_apps=7, id_forma_pagamento=3)  # formato de versões anteriores
+        self.outbox.registrar("b", corrida_resolvida)
+        self.outbox.confirmar(["a"])
+        with mock.patch.object(email_automation, "enviar_lote_corridas_para_api", return_value=[email_automation.ENVIO_REJEITADA]), \
+             self.assertLogs("email_automation", "ERROR"):
+            self.assertEqual(email_automation.enviar_corridas_do_outbox(self.outbox.pendentes_prontos(10)), 0)
+        self.assertEqual(self.linha("b")[0], "rejeitado")
+
+
+if __name__ == "__main__":
+    unittest.main()
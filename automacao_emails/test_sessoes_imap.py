@@ -0,0 +1,80 @@
+# test_sessoes_imap.py
+# Reaproveitamento de sessões e limite de conexões abertas, com conexões falsas (sem servidor IMAP).
+# Executar com: python -m unittest discover -s automacao_emails
+
+import threading
+import time
+import unittest
+
+from sessoes_imap import GerenciadorSessoesIMAP
+
+
+class ConexaoFalsa:
+    def __init__(self, login):
+        self.login = login
+        self.untagged_responses = {}
+        self.encerrada = False
+
+    def noop(self):
+        return 'OK', [b'NOOP completed']
+
+    def logout(self):
+        self.encerrada = True
+
+
+class TesteGerenciadorSessoes(unittest.TestCase):
+    def setUp(self):
+        self.abertas = []
+
+    def conectar(self, id_usuario):
+        mail = ConexaoFalsa(f"usuario{id_usuario}")
+        self.abertas.append(mail)
+        return mail, mail.login
+
+    def abertas_agora(self):
+        return sum(1 for mail in self.abertas if not mail.encerrada)
+
+    def test_reaproveita_a_sessao_do_usuario(self):
+        gerenciador = GerenciadorSessoesIMAP(self.conectar)
+        with gerenciador.sessao(1) as primeira: pass
+        with gerenciador.sessao(1) as segunda: pass
+        self.assertIs(primeira, segunda)
+        self.assertEqual(len(self.abertas), 1)
+
+    def test_limite_encerra_a_ociosa_menos_recente(self):
+        gerenciador = GerenciadorSessoesIMAP(self.conectar, max_sessoes=2)
+        for id_usuario in (1, 2, 1, 3):  # o usuário 2 é o menos recente quando o 3 chega
+            with gerenciador.sessao(id_usuario): pass
+        self.assertEqual(len(gerenciador), 2)
+        self.assertEqual(self.abertas_agora(), 2)
+        self.assertEqual([mail.login for mail in self.abertas if mail.encerrada], ["usuario2"])
+
+    def test_limite_espera_sessao_em_uso_ser_devolvida(self):
+        gerenciador = GerenciadorSessoesIMAP(self.conectar, max_sessoes=1)
+        em_uso, liberar = threading.Event(), threading.Event()
+
+        def usar_por_um_tempo():
+            with gerenciador.sessao(1):
+                em_uso.set()
+                liberar.wait(5)
+        thread = threading.Thread(target=usar_por_um_tempo)
+        thread.start()
+        em_uso.wait(5)
+        threading.Timer(0.2, liberar.set).start()
+        inicio = time.monotonic()
+        with gerenciador.sessao(2):
+            self.assertGreaterEqual(time.monotonic() - inicio, 0.15)
+            self.assertEqual(self.abertas_agora(), 1)
+        thread.join(5)
+
+    def test_erro_de_rede_descarta_a_sessao(self):
+        gerenciador = GerenciadorSessoesIMAP(self.conectar)
+        with self.assertRaises(OSError):
+            with gerenciador.sessao(1):
+                raise OSError("conexão caiu")
+        self.assertEqual(len(gerenciador), 0)
+        self.assertTrue(self.abertas[0].encerrada)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,13 +9,21 @@ const Usuarios = db.Usuarios;
 
 const CriarCorrida = async (req, res) => {
     try {
-        const { data, valor, cartao, id_forma_pagamento, id_apps, id_usuario } = req.body;
+        const { data, valor, cartao, id_forma_pagamento, id_apps, id_usuario, chave_idempotencia } = req.body;
 
         if (!data || !valor || !id_apps) {
             return res.status(400).json({ message: 'Data, valor, pagamentos e id_apps são obrigatórios' });
         }
 
-        const corrida = await Corridas.create({ data, valor, cartao, id_apps, id_forma_pagamento, id_usuario });
+        // Reenvio de uma corrida já registrada: devolve a existente em vez de duplicar
+        if (chave_idempotencia) {
+            const existente = await Corridas.findOne({ where: { chave_idempotencia } });
+            if (existente) {
+                return res.status(200).json({ message: 'Corrida já registrada', corrida: existente });
+            }
+        }
+
+        const corrida = await Corridas.create({ data, valor, cartao, id_apps, id_forma_pagamento, id_usuario, chave_idempotencia });
         return res.status(201).json({ message: 'Corrida registrada com sucesso', corrida });
 
     } catch (error) {
@@ -24,6 +32,46 @@ const CriarCorrida = async (req, res) => {
     }
 };
 
+// Registra várias corridas numa única requisição (usado pela automação de e-mails)
+const CriarCorridasEmLote = async (req, res) => {
+    try {
+        const { corridas } = req.body;
+
+        if (!Array.isArray(corridas) || corridas.length === 0) {
+            return res.status(400).json({ message: 'O campo corridas deve ser uma lista não vazia' });
+        }
+
+        const invalidas = corridas
+            .map((corrida, indice) => ({ corrida, indice }))
+            .filter(({ corrida }) => !corrida || !corrida.data || !corrida.valor || !corrida.id_apps)
+            .map(({ indice }) => indice);
+        if (invalidas.length > 0) {
+            return res.status(400).json({ message: 'Data, valor, pagamentos e id_apps são obrigatórios', indices_invalidos: invalidas });
+        }
+
+        // Ignora corridas cuja chave de idempotência já existe (reenvios) ou se repete dentro do próprio lote
+        const chaves = corridas.map((corrida) => corrida.chave_idempotencia).filter(Boolean);
+        const existentes = chaves.length > 0
+            ? await Corridas.findAll({ where: { chave_idempotencia: { [Op.in]: chaves } }, attributes: ['chave_idempotencia'] })
+            : [];
+        const chavesVistas = new Set(existentes.map((corrida) => corrida.chave_idempotencia));
+        const registros = [];
+        for (const { data, valor, cartao, id_forma_pagamento, id_apps, id_usuario, chave_idempotencia } of corridas) {
+            if (chave_idempotencia) {
+                if (chavesVistas.has(chave_idempotencia)) continue;
+                chavesVistas.add(chave_idempotencia);
+            }
+            registros.push({ data, valor, cartao, id_apps, id_forma_pagamento, id_usuario, chave_idempotencia });
+        }
+
+        const criadas = await sequelize.transaction(async (transaction) => Corridas.bulkCreate(registros, { transaction }));
+        return res.status(201).json({ message: 'Corridas registradas com sucesso', quantidade: criadas.length, ignoradas: corridas.length - criadas.length });
+
+    } catch (error) {
+        console.error('Erro ao registrar corridas em lote:', error);
+        return res.status(500).json({ message: 'Erro ao registrar corridas em lote', error });
+    }
+};
 
 const ListarCorridas = async (req, res) => {
     try {
@@ -157,6 +205,7 @@ const DeletarCorrida = async (req, res) => {
 
 module.exports = {
     CriarCorrida,
+    CriarCorridasEmLote,
     ListarCorridas,
     DeletarCorrida
 };
@@ -25,6 +25,14 @@ const Corridas = sequelize.define('Corridas', {
         type: DataTypes.STRING(4),
         allowNull: true,
         defaultValue: '0000'
+    },
+    // Chave enviada pela automação de e-mails (derivada do Message-ID) para que reenvios não dupliquem corridas.
+    // Em bases já existentes, o sequelize.sync() não cria a coluna; execute uma vez:
+    // ALTER TABLE Corridas ADD COLUMN chave_idempotencia VARCHAR(64) NULL UNIQUE;
+    chave_idempotencia: {
+        type: DataTypes.STRING(64),
+        allowNull: true,
+        unique: true
     }
 }, {
     timestamps: false,
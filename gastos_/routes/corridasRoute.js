@@ -1,10 +1,13 @@
 const express = require('express');
 const router = express.Router();
-const { CriarCorrida, ListarCorridas } = require('../controllers/corridasController');
+const { CriarCorrida, CriarCorridasEmLote, ListarCorridas } = require('../controllers/corridasController');
  
 // Rota para criar uma nova corrida
 router.post('/corridas', CriarCorrida);
 
+// Rota para criar várias corridas de uma vez
+router.post('/corridas/lote', CriarCorridasEmLote);
+
 // Rota para listar corridas por id
 router.get('/corridas', ListarCorridas);
 